@@ -0,0 +1,128 @@
+import math
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from job_queue import INTERACTIVE, BATCH, PRIORITIES
+
+logger = logging.getLogger(__name__)
+
+# Retry-After bounds in seconds, and the run time assumed before any job has finished
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 300
+DEFAULT_RUN_SECONDS = 10.0
+
+
+class Overloaded(Exception):
+    """
+    Raised when an upload is not admitted; carries the HTTP status and Retry-After to respond with
+    """
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the backlog of analysis jobs so a burst of uploads is turned away
+    up front instead of making every queued video wait longer.
+
+    The number of analyses running at once is capped by the job queue's
+    workers; this caps how many may wait behind them. Uploads are checked
+    before their body is read, and each admitted upload holds a reservation
+    until its job is queued, so concurrent uploads can't overshoot the
+    limit while they stream in. Interactive uploads may fill the whole
+    queue, batch uploads only their own share of it, which keeps headroom
+    for interactive users while batch work is queued.
+    """
+    def __init__(self, job_queue, max_queued: int, max_queued_batch: Optional[int] = None):
+        """
+        Initialize the admission controller
+
+        Args:
+            job_queue: JobQueue the admitted uploads are submitted to
+            max_queued: Most jobs waiting to run; uploads beyond it get 503
+            max_queued_batch: Most batch jobs waiting to run; batch uploads
+                beyond it get 429 (defaults to half of max_queued)
+        """
+        self.job_queue = job_queue
+        self.max_queued = max_queued
+        self.max_queued_batch = max_queued_batch if max_queued_batch is not None else max(1, max_queued // 2)
+
+        self._lock = threading.Lock()
+        self._pending = {name: 0 for name in PRIORITIES}
+        self.admitted = {name: 0 for name in PRIORITIES}
+        self.rejected = {name: 0 for name in PRIORITIES}
+
+    def reserve(self, priority: str = INTERACTIVE, count: int = 1):
+        """
+        Admit an upload, or raise Overloaded. Call release once its job is
+        queued (or the upload failed).
+
+        Args:
+            priority: Priority class of the upload, INTERACTIVE or BATCH
+            count: Number of jobs the upload will queue (e.g. the videos of a
+                batch upload); all of them must fit
+
+        Raises:
+            Overloaded: 503 if the queue is full, 429 if the batch share is full
+        """
+        load = self.job_queue.load()
+        with self._lock:
+            queued = sum(load["queued"].values()) + sum(self._pending.values())
+            queued_batch = load["queued"][BATCH] + self._pending[BATCH]
+            if queued + count > self.max_queued:
+                status_code, detail = 503, f"Analysis queue is full ({queued} jobs waiting)"
+                ahead = queued + count - self.max_queued
+            elif priority == BATCH and queued_batch + count > self.max_queued_batch:
+                status_code, detail = 429, f"Batch queue limit reached ({queued_batch} batch jobs waiting)"
+                # Batch jobs only start once no interactive job is waiting, so every queued job is ahead
+                ahead = queued + count - self.max_queued_batch
+            else:
+                self._pending[priority] += count
+                self.admitted[priority] += count
+                return
+            self.rejected[priority] += 1
+
+        retry_after = self._retry_after(load, ahead)
+        logger.warning(f"Rejected {priority} upload with {status_code}: {detail} (retry after {retry_after}s)")
+        raise Overloaded(status_code, detail, retry_after)
+
+    def release(self, priority: str = INTERACTIVE, count: int = 1):
+        """
+        Release the reservation of an admitted upload
+        """
+        with self._lock:
+            self._pending[priority] -= count
+
+    def _retry_after(self, load: Dict[str, Any], ahead: int) -> int:
+        """Estimate the seconds until the workers have started enough jobs to make room"""
+        run_seconds = load["mean_run_seconds"] or DEFAULT_RUN_SECONDS
+        workers = max(1, self.job_queue.workers)
+        estimate = math.ceil(ahead * run_seconds / workers)
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, estimate))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the current concurrency and queue depth (for autoscaling), the
+        limits, and admission counters (counters are per process)
+        """
+        load = self.job_queue.load()
+        with self._lock:
+            pending = dict(self._pending)
+        queued = sum(load["queued"].values())
+        return {
+            "running": load["running"],
+            "workers": self.job_queue.workers,
+            "queued": queued,
+            "queued_by_priority": load["queued"],
+            "uploading": pending,
+            "max_queued": self.max_queued,
+            "max_queued_batch": self.max_queued_batch,
+            "utilization": (load["running"] + queued) / (self.job_queue.workers + self.max_queued),
+            "mean_run_seconds": load["mean_run_seconds"],
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected)
+        }
@@ -0,0 +1,270 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Callable, Optional, Tuple
+
+import numpy as np
+
+from metrics import metrics
+from profiling import Trace, activate, current_trace
+from process_memory import memory_tracker
+from result_cache import FingerprintMatcher, ResultCache
+from video_fingerprint import NearDuplicate
+
+logger = logging.getLogger(__name__)
+
+# State of an analysis worker process, set up by _init_worker
+_analyzer = None
+_progress_queue = None
+_result_cache = None
+
+
+def _init_worker(backend: str, options: Dict[str, Any], progress_queue, ready_counter, memory: Dict[str, Any],
+                 result_cache: Optional[Dict[str, Any]]):
+    """Build the analyzer (loading the model) once per worker process"""
+    global _analyzer, _progress_queue, _result_cache
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from analyzers import create_analyzer
+
+    memory_tracker.configure(**memory)
+
+    started = time.perf_counter()
+    _analyzer = create_analyzer(backend, options)
+    _progress_queue = progress_queue
+    if result_cache is not None:
+        _result_cache = ResultCache(legacy_json=None, **result_cache)
+    with ready_counter.get_lock():
+        ready_counter.value += 1
+    logger.info(f"Analysis worker {os.getpid()} ready in {time.perf_counter() - started:.1f}s")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _run(trace_context: Optional[Tuple[str, bool, float]], fn: Callable, *args):
+    """
+    Run a task, returning its result with the metrics and memory records
+    added since the last task and, for a traced request, the task's part
+    of the trace
+    """
+    if trace_context is None:
+        return fn(*args), metrics.drain(), memory_tracker.drain(), None
+    trace = Trace(*trace_context)
+    with activate(trace):
+        result = fn(*args)
+    return result, metrics.drain(), memory_tracker.drain(), trace.export()
+
+
+def _analyze(video_path: str, video_hash: Optional[str], model_version: Optional[str],
+             task_id: Optional[int], near_duplicates: Optional[Tuple[str, float]],
+             wants_partials: Optional[Callable[[], bool]]) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    loaded_model = _analyzer.model_for_version(model_version)
+    progress = None
+    if task_id is not None:
+        progress = lambda fraction, stage, partial=None: _progress_queue.put((task_id, fraction, stage, partial))
+        if wants_partials is not None:
+            progress.wants_partials = wants_partials
+    matcher = None
+    if near_duplicates is not None and _result_cache is not None:
+        matcher = FingerprintMatcher(_result_cache, near_duplicates[1], near_duplicates[0])
+    with memory_tracker.request(video_hash or os.path.basename(video_path)):
+        result = _analyzer.analyze_video(video_path, video_hash, progress, loaded_model, matcher)
+    return result, matcher.fingerprint if matcher is not None else None
+
+
+class AnalysisPool:
+    """
+    Pool of worker processes running the CPU-bound analysis (decoding, face
+    detection, fingerprinting and inference), so it neither blocks the
+    server's event loop nor competes with request handling for the GIL.
+
+    Every worker builds its own analyzer when it starts, so the model is
+    loaded once per process rather than per video. Workers follow the
+    server's model version: each call names the version to analyze with,
+    and a worker still on another version loads it first.
+    """
+    def __init__(self, processes: int, backend: str, options: Optional[Dict[str, Any]] = None,
+                 memory: Optional[Dict[str, Any]] = None, result_cache: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the pool (workers start in the background, see warm_up)
+
+        Args:
+            processes: Number of worker processes
+            backend: ANALYZER_BACKEND of the workers' analyzer
+            options: Keyword arguments of the workers' analyzer
+            memory: Keyword arguments of the workers' MemoryTracker.configure
+            result_cache: Keyword arguments (cache_dir, db_name) of the ResultCache the
+                workers look near-duplicates up in (None disables the lookups)
+        """
+        self.processes = processes
+        self.backend = backend
+        self.options = options or {}
+        self.memory = memory or {"enabled": False}
+        self.result_cache = result_cache
+
+        # Workers are spawned rather than forked: the server process has
+        # threads (and possibly torch state) that don't survive a fork
+        self._context = multiprocessing.get_context("spawn")
+        self._progress_queue = self._context.Queue()
+        # Number of worker processes that have loaded their analyzer
+        self._ready = self._context.Value("i", 0)
+        self._callbacks = {}
+        self._next_task_id = 0
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.active = 0
+
+        self._progress_thread = threading.Thread(target=self._forward_progress, daemon=True)
+        self._progress_thread.start()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self.backend, self.options, self._progress_queue, self._ready, self.memory, self.result_cache)
+        )
+
+    def warm_up(self):
+        """
+        Start every worker process (and load its model) in the background,
+        so the first uploads don't pay for it
+        """
+        def ping_all():
+            try:
+                started = time.perf_counter()
+                futures = [self._executor.submit(_ping) for _ in range(self.processes)]
+                for future in futures:
+                    future.result()
+                logger.info(f"Analysis pool warmed up: {self._ready.value} worker processes in "
+                            f"{time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                logger.error(f"Could not start analysis workers: {str(e)}")
+
+        threading.Thread(target=ping_all, daemon=True).start()
+
+    def _call(self, fn: Callable, *args):
+        """Run a function in a worker and wait for its result, replacing the executor if a worker died"""
+        executor = self._executor
+        with self._lock:
+            self.active += 1
+        try:
+            trace = current_trace()
+            result, recorded, requests, traced = executor.submit(
+                _run, trace.context() if trace else None, fn, *args
+            ).result()
+            # The stages timed in the worker count towards this process's metrics (and trace),
+            # and its analyses towards the memory report
+            metrics.merge(recorded)
+            memory_tracker.merge(requests)
+            if traced is not None:
+                trace.merge(traced)
+            with self._lock:
+                self.completed += 1
+            return result
+        except NearDuplicate:
+            # The analysis stopped early because its result is already known
+            with self._lock:
+                self.completed += 1
+            raise
+        except BrokenProcessPool:
+            with self._lock:
+                self.failed += 1
+                # Only the first caller to notice replaces the executor
+                if self._executor is executor:
+                    logger.error("An analysis worker process died; restarting the pool")
+                    self._executor = self._create_executor()
+                    self.restarts += 1
+                    self._ready.value = 0
+            executor.shutdown(wait=False)
+            raise RuntimeError("The analysis worker process died")
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def analyze(self, video_path: str, video_hash: Optional[str] = None, model_version: Optional[str] = None,
+                progress: Optional[Callable[..., None]] = None, near_duplicates: Optional[Tuple[str, float]] = None
+                ) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+        """
+        Analyze a video in a worker process (blocks the calling thread until done)
+
+        Args:
+            video_path: Path to the video
+            video_hash: SHA-256 of the video, for the stage cache
+            model_version: Model version to analyze with (None for the worker's current one)
+            progress: Optional progress(fraction, stage, partial=None) callback, called from a pool
+                thread; its wants_partials(), if any, must be picklable (e.g. a SubscriberCheck)
+            near_duplicates: Optional (scope, max distance) to match the video's fingerprint,
+                taken from the decoded frames, against the pool's result cache
+
+        Returns:
+            Tuple of (result of the analyzer's analyze_video, fingerprint of the
+            video or None if it wasn't matched)
+
+        Raises:
+            NearDuplicate: If the video is a near-duplicate of a cached one
+        """
+        task_id = None
+        if progress is not None:
+            with self._lock:
+                self._next_task_id += 1
+                task_id = self._next_task_id
+                self._callbacks[task_id] = progress
+        try:
+            return self._call(_analyze, video_path, video_hash, model_version, task_id, near_duplicates,
+                              getattr(progress, "wants_partials", None))
+        finally:
+            if task_id is not None:
+                with self._lock:
+                    self._callbacks.pop(task_id, None)
+
+    def _forward_progress(self):
+        """Pass progress reported by the workers on to the callers' callbacks"""
+        while True:
+            try:
+                message = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            task_id, fraction, stage, partial = message
+            with self._lock:
+                callback = self._callbacks.get(task_id)
+            if callback is not None:
+                try:
+                    if partial is None:
+                        callback(fraction, stage)
+                    else:
+                        callback(fraction, stage, partial)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {str(e)}")
+
+    def shutdown(self):
+        """
+        Stop the worker processes
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._progress_queue.put(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "ready": self._ready.value,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts
+        }
@@ -0,0 +1,279 @@
+import os
+import hashlib
+import logging
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from result_cache import cache_scope
+from video_fingerprint import FingerprintBuilder, compute_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Faces per provisional result published while a video is analyzed
+PARTIAL_WINDOW_FACES = 5
+
+
+# Simple implementation to use micro-expression dataset
+class MicroExpressionAnalyzer:
+    def __init__(self):
+        self.truth_dir = os.path.join("micro_expression_dataset", "truth")
+        self.lie_dir = os.path.join("micro_expression_dataset", "lie")
+
+        # Check if the dataset exists
+        self.dataset_loaded = (os.path.exists(self.truth_dir) and
+                              os.path.exists(self.lie_dir) and
+                              len(os.listdir(self.truth_dir)) > 0 and
+                              len(os.listdir(self.lie_dir)) > 0)
+
+        if self.dataset_loaded:
+            self.truth_count = len(os.listdir(self.truth_dir))
+            self.lie_count = len(os.listdir(self.lie_dir))
+            logger.info(f"Micro-expression dataset loaded: {self.truth_count} truth images, {self.lie_count} lie images")
+        else:
+            logger.warning("Micro-expression dataset not found or empty")
+
+    def analyze_video(self, video_path, video_hash=None, progress=None, loaded_model=None, on_fingerprint=None):
+        # Nothing else decodes the video here, so the fingerprint needs its own pass
+        if on_fingerprint is not None:
+            on_fingerprint(compute_fingerprint(video_path))
+
+        # This is a simplified version that doesn't actually analyze the video
+        # but simulates the result based on whether the dataset exists
+        if not self.dataset_loaded:
+            # Random result if dataset isn't loaded
+            is_truth = np.random.random() > 0.5
+        else:
+            # Deterministic but pseudo-random result based on the video path
+            # This ensures the same video will always get the same result
+            video_hash = hashlib.md5(video_path.encode()).hexdigest()
+            hash_value = int(video_hash[:8], 16)
+            is_truth = (hash_value % 100) > 50  # Deterministic outcome
+
+        confidence = 70.0 + np.random.random() * 25.0
+
+        # In a real implementation, we'd extract frames and compare with the dataset
+        return {
+            "prediction": "Truth" if is_truth else "Fake",
+            "confidence": confidence,
+            "features": {
+                "facialExpressions": 65 + np.random.random() * 25,
+                "voiceAnalysis": 60 + np.random.random() * 30,
+                "microGestures": 70 + np.random.random() * 20
+            },
+            "using_dataset": self.dataset_loaded
+        }
+
+    def model_version(self):
+        return None
+
+    def model_for_version(self, version):
+        return None
+
+    def cache_scope(self, model_version=None):
+        return cache_scope({"analyzer": "simple", "dataset_loaded": self.dataset_loaded})
+
+class FullPipelineAnalyzer:
+    """
+    Runs the real pipeline: VideoProcessor face extraction followed by
+    Predictor (CNN-LSTM model + micro-expression analysis)
+    """
+    def __init__(self, watch_interval: Optional[float] = None, embedding_spill_dir: Optional[str] = None,
+                 stage_cache_dir: Optional[str] = None, stage_cache_max_bytes: int = 0):
+        """
+        Initialize the pipeline and load the active model
+
+        Args:
+            watch_interval: Seconds between checks for newly trained models (None disables)
+            embedding_spill_dir: Directory to spill evicted CNN embeddings to (optional)
+            stage_cache_dir: Directory of the extracted face crop/audio feature cache (optional)
+            stage_cache_max_bytes: Disk budget of that cache
+        """
+        from video_processor import VideoProcessor
+        from predictor import Predictor
+        from stage_cache import StageCache
+
+        self.video_processor = VideoProcessor()
+        self.stage_cache = (StageCache(stage_cache_dir, stage_cache_max_bytes)
+                            if stage_cache_dir and stage_cache_max_bytes > 0 else None)
+        self.predictor = Predictor(watch_interval=watch_interval, embedding_spill_dir=embedding_spill_dir)
+        self.dataset_loaded = (self.predictor.micro_expr_analyzer is not None and
+                               self.predictor.micro_expr_analyzer.dataset_loaded)
+
+    def analyze_video(self, video_path, video_hash=None, progress=None, loaded_model=None, on_fingerprint=None):
+        """
+        Analyze a video
+
+        Args:
+            video_path: Path to the video
+            video_hash: SHA-256 of the video, for the stage cache
+            progress: Optional progress(fraction, stage, partial=None) callback
+            loaded_model: Model snapshot to predict with
+            on_fingerprint: Optional callback given the video's fingerprint (None if it
+                wasn't decoded) once its frames are, before the prediction; it may
+                raise (e.g. NearDuplicate) to stop the analysis
+
+        Returns:
+            Prediction result
+        """
+        fingerprint = FingerprintBuilder() if on_fingerprint is not None else None
+        processed_data = self.extract(video_path, video_hash, progress, loaded_model, fingerprint)
+        if fingerprint is not None:
+            on_fingerprint(fingerprint.fingerprint())
+        if processed_data is None:
+            raise ValueError("Could not process video (no faces detected)")
+        if progress is not None:
+            progress(0.9, "predicting")
+        return self.predictor.predict(processed_data, loaded_model)
+
+    def rescore(self, video_hash, video_path=None, loaded_model=None) -> Optional[Dict[str, Any]]:
+        """
+        Re-analyze a known video from its stage cache entry, or its file if
+        given (None if neither is available)
+        """
+        processed_data = self.extract(video_path, video_hash)
+        if processed_data is None:
+            return None
+        return self.predictor.predict(processed_data, loaded_model)
+
+    def extract(self, video_path, video_hash=None, progress=None, loaded_model=None, fingerprint=None):
+        """
+        Get the face crops and audio features of a video, from the stage cache if possible
+
+        With a progress callback, faces are also scored as they are extracted
+        and a provisional result is reported every PARTIAL_WINDOW_FACES faces,
+        as progress(fraction, stage, partial). The micro-expression scores are
+        kept for the final prediction, and the model's CNN embeddings are
+        reused through the embedding cache, so this adds little work. If the
+        callback has a wants_partials() that returns False, faces are only
+        scored once it returns True (e.g. a client subscribes).
+
+        Args:
+            video_path: Path to the video (None to only use the stage cache)
+            video_hash: SHA-256 of the video, needed for the stage cache
+            progress: Optional progress(fraction, stage, partial=None) callback
+            loaded_model: Model snapshot for the provisional results
+            fingerprint: Optional FingerprintBuilder fed with the decoded frames
+                (nothing is decoded on a stage cache hit)
+
+        Returns:
+            Output of VideoProcessor.process_video, or None if there is none
+        """
+        use_cache = self.stage_cache is not None and video_hash is not None
+        config = self.video_processor.config()
+        if use_cache:
+            processed_data = self.stage_cache.get(video_hash, config)
+            if processed_data is not None:
+                return processed_data
+
+        if video_path is None:
+            return None
+        frame_callback = fingerprint.add if fingerprint is not None else None
+        if progress is None:
+            processed_data = self.video_processor.process_video(video_path, frame_callback=frame_callback)
+        else:
+            processed_data = self._extract_with_progress(video_path, progress, loaded_model, frame_callback)
+        if processed_data is not None and use_cache:
+            self.stage_cache.put(video_hash, config, processed_data)
+        return processed_data
+
+    def _extract_with_progress(self, video_path, progress, loaded_model=None, frame_callback=None):
+        """Run process_video, reporting progress and provisional results"""
+        from predictor import SEQUENCE_LENGTH
+        from streaming_inference import RollingPrediction
+
+        # Face extraction is reported as 10-90% of the analysis
+        state = {"fraction": 0.1, "frames": 0}
+        # The model only sees the first SEQUENCE_LENGTH faces, so the provisional
+        # results stop running it there; audio is only extracted at the end
+        rolling = RollingPrediction(self.predictor, np.full(20, 0.5), PARTIAL_WINDOW_FACES, loaded_model,
+                                    model_frames=SEQUENCE_LENGTH, keep_frame_results=True)
+        wants_partials = getattr(progress, "wants_partials", None)
+        # Faces not scored yet, while nobody wants provisional results
+        pending = []
+        reported = {"faces": 0}
+
+        def on_progress(fraction):
+            state["frames"] += 1
+            state["fraction"] = 0.1 + 0.8 * fraction
+            progress(state["fraction"], "extracting_faces")
+
+        def on_face(face):
+            nonlocal rolling
+            if rolling is None:
+                return
+            pending.append(face)
+            if wants_partials is not None and not wants_partials():
+                return
+            try:
+                for pending_face in pending:
+                    rolling.push(pending_face)
+                pending.clear()
+                if rolling.faces - reported["faces"] >= PARTIAL_WINDOW_FACES:
+                    reported["faces"] = rolling.faces
+                    progress(state["fraction"], "extracting_faces", {
+                        "frames_processed": state["frames"],
+                        "faces": rolling.faces,
+                        "vote": dict(rolling.micro_counts),
+                        "segment": rolling.model_prediction,
+                        "prediction": rolling.prediction()
+                    })
+            except Exception as e:
+                # Provisional results are best effort; the analysis carries on without them
+                logger.warning(f"Provisional results disabled for {video_path}: {str(e)}")
+                rolling = None
+
+        processed_data = self.video_processor.process_video(video_path, progress_callback=on_progress, face_callback=on_face,
+                                                            frame_callback=frame_callback)
+        if (processed_data is not None and rolling is not None and
+                len(rolling.frame_results) == len(processed_data["face_frames"])):
+            processed_data["micro_expression_frames"] = rolling.frame_results
+        return processed_data
+
+    def model_version(self):
+        """
+        Version of the active model
+        """
+        return self.predictor.registry.current().version
+
+    def model_for_version(self, version):
+        """
+        Get the snapshot of a model version, loading it first if it isn't the
+        active one (e.g. in an analysis worker process following the server)
+        """
+        from model_registry import DUMMY_VERSION
+
+        registry = self.predictor.registry
+        current = registry.current()
+        if version is None or version == current.version or version == DUMMY_VERSION:
+            return current
+
+        logger.info(f"Switching to model version {version}")
+        registry.reload(version, wait=True)
+        current = registry.current()
+        if current.version != version:
+            raise RuntimeError(f"Could not load model version {version}: {registry.status()['last_reload_error']}")
+        return current
+
+    def cache_scope(self, model_version=None):
+        """
+        Cache scope of results produced with a model version (the active one by default)
+        """
+        return cache_scope({
+            "analyzer": "full",
+            "model_version": model_version or self.model_version(),
+            "video_processor": self.video_processor.config(),
+            "predictor": self.predictor.config()
+        })
+
+def create_analyzer(backend: str, options: Optional[Dict[str, Any]] = None):
+    """
+    Create the analyzer for an ANALYZER_BACKEND value
+
+    Args:
+        backend: "full" for FullPipelineAnalyzer, anything else for MicroExpressionAnalyzer
+        options: Keyword arguments for FullPipelineAnalyzer
+    """
+    if backend == "full":
+        return FullPipelineAnalyzer(**(options or {}))
+    return MicroExpressionAnalyzer()
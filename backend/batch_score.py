@@ -0,0 +1,385 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from sqlite_store import dumps
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v"}
+# Videos whose face crops are sent through the model together
+DEFAULT_BATCH_SIZE = 8
+# Seconds between throughput reports while scoring
+REPORT_INTERVAL = 30.0
+
+# State of a decode worker process, set up by _init_worker
+_video_processor = None
+_stage_cache = None
+_file_hashes = None
+
+
+def _init_worker(stage_cache_dir: Optional[str], stage_cache_max_bytes: int, file_hashes_path: str):
+    """Build the video processor once per worker process"""
+    global _video_processor, _stage_cache, _file_hashes
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from video_processor import VideoProcessor
+    from stage_cache import StageCache
+    from path_ingest import FileHashIndex
+
+    _video_processor = VideoProcessor()
+    _stage_cache = StageCache(stage_cache_dir, stage_cache_max_bytes) if stage_cache_dir and stage_cache_max_bytes > 0 else None
+    _file_hashes = FileHashIndex(file_hashes_path)
+
+
+def _hash_file(video_path: str) -> str:
+    """SHA-256 of a video (only read if it changed since it was last hashed)"""
+    return _file_hashes.hash(video_path)
+
+
+def _extract(video_path: str, video_hash: str) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray], float]:
+    """
+    Decode a video and extract its face crops and audio features (from the
+    stage cache if possible), fingerprinting the decoded frames
+
+    Returns:
+        Tuple of (output of VideoProcessor.process_video or None, fingerprint
+        or None if the video wasn't decoded, seconds taken)
+    """
+    from video_fingerprint import FingerprintBuilder
+
+    started = time.perf_counter()
+    config = _video_processor.config()
+    processed_data = _stage_cache.get(video_hash, config) if _stage_cache is not None else None
+    fingerprint = None
+    if processed_data is None:
+        builder = FingerprintBuilder()
+        processed_data = _video_processor.process_video(video_path, frame_callback=builder.add)
+        fingerprint = builder.fingerprint()
+        if processed_data is not None and _stage_cache is not None:
+            _stage_cache.put(video_hash, config, processed_data)
+    return processed_data, fingerprint, time.perf_counter() - started
+
+
+def find_videos(root: str) -> Iterator[str]:
+    """
+    Yield the video files under a directory (or the file itself), in a stable order
+    """
+    if os.path.isfile(root):
+        yield os.path.abspath(root)
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS:
+                yield os.path.abspath(os.path.join(dirpath, filename))
+
+
+def load_finished(output_path: str, retry_failed: bool = False) -> Set[Tuple[str, int, int]]:
+    """
+    Get the videos an earlier (possibly interrupted) run already scored
+
+    Args:
+        output_path: JSON Lines output of the earlier run
+        retry_failed: Score videos that failed before again
+
+    Returns:
+        Set of (path, size, mtime_ns); a video that changed since is scored again
+    """
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run may be cut off
+                continue
+            if retry_failed and record.get("status") == "failed":
+                continue
+            finished.add((record["path"], record["size"], record["mtime_ns"]))
+    return finished
+
+
+class BatchScorer:
+    """
+    Scores many videos in one run, writing a JSON Lines record per video.
+
+    Decoding and face detection, the expensive part, run in a pool of worker
+    processes; hashing runs there too, and unchanged videos hashed before (by
+    an earlier run or the server, see FileHashIndex) are not read again to
+    hash them. Videos with a result in the server's
+    result cache are not decoded at all. The face crops of the full backend
+    are scored in micro-batches (Predictor.predict_batch), one model forward
+    pass per batch of videos, and the results are stored in the result cache
+    for the API to serve, with the fingerprints of the decoded videos (so
+    the server matches re-encoded copies against them).
+
+    Every record is flushed as soon as it is written, so an interrupted run
+    continues where it stopped (see load_finished).
+    """
+    def __init__(self, analyzer, result_cache, output_path: str, file_hashes_path: str, processes: int = 1,
+                 batch_size: int = DEFAULT_BATCH_SIZE, stage_cache_dir: Optional[str] = None,
+                 stage_cache_max_bytes: int = 0):
+        """
+        Initialize the scorer
+
+        Args:
+            analyzer: Analyzer of the results (see analyzers.create_analyzer)
+            result_cache: ResultCache to look results up in and store them to
+            output_path: JSON Lines file the records are appended to
+            file_hashes_path: Database of the FileHashIndex of the videos
+            processes: Decode worker processes (0 decodes in this process)
+            batch_size: Videos per model batch
+            stage_cache_dir: Stage cache of the decode workers (optional)
+            stage_cache_max_bytes: Disk budget of the stage cache
+        """
+        from analyzers import FullPipelineAnalyzer
+
+        self.analyzer = analyzer
+        self.result_cache = result_cache
+        self.output_path = output_path
+        self.file_hashes_path = file_hashes_path
+        self.processes = processes
+        self.batch_size = max(1, batch_size)
+        self.stage_cache_dir = stage_cache_dir
+        self.stage_cache_max_bytes = stage_cache_max_bytes
+        # The simple analyzer doesn't decode videos, so only hashing uses the workers
+        self.decodes = isinstance(analyzer, FullPipelineAnalyzer)
+
+        self.stats = {"scored": 0, "cached": 0, "failed": 0, "skipped": 0, "bytes": 0,
+                      "batches": 0, "decode_seconds": 0.0, "predict_seconds": 0.0}
+        self._started = None
+        self._last_report = None
+        self._output = None
+
+    def run(self, paths: List[str], finished: Optional[Set[Tuple[str, int, int]]] = None) -> Dict[str, Any]:
+        """
+        Score videos, skipping the finished ones
+
+        Args:
+            paths: Video files
+            finished: (path, size, mtime_ns) of videos already scored (see load_finished)
+
+        Returns:
+            Throughput statistics of the run
+        """
+        finished = finished or set()
+        self._started = self._last_report = time.perf_counter()
+        model_version = self.analyzer.model_version()
+        loaded_model = self.analyzer.model_for_version(model_version)
+        scope = self.analyzer.cache_scope(model_version)
+
+        todo = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.warning(f"Skipping {path}: {str(e)}")
+                continue
+            video = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            if (path, stat.st_size, stat.st_mtime_ns) in finished:
+                self.stats["skipped"] += 1
+            else:
+                todo.append(video)
+        logger.info(f"Scoring {len(todo)} videos ({self.stats['skipped']} already scored) "
+                    f"with {self.processes} decode processes, batches of {self.batch_size}")
+
+        executor = None
+        if self.processes > 0:
+            executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                # Spawned like the server's analysis pool: torch state doesn't survive a fork
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.stage_cache_dir, self.stage_cache_max_bytes, self.file_hashes_path)
+            )
+        else:
+            _init_worker(self.stage_cache_dir, self.stage_cache_max_bytes, self.file_hashes_path)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        self._output = open(self.output_path, "a")
+        try:
+            self._score(todo, scope, model_version, loaded_model, executor)
+        finally:
+            self._output.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        return self.report(final=True)
+
+    def _score(self, todo, scope, model_version, loaded_model, executor):
+        """Hash, look up, decode and predict, keeping a bounded number of videos in flight"""
+        pending = {}
+        ready = []
+        queue = list(reversed(todo))
+        # Enough work to keep every worker busy while a batch is predicted
+        max_in_flight = max(1, self.processes) * 2 + self.batch_size
+
+        def submit(fn, *args):
+            if executor is not None:
+                return executor.submit(fn, *args)
+            # Run inline, wrapped in a finished future
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        while queue or pending or ready:
+            while queue and len(pending) + len(ready) < max_in_flight:
+                video = queue.pop()
+                pending[submit(_hash_file, video["path"])] = ("hash", video)
+
+            if pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, video = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        self._write(video, "failed", error=f"{stage}: {str(e)}")
+                        continue
+                    if stage == "hash":
+                        video["sha256"] = value
+                        result = self.result_cache.get_result(value, scope)
+                        if result is not None:
+                            self._write(video, "cached", result)
+                        elif self.decodes:
+                            pending[submit(_extract, video["path"], value)] = ("decode", video)
+                        else:
+                            ready.append((video, None, None))
+                    else:
+                        processed_data, fingerprint, seconds = value
+                        self.stats["decode_seconds"] += seconds
+                        if processed_data is None:
+                            self._write(video, "failed", error="Could not process video (no faces detected)")
+                        else:
+                            ready.append((video, processed_data, fingerprint))
+
+            # Predict once a batch is full, or with whatever is left at the end
+            if len(ready) >= self.batch_size or (ready and not queue and not pending):
+                batch, ready = ready[:self.batch_size], ready[self.batch_size:]
+                self._predict(batch, scope, loaded_model)
+
+            if time.perf_counter() - self._last_report >= REPORT_INTERVAL:
+                self.report()
+
+    def _predict(self, batch, scope, loaded_model):
+        """Score a batch of videos and store the results"""
+        started = time.perf_counter()
+        fingerprints = [fingerprint for _, _, fingerprint in batch]
+        try:
+            if self.decodes:
+                results = self.analyzer.predictor.predict_batch([processed_data for _, processed_data, _ in batch],
+                                                                loaded_model)
+            else:
+                results = []
+                for i, (video, _, _) in enumerate(batch):
+                    captured = []
+                    results.append(self.analyzer.analyze_video(video["path"], video["sha256"],
+                                                                on_fingerprint=captured.append))
+                    fingerprints[i] = captured[0]
+        except Exception as e:
+            logger.error(f"Error scoring batch of {len(batch)} videos: {str(e)}")
+            for video, _, _ in batch:
+                self._write(video, "failed", error=str(e))
+            return
+        self.stats["batches"] += 1
+        self.stats["predict_seconds"] += time.perf_counter() - started
+        for (video, _, _), result, fingerprint in zip(batch, results, fingerprints):
+            self.result_cache.store_result(video["sha256"], result, scope)
+            if fingerprint is not None:
+                self.result_cache.store_fingerprint(video["sha256"], fingerprint)
+            self._write(video, "scored", result)
+
+    def _write(self, video: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None):
+        """Append the record of a video to the output"""
+        record = dict(video, status=status, scored_at=datetime.now().isoformat())
+        if result is not None:
+            record["result"] = result
+        if error is not None:
+            record["error"] = error
+            logger.warning(f"Failed to score {video['path']}: {error}")
+        self._output.write(dumps(record) + "\n")
+        self._output.flush()
+        self.stats[status] += 1
+        if status != "failed":
+            self.stats["bytes"] += video["size"]
+
+    def report(self, final: bool = False) -> Dict[str, Any]:
+        """
+        Log and return the throughput so far
+        """
+        self._last_report = time.perf_counter()
+        elapsed = self._last_report - self._started
+        done = self.stats["scored"] + self.stats["cached"]
+        report = dict(
+            self.stats,
+            elapsed_seconds=round(elapsed, 1),
+            videos_per_second=round(done / elapsed, 2) if elapsed > 0 else 0.0,
+            mb_per_second=round(self.stats["bytes"] / (1024 * 1024) / elapsed, 1) if elapsed > 0 else 0.0,
+            mean_decode_seconds=(round(self.stats["decode_seconds"] / self.stats["scored"], 2)
+                                 if self.stats["scored"] else None),
+            mean_batch_seconds=(round(self.stats["predict_seconds"] / self.stats["batches"], 2)
+                                if self.stats["batches"] else None)
+        )
+        report["decode_seconds"] = round(report["decode_seconds"], 1)
+        report["predict_seconds"] = round(report["predict_seconds"], 1)
+        logger.info(f"{'Finished' if final else 'Progress'}: {self.stats['scored']} scored, "
+                    f"{self.stats['cached']} from cache, {self.stats['failed']} failed, "
+                    f"{self.stats['skipped']} skipped in {elapsed:.1f}s "
+                    f"({report['videos_per_second']} videos/s, {report['mb_per_second']} MB/s)")
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every video under a directory, writing JSON Lines")
+    parser.add_argument("root", type=str, help="Directory (searched recursively) or video file")
+    parser.add_argument("--output", type=str,
+                        help="JSON Lines file to append the results to; an interrupted run resumes from it "
+                             "(default batch_scores.jsonl in the cache directory)")
+    parser.add_argument("--backend", type=str, default=os.environ.get("ANALYZER_BACKEND", "full"),
+                        choices=["simple", "full"], help="Analyzer to score with")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Decode worker processes (0 decodes in this process)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Videos per model batch")
+    parser.add_argument("--cache-dir", type=str, default="cache",
+                        help="Directory of the result, stage and file hash caches shared with the server")
+    parser.add_argument("--retry-failed", action="store_true", help="Score videos that failed in an earlier run again")
+    parser.add_argument("--stats", type=str, help="Write the throughput statistics to this JSON file")
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = os.path.join(args.cache_dir, "batch_scores.jsonl")
+
+    from analyzers import create_analyzer
+    from result_cache import ResultCache
+
+    stage_cache_dir = os.path.join(args.cache_dir, "stages")
+    stage_cache_max_bytes = int(os.environ.get("STAGE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+    analyzer = create_analyzer(args.backend, {
+        "watch_interval": None,
+        "stage_cache_dir": stage_cache_dir,
+        "stage_cache_max_bytes": stage_cache_max_bytes
+    })
+    # Same database as the server's result cache
+    result_cache = ResultCache(args.cache_dir, db_name="simple_prediction_cache.db", legacy_json=None)
+
+    scorer = BatchScorer(analyzer, result_cache, args.output, os.path.join(args.cache_dir, "file_hashes.db"),
+                         args.processes, args.batch_size, stage_cache_dir, stage_cache_max_bytes)
+    stats = scorer.run(list(find_videos(args.root)), load_finished(args.output, args.retry_failed))
+    if args.stats:
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
@@ -0,0 +1,367 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+from synthetic_media import draw_face, make_video
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmark_baseline.json")
+# A benchmark whose median is this much slower than its baseline fails the run
+DEFAULT_THRESHOLD = 0.25
+# Clips of the end-to-end scenarios: (width, height, seconds)
+CLIPS = [(640, 480, 5), (1280, 720, 5), (640, 480, 20)]
+QUICK_CLIPS = [(640, 480, 3)]
+# Resolutions of the face detection benchmark
+DETECT_RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+QUICK_DETECT_RESOLUTIONS = [(640, 480)]
+# Side of the gallery images and face crops (MicroExpressionAnalyzer resizes to it)
+FACE_SIZE = 224
+
+
+def make_face_image(rng: np.random.Generator, size: int = FACE_SIZE, lie: bool = False) -> np.ndarray:
+    """
+    Draw a face crop with a random expression. Lie faces lean towards raised
+    brows and a tight mouth, so the two halves of a gallery differ.
+    """
+    image = np.full((size, size, 3), int(rng.integers(70, 110)), np.uint8)
+    brow_raise = rng.uniform(4, 14) if lie else rng.uniform(-4, 6)
+    mouth_open = rng.uniform(0.4, 1.0) if lie else rng.uniform(0.8, 2.0)
+    draw_face(image, (size // 2, size // 2), scale=size / 300, eye_open=rng.uniform(0.6, 1.4),
+              brow_raise=brow_raise, mouth_open=mouth_open)
+    # Sensor-like noise, so the texture features (LBP) have something to work on
+    noise = rng.normal(0, 6, image.shape)
+    image = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+
+def make_gallery(dataset_dir: str, size: int, seed: int = 0):
+    """
+    Write a synthetic micro-expression dataset (truth/ and lie/ images) in the
+    layout MicroExpressionAnalyzer loads
+    """
+    rng = np.random.default_rng(seed)
+    for label in ("truth", "lie"):
+        os.makedirs(os.path.join(dataset_dir, label), exist_ok=True)
+        for i in range(size):
+            cv2.imwrite(os.path.join(dataset_dir, label, f"{label}_{i:03d}.png"),
+                        make_face_image(rng, lie=label == "lie"))
+
+
+def make_model(model_dir: str, seed: int = 0):
+    """
+    Write a checkpoint with seeded random weights and point model_metadata.json
+    at it, so the real (non-dummy) model path runs without a trained model
+    """
+    from model_trainer import LieDetectionModel
+
+    os.makedirs(model_dir, exist_ok=True)
+    torch.manual_seed(seed)
+    model_path = os.path.join(model_dir, "model_benchmark.pth")
+    torch.save(LieDetectionModel().state_dict(), model_path)
+    with open(os.path.join(model_dir, "model_metadata.json"), "w") as f:
+        json.dump({"model_path": model_path, "timestamp": datetime.now().isoformat(), "accuracy": None}, f)
+
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float, warmup: bool = True) -> Dict[str, Any]:
+    """
+    Time a function: calls are grouped into rounds of at least min_time seconds
+    (the calls per round are calibrated first, like timeit's autorange) and
+    repeat rounds are timed
+
+    Returns:
+        Seconds per call (median, min and max over the rounds) and the round size
+    """
+    if warmup:
+        fn()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    # The calibration round counts as the first round
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - started) / number)
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+        "rounds": len(times),
+        "calls_per_round": number
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Describe the machine and library versions, so results of different
+    environments aren't compared unnoticed
+    """
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "opencv_threads": cv2.getNumThreads()
+    }
+
+
+def run_benchmarks(workdir: str, quick: bool, repeat: int, e2e_repeat: int, min_time: float,
+                   gallery_size: int, only: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the synthetic inputs in workdir and run the micro-benchmarks and
+    end-to-end scenarios
+
+    Args:
+        workdir: Scratch directory (the pipeline is built with it as the working directory)
+        quick: Smaller clips and fewer resolutions (for a smoke run)
+        repeat: Timed rounds per micro-benchmark
+        e2e_repeat: Timed runs per end-to-end scenario
+        min_time: Minimum seconds per micro-benchmark round
+        gallery_size: Images per class of the synthetic micro-expression gallery
+        only: Run only the benchmarks whose name contains one of these strings
+
+    Returns:
+        Results by benchmark name
+    """
+    from analyzers import FullPipelineAnalyzer
+    from embedding_cache import EmbeddingCache
+    from result_cache import ResultCache
+
+    make_model(os.path.join(workdir, "models"))
+    make_gallery(os.path.join(workdir, "micro_expression_dataset"), gallery_size)
+    clips = []
+    for width, height, seconds in (QUICK_CLIPS if quick else CLIPS):
+        path = os.path.join(workdir, f"clip_{width}x{height}_{seconds}s.avi")
+        make_video(path, seconds=seconds, width=width, height=height)
+        clips.append((f"{width}x{height},{seconds}s", path))
+
+    # Predictor looks for models/ and micro_expression_dataset/ in the working directory
+    analyzer = FullPipelineAnalyzer()
+    predictor = analyzer.predictor
+    processor = analyzer.video_processor
+    gallery = predictor.micro_expr_analyzer
+    if gallery is None or not gallery.dataset_loaded:
+        raise RuntimeError("The synthetic micro-expression gallery did not load")
+    loaded_model = predictor.registry.current()
+    if loaded_model.is_dummy:
+        raise RuntimeError("The benchmark checkpoint did not load")
+
+    rng = np.random.default_rng(1)
+    face = make_face_image(rng)
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    features = gallery._extract_features(gray)
+    other_features = gallery.truth_expressions[0]["features"]
+    face_frames = [make_face_image(rng) for _ in range(30)]
+    audio_features = rng.random(20).astype(np.float32)
+    processed = processor.process_video(clips[0][1])
+    if processed is None:
+        raise RuntimeError("No face detected in the synthetic clip")
+    result = predictor.predict(processed, loaded_model)
+    result_cache = ResultCache(os.path.join(workdir, "cache"), legacy_json=None)
+    video_hashes = (f"{i:064x}" for i in itertools.count())
+    cached_embeddings = predictor.embedding_cache
+    # No embedding fits in a zero budget: every call runs the CNN
+    cold_embeddings = EmbeddingCache(0)
+
+    def model_prediction(cache):
+        def run():
+            predictor.embedding_cache = cache
+            try:
+                predictor._get_model_prediction(face_frames, audio_features, loaded_model)
+            finally:
+                predictor.embedding_cache = cached_embeddings
+        return run
+
+    micro = {
+        "lbp": lambda: gallery._local_binary_pattern(gray, 8, 1),
+        "extract_features": lambda: gallery._extract_features(gray),
+        "compute_similarity": lambda: gallery._compute_similarity(features, other_features),
+        "gallery_scoring": lambda: gallery.analyze_frame(face),
+        "model_prediction": model_prediction(cold_embeddings),
+        "model_prediction_cached": model_prediction(cached_embeddings),
+        "result_cache_store": lambda: result_cache.store_result(next(video_hashes), result, "benchmark"),
+    }
+    for width, height in (QUICK_DETECT_RESOLUTIONS if quick else DETECT_RESOLUTIONS):
+        frame = np.full((height, width, 3), 90, np.uint8)
+        draw_face(frame, (width // 2, height // 2), scale=height / 480)
+        frame = cv2.GaussianBlur(frame, (7, 7), 0)
+        micro[f"detect_face[{width}x{height}]"] = lambda frame=frame: processor._detect_face(frame)
+
+    def selected(name):
+        return not only or any(pattern in name for pattern in only)
+
+    results = {}
+    for name, fn in micro.items():
+        if selected(name):
+            results[name] = measure(fn, repeat, min_time)
+            logger.info(f"{name}: {results[name]['median_s'] * 1000:.3f} ms")
+
+    # End-to-end: decode, face detection, gallery scoring and inference of a
+    # whole clip, with the embedding cache cold as for a new upload
+    predictor.embedding_cache = cold_embeddings
+    try:
+        for label, path in clips:
+            for name, fn in ((f"process_video[{label}]", lambda path=path: processor.process_video(path)),
+                             (f"analyze_video[{label}]", lambda path=path: analyzer.analyze_video(path, None, None, loaded_model))):
+                if selected(name):
+                    results[name] = measure(fn, e2e_repeat, 0, warmup=False)
+                    logger.info(f"{name}: {results[name]['median_s']:.2f} s")
+    finally:
+        predictor.embedding_cache = cached_embeddings
+        result_cache.close()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any],
+            threshold: float) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Compare results with a baseline by median time
+
+    Returns:
+        One row per benchmark (name, baseline and current medians, ratio and
+        status: ok, faster, regression or new) and the names of the regressions
+    """
+    rows = []
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("benchmarks", {}).get(name)
+        row = {"name": name, "current_s": result["median_s"]}
+        if reference is None:
+            row["status"] = "new"
+        else:
+            ratio = result["median_s"] / max(reference["median_s"], 1e-12)
+            row.update(baseline_s=reference["median_s"], ratio=round(ratio, 3))
+            if ratio > 1 + threshold:
+                row["status"] = "regression"
+                regressions.append(name)
+            elif ratio < 1 / (1 + threshold):
+                row["status"] = "faster"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows, regressions
+
+
+def format_seconds(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    width = max(len(row["name"]) for row in rows)
+    print(f"{'benchmark':<{width}}  {'baseline':>10}  {'current':>10}  {'ratio':>6}  status")
+    for row in rows:
+        ratio = f"{row['ratio']:.2f}" if "ratio" in row else "-"
+        print(f"{row['name']:<{width}}  {format_seconds(row.get('baseline_s')):>10}  "
+              f"{format_seconds(row['current_s']):>10}  {ratio:>6}  {row['status']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis hot paths and the full pipeline on "
+                                                 "synthetic videos, and check them against a baseline")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fail if a median is this much slower than its baseline (0.25 = 25%%)")
+    parser.add_argument("--quick", action="store_true", help="One short clip and one resolution (smoke run)")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed rounds per micro-benchmark")
+    parser.add_argument("--e2e-repeat", type=int, default=3, help="Timed runs per end-to-end scenario")
+    parser.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per micro-benchmark round")
+    parser.add_argument("--gallery-size", type=int, default=20, help="Images per class of the synthetic gallery")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Torch and OpenCV threads (fixed, so results don't depend on the machine's load)")
+    parser.add_argument("--only", type=str, default=None,
+                        help="Comma-separated substrings: run only the benchmarks whose name contains one")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    # The pipeline logs every analysis at INFO, which would drown the benchmark's own progress
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    torch.set_num_threads(args.threads)
+    cv2.setNumThreads(args.threads)
+    np.random.seed(0)
+
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        results = run_benchmarks(workdir, args.quick, args.repeat, args.e2e_repeat, args.min_time,
+                                 args.gallery_size, args.only.split(",") if args.only else None)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if not results:
+        sys.exit(f"No benchmarks selected: none of their names contains any of --only {args.only}")
+
+    report = {
+        "created": datetime.now().isoformat(),
+        "environment": environment(),
+        "settings": {"quick": args.quick, "repeat": args.repeat, "e2e_repeat": args.e2e_repeat,
+                     "min_time": args.min_time, "gallery_size": args.gallery_size, "threads": args.threads},
+        "benchmarks": results
+    }
+
+    regressions = []
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key, value in baseline.get("environment", {}).items():
+            if report["environment"].get(key) != value:
+                logger.warning(f"Environment differs from the baseline ({key}: {value} -> "
+                               f"{report['environment'].get(key)}); timings may not be comparable")
+    rows, regressions = compare(results, baseline or {}, args.threshold)
+    report["threshold"] = args.threshold
+    report["comparison"] = rows if baseline is not None else None
+    report["regressions"] = regressions
+    print_table(rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif baseline is None:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,34 @@
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Cancellation event of the work running in the current context (see cancellable)
+_current = contextvars.ContextVar("cancellation", default=None)
+
+
+class Cancelled(Exception):
+    """Raised by check inside work that has been cancelled"""
+
+
+@contextmanager
+def cancellable(event: threading.Event):
+    """
+    Run the enclosed work so that setting event cancels it. Python threads
+    can't be interrupted, so the work stops at its next check() rather than
+    right away.
+    """
+    token = _current.set(event)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def check():
+    """
+    Raise Cancelled if the current work has been cancelled (called between
+    the steps of long loops, e.g. per frame)
+    """
+    event = _current.get()
+    if event is not None and event.is_set():
+        raise Cancelled("Cancelled")
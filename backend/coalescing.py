@@ -0,0 +1,151 @@
+import os
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing falls back to a single process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key (e.g. a video hash and
+    cache scope).
+
+    Within a process, the first caller computes the result and concurrent
+    duplicates (on other threads) wait for the same future. Across the
+    worker processes of one host, the computing process holds an exclusive
+    lock file for the key; a process that finds the key locked waits for the
+    lock and then reads the result from the shared cache instead of
+    computing it again.
+    """
+    def __init__(self, lock_dir: str):
+        """
+        Initialize the coalescer
+
+        Args:
+            lock_dir: Directory for the per-key lock files (shared by all workers)
+        """
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self.computed = 0
+        self.coalesced_local = 0
+        self.coalesced_remote = 0
+
+    def run(self, key: str, compute: Callable[[], Any], lookup: Callable[[], Optional[Any]]) -> Any:
+        """
+        Get the result for a key, computing it at most once across concurrent callers
+
+        Args:
+            key: Coalescing key (used in a file name)
+            compute: Function computing (and caching) the result
+            lookup: Function returning the cached result for the key, or None
+
+        Returns:
+            The result
+        """
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced_local += 1
+        if inflight is not None:
+            logger.info(f"Coalescing analysis of {key[:8]}... with one in progress")
+            return inflight.result()
+
+        try:
+            result = self._run_locked(key, compute, lookup)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _run_locked(self, key: str, compute: Callable[[], Any], lookup: Callable[[], Optional[Any]]) -> Any:
+        if fcntl is None:
+            with self._lock:
+                self.computed += 1
+            return compute()
+
+        # Blocks while another worker process computes the same key
+        fd, waited = self._acquire(key)
+        try:
+            # Re-check the cache: another process may have finished this key
+            # between our caller's cache lookup and us getting the lock
+            result = lookup()
+            if result is not None:
+                if waited:
+                    with self._lock:
+                        self.coalesced_remote += 1
+                    logger.info(f"Analysis of {key[:8]}... was computed by another worker")
+                return result
+
+            with self._lock:
+                self.computed += 1
+            return compute()
+        finally:
+            self._release(key, fd)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, f"{key}.lock")
+
+    def _acquire(self, key: str) -> Tuple[int, bool]:
+        """
+        Take the exclusive lock for a key
+
+        Returns:
+            Tuple of (lock file descriptor, whether another process held the lock)
+        """
+        path = self._lock_path(key)
+        waited = False
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waited = True
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+            # The previous holder unlinks the file before unlocking; if we locked
+            # an unlinked file, try again on a fresh one
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd, waited
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _release(self, key: str, fd: int):
+        try:
+            os.unlink(self._lock_path(key))
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get coalescing counters (per process)
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._inflight),
+                "computed": self.computed,
+                "coalesced_local": self.coalesced_local,
+                "coalesced_remote": self.coalesced_remote,
+                "cross_process": fcntl is not None
+            }
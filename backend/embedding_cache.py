@@ -0,0 +1,196 @@
+import os
+import glob
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry bookkeeping overhead (key string, OrderedDict node, array header)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of per-frame CNN embeddings.
+
+    Entries are keyed by a hash of the raw uint8 face crop plus the model
+    version, so re-scoring the same crops (overlapping windows, repeated
+    uploads, new LSTM/classifier heads on the same CNN) skips the CNN.
+    Entries evicted from memory can optionally spill to disk.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, spill_dir: Optional[str] = None,
+                 spill_max_entries: int = 1_000_000):
+        """
+        Initialize the embedding cache
+
+        Args:
+            max_bytes: Memory budget for cached embeddings
+            spill_dir: Directory to spill evicted embeddings to (disabled if None)
+            spill_max_entries: Maximum number of spilled embeddings kept on disk
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_entries = spill_max_entries
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._spilled = 0
+        # Guards the spill counter and pruning (the spill I/O stays outside _lock)
+        self._spill_lock = threading.Lock()
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spilled = len(glob.glob(os.path.join(spill_dir, "*.npy")))
+
+        logger.info(f"Embedding cache initialized (budget: {max_bytes / 1e6:.0f} MB, spill: {spill_dir or 'disabled'})")
+
+    @staticmethod
+    def frame_key(frame: np.ndarray, model_version: str) -> str:
+        """
+        Compute the cache key of a face crop
+
+        Args:
+            frame: uint8 face crop
+            model_version: Version of the model producing the embedding
+
+        Returns:
+            A hex string key
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(model_version.encode())
+        h.update(str(frame.shape).encode())
+        h.update(np.ascontiguousarray(frame).data)
+        return h.hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up embeddings
+
+        Args:
+            keys: Cache keys from frame_key
+
+        Returns:
+            The embedding for every key, or None where it isn't cached
+        """
+        results = []
+        with self._lock:
+            for key in keys:
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                results.append(embedding)
+
+        # Check the spill directory for in-memory misses (outside the lock, it does I/O)
+        spill_hits = 0
+        misses = 0
+        for i, key in enumerate(keys):
+            if results[i] is not None:
+                continue
+            embedding = self._read_spilled(key)
+            if embedding is not None:
+                results[i] = embedding
+                self.put_many([key], [embedding])
+                spill_hits += 1
+            else:
+                misses += 1
+
+        with self._lock:
+            self.spill_hits += spill_hits
+            self.misses += misses
+
+        return results
+
+    def put_many(self, keys: List[str], embeddings: List[np.ndarray]):
+        """
+        Store embeddings, evicting least recently used entries beyond the memory budget
+
+        Args:
+            keys: Cache keys from frame_key
+            embeddings: Embeddings to store (float32 arrays)
+        """
+        evicted = []
+        with self._lock:
+            for key, embedding in zip(keys, embeddings):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    continue
+                self._entries[key] = embedding
+                self._bytes += embedding.nbytes + ENTRY_OVERHEAD_BYTES
+
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, old_embedding = self._entries.popitem(last=False)
+                self._bytes -= old_embedding.nbytes + ENTRY_OVERHEAD_BYTES
+                self.evictions += 1
+                evicted.append((old_key, old_embedding))
+
+        if self.spill_dir:
+            for key, embedding in evicted:
+                self._spill(key, embedding)
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.npy")
+
+    def _spill(self, key: str, embedding: np.ndarray):
+        path = self._spill_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            np.save(path, embedding)
+            with self._spill_lock:
+                self._spilled += 1
+                if self._spilled > self.spill_max_entries:
+                    self._prune_spill()
+        except Exception as e:
+            logger.warning(f"Could not spill embedding: {str(e)}")
+
+    def _read_spilled(self, key: str) -> Optional[np.ndarray]:
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path)
+        except Exception as e:
+            logger.warning(f"Could not read spilled embedding: {str(e)}")
+            return None
+
+    def _prune_spill(self):
+        """Delete the oldest spilled embeddings, down to 90% of the spill limit (called with _spill_lock held)"""
+        files = sorted(glob.glob(os.path.join(self.spill_dir, "*.npy")), key=os.path.getmtime)
+        excess = len(files) - int(self.spill_max_entries * 0.9)
+        for path in files[:max(0, excess)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._spilled = len(files) - max(0, excess)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics
+        """
+        lookups = self.hits + self.spill_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "spill_hits": self.spill_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "spilled_entries": self._spilled,
+            "hit_rate": (self.hits + self.spill_hits) / lookups if lookups else 0.0
+        }
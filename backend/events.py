@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from sqlite_store import SQLiteStore, dumps
+
+logger = logging.getLogger(__name__)
+
+# Events published for a job
+PROGRESS = "progress"  # progress fraction and stage
+PARTIAL = "partial"    # provisional result while the analysis runs
+FINISHED = "finished"  # the job is done or failed (its status is in the data)
+
+# Seconds a subscription lasts unless renewed (so a subscriber that died stops counting)
+SUBSCRIPTION_TTL = 60.0
+# Seconds a SubscriberCheck reuses its answer
+SUBSCRIBER_CHECK_INTERVAL = 1.0
+
+
+class EventChannel(SQLiteStore):
+    """
+    Channel of job events, stored in SQLite so that every publisher (job
+    worker threads, analysis worker processes through the pool, other server
+    processes sharing the job queue) and every subscriber see one ordered
+    stream per job.
+
+    Events get increasing ids across all jobs, so a subscriber resumes with
+    the last id it saw (e.g. an SSE Last-Event-ID) and never misses or
+    repeats one. They are kept until pruned, so late subscribers get the
+    events published before they connected.
+
+    Subscribers also register while they are connected, so publishers can
+    skip work nobody is waiting for (see has_subscribers).
+    """
+    def __init__(self, db_path: str):
+        """
+        Initialize the channel
+
+        Args:
+            db_path: Path of the SQLite database
+        """
+        super().__init__(db_path)
+        self.published = 0
+        self._stats_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "job_id TEXT NOT NULL, "
+                "event TEXT NOT NULL, "
+                "data TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS events_job ON events (job_id, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS subscriptions ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "job_id TEXT NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS subscriptions_job ON subscriptions (job_id)")
+
+    def publish(self, job_id: str, event: str, data: Dict[str, Any]) -> Optional[int]:
+        """
+        Publish an event of a job
+
+        Args:
+            job_id: Job id
+            event: Event name (PROGRESS, PARTIAL or FINISHED)
+            data: JSON-serializable event data
+
+        Returns:
+            Id of the event, or None if it could not be stored
+        """
+        try:
+            event_id = self._connection().execute(
+                "INSERT INTO events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event, dumps(data), time.time())
+            ).lastrowid
+        except sqlite3.Error as e:
+            # Events are informational; a failure must not fail the job
+            logger.warning(f"Could not publish {event} event of job {job_id}: {str(e)}")
+            return None
+        with self._stats_lock:
+            self.published += 1
+        return event_id
+
+    def read(self, job_id: str, after: int = 0, limit: int = 100) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Get the events of a job published after an event id
+
+        Args:
+            job_id: Job id
+            after: Id of the last event already seen (0 for all)
+            limit: Most events to return
+
+        Returns:
+            List of (id, event, data), oldest first
+        """
+        rows = self._connection().execute(
+            "SELECT id, event, data FROM events WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (job_id, after, limit)
+        ).fetchall()
+        return [(event_id, event, json.loads(data)) for event_id, event, data in rows]
+
+    def subscribe(self, job_id: str) -> int:
+        """
+        Register a subscriber of a job's events (renew it at least every
+        SUBSCRIPTION_TTL seconds, and unsubscribe when done)
+
+        Returns:
+            Subscription id
+        """
+        return self._connection().execute(
+            "INSERT INTO subscriptions (job_id, expires_at) VALUES (?, ?)", (job_id, time.time() + SUBSCRIPTION_TTL)
+        ).lastrowid
+
+    def renew(self, subscription_id: int):
+        self._connection().execute(
+            "UPDATE subscriptions SET expires_at = ? WHERE id = ?", (time.time() + SUBSCRIPTION_TTL, subscription_id)
+        )
+
+    def unsubscribe(self, subscription_id: int):
+        self._connection().execute("DELETE FROM subscriptions WHERE id = ?", (subscription_id,))
+
+    def has_subscribers(self, job_id: str) -> bool:
+        """
+        Whether a job's events currently have a subscriber
+        """
+        return self._connection().execute(
+            "SELECT 1 FROM subscriptions WHERE job_id = ? AND expires_at > ? LIMIT 1", (job_id, time.time())
+        ).fetchone() is not None
+
+    def subscriber_check(self, job_id: str) -> "SubscriberCheck":
+        """
+        Get a callable telling whether a job has subscribers, which can be
+        passed to other processes (e.g. the analysis pool)
+        """
+        return SubscriberCheck(self.db_path, job_id)
+
+    def prune(self, before: float) -> int:
+        """
+        Delete events published before a time (and expired subscriptions)
+
+        Returns:
+            Number of events removed
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM subscriptions WHERE expires_at < ?", (time.time(),))
+        removed = conn.execute("DELETE FROM events WHERE created_at < ?", (before,)).rowcount
+        if removed:
+            logger.info(f"Removed {removed} expired job events")
+        return removed
+
+
+# Channels opened by SubscriberChecks, per database (one per process)
+_channels: Dict[str, EventChannel] = {}
+_channels_lock = threading.Lock()
+
+
+class SubscriberCheck:
+    """
+    Picklable callable telling whether a job has subscribers. The answer is
+    reused for SUBSCRIBER_CHECK_INTERVAL seconds, so it is cheap to call per
+    frame; errors count as no subscribers.
+    """
+    def __init__(self, db_path: str, job_id: str):
+        self.db_path = db_path
+        self.job_id = job_id
+        self._checked_at = None
+        self._subscribed = False
+
+    def __call__(self) -> bool:
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= SUBSCRIBER_CHECK_INTERVAL:
+            self._checked_at = now
+            try:
+                self._subscribed = self._channel().has_subscribers(self.job_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not check the subscribers of job {self.job_id}: {str(e)}")
+                self._subscribed = False
+        return self._subscribed
+
+    def _channel(self) -> EventChannel:
+        with _channels_lock:
+            channel = _channels.get(self.db_path)
+            if channel is None:
+                channel = _channels[self.db_path] = EventChannel(self.db_path)
+            return channel
+
+    def __getstate__(self):
+        return {"db_path": self.db_path, "job_id": self.job_id}
+
+    def __setstate__(self, state):
+        self.__init__(state["db_path"], state["job_id"])
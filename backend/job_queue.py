@@ -0,0 +1,551 @@
+import os
+import json
+import time
+import uuid
+import errno
+import asyncio
+import sqlite3
+import logging
+import threading
+import traceback
+from datetime import datetime
+from typing import Dict, Any, Callable, Optional, Tuple
+
+from sqlite_store import SQLiteStore, dumps
+from events import EventChannel, PROGRESS, PARTIAL, FINISHED
+from metrics import metrics
+from cancellation import Cancelled, cancellable
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Priority classes; queued jobs are claimed by priority, then in order of submission
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+# Number of recent jobs the mean run time is taken over
+RUN_TIME_WINDOW = 50
+
+# Seconds between progress writes of a job within a stage (each also publishes a progress event)
+PROGRESS_INTERVAL = 1.0
+# Seconds between provisional results published for a job
+PARTIAL_INTERVAL = 2.0
+# Seconds between checks for jobs orphaned by dead worker processes, and for expired jobs
+MAINTENANCE_INTERVAL = 30.0
+
+
+class JobQueue(SQLiteStore):
+    """
+    Persistent queue of analysis jobs, processed by a bounded pool of worker threads.
+
+    The queue is an SQLite table, so jobs survive restarts and several
+    server processes on one host can share it: each claims queued jobs
+    atomically, and jobs left running by a process that died are queued
+    again. Submitting a video that already has an active job returns that
+    job instead of queueing a duplicate. With an event channel, progress,
+    provisional results and completion are also published as job events.
+
+    Queued jobs can be cancelled right away; running ones stop at their
+    handler's next cancellation check (see cancellation.py), which the
+    owning process learns about when it next writes the job's progress.
+    """
+    def __init__(self, db_path: str, handler: Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]],
+                 workers: int = 2, retention_seconds: float = 24 * 3600, poll_interval: float = 1.0,
+                 events: Optional[EventChannel] = None,
+                 release: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Initialize the job queue (call start to run the workers)
+
+        Args:
+            db_path: Path of the SQLite database
+            handler: Function running a job; called with the job and a
+                progress(fraction, stage, partial=None) callback, returns the result.
+                The callback's wants_partials() tells whether anyone is subscribed
+                to the provisional results
+            workers: Number of worker threads
+            retention_seconds: How long finished jobs are kept
+            poll_interval: Seconds idle workers wait before checking for jobs
+                queued by other processes
+            events: EventChannel to publish job events to (optional)
+            release: Called with each job cancelled without its handler
+                finishing (queued, or orphaned by a dead process), to free
+                what the handler would have, e.g. the job's upload (optional)
+        """
+        super().__init__(db_path)
+        self.handler = handler
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self.events = events
+        self.release = release
+
+        # Identifies this process in the owner column; the token tells a
+        # restarted process apart from its predecessor with the same pid
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_maintenance = 0.0
+        # Job id -> cancellation event of the jobs running in this process
+        self._running = {}
+
+        self.submitted = 0
+        self.coalesced = 0
+        self._stats_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._init_db()
+
+    def _configure(self, conn: sqlite3.Connection):
+        conn.row_factory = sqlite3.Row
+        super()._configure(conn)
+
+    def _init_db(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, "
+                "progress REAL NOT NULL DEFAULT 0, "
+                "stage TEXT, "
+                "video_hash TEXT NOT NULL, "
+                "scope TEXT NOT NULL, "
+                "video_path TEXT, "
+                "filename TEXT, "
+                "owner TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "result TEXT, "
+                "error TEXT, "
+                "created_at REAL NOT NULL, "
+                "started_at REAL, "
+                "finished_at REAL, "
+                "priority INTEGER NOT NULL DEFAULT 0, "
+                "trace_id TEXT, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0)"
+            )
+            # Databases created before priority classes, request tracing and cancellation
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "trace_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN trace_id TEXT")
+            if "cancel_requested" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_video ON jobs (video_hash, scope) WHERE status IN ('queued', 'running')")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at) WHERE finished_at IS NOT NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (priority, created_at) WHERE status = 'queued'")
+
+    def start(self):
+        """
+        Queue jobs orphaned by a previous run again and start the workers
+        """
+        if self.owner.split(":")[0] != str(os.getpid()):
+            # A process forked after the queue was created (see serve.py) needs its own owner id
+            self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._recover()
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job queue started with {self.workers} workers ({self.db_path})")
+
+    def stop(self):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def submit(self, video_hash: str, scope: str, video_path: Optional[str], filename: Optional[str] = None,
+               result: Optional[Dict[str, Any]] = None, priority: str = INTERACTIVE,
+               trace_id: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Queue an analysis job
+
+        Args:
+            video_hash: SHA-256 of the video
+            scope: Result cache scope to analyze under
+            video_path: Path of the uploaded video; the job's handler is responsible for it
+            filename: Original file name
+            result: Result that is already known (e.g. cached); the job is created finished
+            priority: Priority class, INTERACTIVE or BATCH
+            trace_id: Trace the job's analysis is recorded to (see profiling.py)
+
+        Returns:
+            Tuple of (job, created). created is False if an active job for the
+            same video and scope was returned instead of queueing a new one.
+        """
+        now = time.time()
+        rank = PRIORITIES[priority]
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if result is None:
+                existing = conn.execute(
+                    "SELECT * FROM jobs WHERE video_hash = ? AND scope = ? AND status IN (?, ?) LIMIT 1",
+                    (video_hash, scope, *ACTIVE_STATUSES)
+                ).fetchone()
+                if existing is not None:
+                    with self._stats_lock:
+                        self.coalesced += 1
+                    logger.info(f"Coalescing upload of {video_hash[:8]}... with job {existing['id']}")
+                    if rank < existing["priority"]:
+                        # An interactive upload joining a batch job moves it up
+                        existing = conn.execute(
+                            "UPDATE jobs SET priority = ? WHERE id = ? RETURNING *", (rank, existing["id"])
+                        ).fetchone()
+                    if trace_id is not None and existing["trace_id"] is None and existing["status"] == QUEUED:
+                        # A traced upload joining a job that hasn't started gets its analysis traced
+                        existing = conn.execute(
+                            "UPDATE jobs SET trace_id = ? WHERE id = ? RETURNING *", (trace_id, existing["id"])
+                        ).fetchone()
+                    return dict(existing), False
+
+            job_id = uuid.uuid4().hex
+            if result is None:
+                conn.execute(
+                    "INSERT INTO jobs (id, status, video_hash, scope, video_path, filename, created_at, priority, trace_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, QUEUED, video_hash, scope, video_path, filename, now, rank, trace_id)
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO jobs (id, status, progress, stage, video_hash, scope, filename, result, "
+                    "created_at, started_at, finished_at, priority) VALUES (?, ?, 1, 'cached', ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, DONE, video_hash, scope, filename, dumps(result), now, now, now, rank)
+                )
+            job = dict(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+        with self._stats_lock:
+            self.submitted += 1
+        if result is None:
+            logger.info(f"Queued job {job_id} for {filename or video_hash[:8]}")
+            with self._wakeup:
+                self._wakeup.notify()
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job by id, or None if it doesn't exist
+        """
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a job: a queued one right away, a running one once its handler
+        reaches a cancellation check. Uploads coalesced into the job are
+        cancelled with it.
+
+        Args:
+            job_id: Job id
+
+        Returns:
+            The job in its latest state (unchanged if it had finished), or None if it doesn't exist
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, finished_at = ? WHERE id = ? AND status = ? RETURNING *",
+                (CANCELLED, CANCELLED, time.time(), job_id, QUEUED)
+            ).fetchone()
+            was_queued = row is not None
+            if row is None:
+                row = conn.execute(
+                    "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ? RETURNING *", (job_id, RUNNING)
+                ).fetchone()
+            if row is None:
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        if was_queued:
+            logger.info(f"Cancelled queued job {job_id}")
+            self._cancelled(dict(row))
+        elif row["status"] == RUNNING:
+            logger.info(f"Cancelling running job {job_id}")
+            cancel = self._running.get(job_id)
+            if cancel is not None:
+                cancel.set()
+        return dict(row)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait until a job has finished or the timeout has passed
+
+        Args:
+            job_id: Job id
+            timeout: Longest time to wait in seconds
+
+        Returns:
+            The job in its latest state, or None if it doesn't exist
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            # SQLite is blocking, so the row is read off the event loop
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            # The job may run in another process, so its row is polled
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued job of the highest priority"""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, started_at = ?, attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY priority, created_at LIMIT 1) RETURNING *",
+                (RUNNING, self.owner, time.time(), QUEUED)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - self._last_maintenance > MAINTENANCE_INTERVAL:
+                    self._last_maintenance = time.monotonic()
+                    self._recover()
+                    self._prune()
+
+                job = self._claim()
+                if job is None:
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+                    continue
+
+                self._run(job)
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+                logger.error(traceback.format_exc())
+                self._stop.wait(self.poll_interval)
+
+    def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        last_written = {"progress": -1.0, "stage": None, "at": 0.0, "partial_at": 0.0}
+        cancel = threading.Event()
+
+        def progress(fraction: float, stage: str, partial: Optional[Dict[str, Any]] = None):
+            now = time.monotonic()
+            if (partial is not None and self.events is not None
+                    and now - last_written["partial_at"] >= PARTIAL_INTERVAL):
+                last_written["partial_at"] = now
+                self.events.publish(job_id, PARTIAL, {"progress": fraction, "stage": stage, **partial})
+            if stage == last_written["stage"] and (now - last_written["at"] < PROGRESS_INTERVAL
+                                                   or fraction <= last_written["progress"]):
+                return
+            last_written.update(progress=fraction, stage=stage, at=now)
+            row = self._connection().execute(
+                "UPDATE jobs SET progress = ?, stage = ? WHERE id = ? AND owner = ? RETURNING cancel_requested",
+                (fraction, stage, job_id, self.owner)
+            ).fetchone()
+            # Cancellation requested through another process
+            if row is not None and row[0]:
+                cancel.set()
+            if self.events is not None:
+                self.events.publish(job_id, PROGRESS, {"progress": fraction, "stage": stage})
+
+        # Tells the handler whether provisional results are worth computing
+        progress.wants_partials = self.events.subscriber_check(job_id) if self.events is not None else _no_partials
+
+        logger.info(f"Running job {job_id} ({job['filename'] or job['video_hash'][:8]})")
+        if job["started_at"] is not None:
+            metrics.record("queue_wait", job["started_at"] - job["created_at"])
+        started = time.perf_counter()
+        self._running[job_id] = cancel
+        try:
+            with cancellable(cancel):
+                result = self.handler(job, progress)
+        except Cancelled:
+            logger.info(f"Job {job_id} cancelled")
+            self._finish(job_id, CANCELLED)
+            return
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            logger.error(traceback.format_exc())
+            self._finish(job_id, FAILED, error=str(e))
+            return
+        finally:
+            self._running.pop(job_id, None)
+            metrics.record("analysis", time.perf_counter() - started)
+
+        # An analysis running in another process (see analysis_pool.py) can't be
+        # stopped; its result is cached, but the job stays cancelled
+        if cancel.is_set() or self._cancel_requested(job_id):
+            logger.info(f"Job {job_id} cancelled")
+            self._finish(job_id, CANCELLED)
+            return
+        self._finish(job_id, DONE, result=result)
+        logger.info(f"Job {job_id} done in {time.perf_counter() - started:.2f}s")
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        row = self._connection().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, "
+            "stage = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND owner = ?",
+            (status, status, status, dumps(result) if result is not None else None, error, time.time(),
+             job_id, self.owner)
+        )
+        metrics.inc("jobs_finished_total", status=status)
+        if self.events is not None:
+            # Subscribers read the result from the job itself
+            self.events.publish(job_id, FINISHED, {"status": status})
+
+    def _cancelled(self, job: Dict[str, Any]):
+        """Record a job cancelled without its handler finishing, and release it"""
+        metrics.inc("jobs_finished_total", status=CANCELLED)
+        if self.events is not None:
+            self.events.publish(job["id"], FINISHED, {"status": CANCELLED})
+        if self.release is not None:
+            try:
+                self.release(job)
+            except Exception as e:
+                logger.warning(f"Could not release cancelled job {job['id']}: {str(e)}")
+
+    def _recover(self):
+        """Queue running jobs again whose worker process no longer exists (or finish them if cancelled)"""
+        conn = self._connection()
+        cancelled = []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            orphaned = [
+                row["id"] for row in conn.execute("SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,))
+                if not self._owner_alive(row["owner"])
+            ]
+            for job_id in orphaned:
+                row = conn.execute(
+                    "UPDATE jobs SET status = ?, stage = ?, finished_at = ? "
+                    "WHERE id = ? AND cancel_requested = 1 RETURNING *",
+                    (CANCELLED, CANCELLED, time.time(), job_id)
+                ).fetchone()
+                if row is not None:
+                    cancelled.append(dict(row))
+            conn.executemany(
+                "UPDATE jobs SET status = ?, owner = NULL, progress = 0, stage = NULL WHERE id = ? AND status = ?",
+                [(QUEUED, job_id, RUNNING) for job_id in orphaned]
+            )
+        for job in cancelled:
+            logger.info(f"Cancelled job {job['id']} left running by a stopped process")
+            self._cancelled(job)
+        if len(orphaned) > len(cancelled):
+            logger.warning(f"Requeued {len(orphaned) - len(cancelled)} jobs left running by a stopped process")
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def _owner_alive(self, owner: Optional[str]) -> bool:
+        if not owner:
+            return False
+        if owner == self.owner:
+            return True
+        pid = int(owner.split(":")[0])
+        if pid == os.getpid():
+            # Same pid as us but a different token: a previous run of this process
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
+
+    def _prune(self):
+        """Delete finished jobs older than the retention period"""
+        removed = self._connection().execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+            (time.time() - self.retention_seconds,)
+        ).rowcount
+        if removed:
+            logger.info(f"Removed {removed} expired jobs")
+        if self.events is not None:
+            self.events.prune(time.time() - self.retention_seconds)
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Get the current load of the queue (shared by every process using it)
+
+        Returns:
+            Dict with the number of running jobs, queued jobs per priority
+            class, and the mean run time of recent jobs in seconds (None
+            before any job has run)
+        """
+        conn = self._connection()
+        queued = {name: 0 for name in PRIORITIES}
+        names = {rank: name for name, rank in PRIORITIES.items()}
+        for row in conn.execute("SELECT priority, COUNT(*) AS n FROM jobs WHERE status = ? GROUP BY priority", (QUEUED,)):
+            queued[names.get(row["priority"], BATCH)] += row["n"]
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+        # Cached results are created finished and don't count
+        mean_run_seconds = conn.execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT started_at, finished_at FROM jobs "
+            "WHERE finished_at IS NOT NULL AND status = ? AND finished_at > started_at "
+            "ORDER BY finished_at DESC LIMIT ?)",
+            (DONE, RUN_TIME_WINDOW)
+        ).fetchone()[0]
+        return {"running": running, "queued": queued, "mean_run_seconds": mean_run_seconds}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the number of jobs per status and submission counters (counters are per process)
+        """
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+        for row in self._connection().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+        return {
+            "jobs": counts,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced
+        }
+
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get the client-facing view of a job
+
+    Args:
+        job: Job as returned by JobQueue
+
+    Returns:
+        Job id, status, progress and timestamps, plus the result or error once finished
+    """
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "stage": job["stage"],
+        "filename": job["filename"],
+        "priority": BATCH if job["priority"] else INTERACTIVE,
+        "created_at": _isoformat(job["created_at"]),
+        "started_at": _isoformat(job["started_at"]),
+        "finished_at": _isoformat(job["finished_at"])
+    }
+    if job["status"] == DONE:
+        view["result"] = json.loads(job["result"])
+    elif job["status"] == FAILED:
+        view["error"] = job["error"]
+    return view
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+def _no_partials() -> bool:
+    return False
@@ -0,0 +1,278 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+import cv2
+import numpy as np
+import torch
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from streaming_inference import RollingPrediction
+
+logger = logging.getLogger(__name__)
+
+# First byte of the binary messages a client sends
+FRAME_MESSAGE = 0x01  # followed by a JPEG-encoded frame
+AUDIO_MESSAGE = 0x02  # followed by mono 16-bit little-endian PCM samples
+
+# Default sample rate of the PCM chunks, and the seconds of audio the features are computed over
+DEFAULT_SAMPLE_RATE = 16000
+AUDIO_WINDOW_SECONDS = 5.0
+# The model takes 20 audio features
+AUDIO_BANDS = 20
+# Seconds over which the achieved frame rate is measured
+FPS_WINDOW_SECONDS = 2.0
+# Most latencies kept per session for the summary percentiles
+MAX_LATENCY_SAMPLES = 10000
+
+
+class LiveAudioFeatures:
+    """
+    Rolling audio features of a live stream: the log energy of the last few
+    seconds of audio in AUDIO_BANDS frequency bands, scaled to [0, 1]
+    """
+    def __init__(self, sample_rate: int = DEFAULT_SAMPLE_RATE, window_seconds: float = AUDIO_WINDOW_SECONDS):
+        self.sample_rate = sample_rate
+        self._samples = deque(maxlen=int(sample_rate * window_seconds))
+        self._lock = threading.Lock()
+        self.chunks = 0
+
+    def push(self, pcm: bytes):
+        """
+        Add a chunk of mono 16-bit little-endian PCM samples
+        """
+        samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype="<i2")
+        with self._lock:
+            self._samples.extend(samples.tolist())
+            self.chunks += 1
+
+    def features(self) -> Optional[np.ndarray]:
+        """
+        Get the features of the audio received so far, or None if there is none yet
+        """
+        with self._lock:
+            if len(self._samples) < AUDIO_BANDS * 2:
+                return None
+            samples = np.array(self._samples, dtype=np.float32) / 32768.0
+
+        spectrum = np.abs(np.fft.rfft(samples)) ** 2
+        bands = np.array_split(spectrum[1:], AUDIO_BANDS)
+        energy = np.log1p(np.array([band.sum() for band in bands]))
+        peak = energy.max()
+        return energy / peak if peak > 0 else energy
+
+
+class LiveAnalysisSession:
+    """
+    Analysis of one live stream of frames: face detection, micro-expression
+    scoring and incremental CNN-LSTM inference as each frame arrives.
+
+    The LSTM state is carried from window to window (see StreamingSession),
+    so a rolling prediction over everything seen so far costs one window of
+    frames, however long the stream runs. Without audio, neutral audio
+    features are used until the first PCM chunk arrives.
+    """
+    def __init__(self, video_processor, predictor, window_size: int = 1, sample_rate: int = DEFAULT_SAMPLE_RATE,
+                 loaded_model=None):
+        """
+        Initialize a live session
+
+        Args:
+            video_processor: VideoProcessor used for face detection
+            predictor: Predictor providing the model and micro-expression analyzer
+            window_size: Face frames per model step (1 gives a prediction per face)
+            sample_rate: Sample rate of the PCM chunks
+            loaded_model: Model snapshot to use; defaults to the active one
+        """
+        self.video_processor = video_processor
+        self.predictor = predictor
+        self.audio = LiveAudioFeatures(sample_rate)
+        self.rolling = RollingPrediction(predictor, np.full(AUDIO_BANDS, 0.5), window_size, loaded_model)
+        self.session = self.rolling.session
+
+        self.frames = 0
+        self._audio_chunks_used = 0
+
+    @property
+    def faces(self) -> int:
+        return self.rolling.faces
+
+    def process_frame(self, jpeg: bytes) -> Dict[str, Any]:
+        """
+        Analyze one JPEG-encoded frame
+
+        Returns:
+            The face box (None without a face), the frame's micro-expression
+            score, and the rolling prediction (None until the first window)
+        """
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode frame")
+        self.frames += 1
+
+        detected = self.video_processor._detect_face(frame)
+        if detected is None:
+            return {"face": None, "micro_expression": None, "prediction": self.rolling_prediction()}
+        face, box = detected
+
+        # Pick up newly received audio before the next model step
+        if self.audio.chunks != self._audio_chunks_used:
+            features = self.audio.features()
+            if features is not None:
+                self._audio_chunks_used = self.audio.chunks
+                self.session.audio_tensor = torch.tensor(features, dtype=torch.float32).reshape(1, AUDIO_BANDS).to(self.predictor.device)
+
+        micro_expression, _ = self.rolling.push(face)
+        return {"face": list(box), "micro_expression": micro_expression, "prediction": self.rolling_prediction()}
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """
+        Run the model on buffered frames that don't fill a window, and get the final prediction
+        """
+        return self.rolling.flush()
+
+    def rolling_prediction(self) -> Optional[Dict[str, Any]]:
+        """
+        Combine the latest model output with the micro-expression scores so
+        far, weighted equally as in Predictor.predict
+        """
+        return self.rolling.prediction()
+
+
+class LiveStreamStats:
+    """
+    Frame counters, achieved frame rate and per-frame latency of a live stream
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self._processed_at = deque()
+        self._latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+
+    def record(self, latency: float):
+        now = time.perf_counter()
+        self.processed += 1
+        self._latencies.append(latency)
+        self._processed_at.append(now)
+        while self._processed_at and now - self._processed_at[0] > FPS_WINDOW_SECONDS:
+            self._processed_at.popleft()
+
+    def fps(self) -> float:
+        """Frames processed per second over the last FPS_WINDOW_SECONDS"""
+        window = min(FPS_WINDOW_SECONDS, time.perf_counter() - self.started)
+        return len(self._processed_at) / window if window > 0 else 0.0
+
+    def counters(self) -> Dict[str, Any]:
+        return {"fps": round(self.fps(), 2), "received": self.received,
+                "processed": self.processed, "dropped": self.dropped}
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        summary = {
+            "seconds": round(elapsed, 2),
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "mean_fps": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0
+        }
+        if self._latencies:
+            latencies = np.array(self._latencies) * 1000
+            summary["latency_ms"] = {
+                "p50": round(float(np.percentile(latencies, 50)), 1),
+                "p95": round(float(np.percentile(latencies, 95)), 1),
+                "max": round(float(latencies.max()), 1)
+            }
+        return summary
+
+
+async def serve_live_stream(websocket: WebSocket, session: LiveAnalysisSession):
+    """
+    Run a live analysis over an accepted WebSocket
+
+    Binary messages carry a type byte (FRAME_MESSAGE or AUDIO_MESSAGE) and
+    the payload. Text messages are JSON control messages: {"type": "end"}
+    asks for the final prediction and closes the stream. Each analyzed
+    frame is answered with a "frame" message (face box, micro-expression
+    score, rolling prediction, latency, frame rate and counters).
+
+    Frames are received continuously while the previous one is analyzed and
+    only the latest is kept: a client sending faster than frames can be
+    analyzed has frames dropped instead of queued, so latency stays bounded
+    by the time to analyze about two frames.
+    """
+    stats = LiveStreamStats()
+    latest = {"frame": None}
+    frame_ready = asyncio.Event()
+    ended = asyncio.Event()
+
+    async def receive():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if data:
+                    if data[0] == FRAME_MESSAGE:
+                        stats.received += 1
+                        if latest["frame"] is not None:
+                            stats.dropped += 1
+                        latest["frame"] = (data[1:], time.perf_counter())
+                        frame_ready.set()
+                    elif data[0] == AUDIO_MESSAGE:
+                        session.audio.push(data[1:])
+                elif message.get("text"):
+                    try:
+                        control = json.loads(message["text"])
+                    except ValueError:
+                        control = {}
+                    if control.get("type") == "end":
+                        break
+        finally:
+            ended.set()
+            frame_ready.set()
+
+    async def analyze():
+        while True:
+            item, latest["frame"] = latest["frame"], None
+            if item is None:
+                if ended.is_set():
+                    return
+                frame_ready.clear()
+                await frame_ready.wait()
+                continue
+            jpeg, received_at = item
+            try:
+                result = await run_in_threadpool(session.process_frame, jpeg)
+            except ValueError as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            stats.record(time.perf_counter() - received_at)
+            await websocket.send_json({
+                "type": "frame",
+                **result,
+                "latency_ms": round((time.perf_counter() - received_at) * 1000, 1),
+                **stats.counters()
+            })
+
+    receiver = asyncio.create_task(receive())
+    try:
+        await analyze()
+        prediction = await run_in_threadpool(session.finish)
+        summary = stats.summary()
+        logger.info(f"Live stream ended: {summary['processed']} frames analyzed, {summary['dropped']} dropped, "
+                    f"{summary['mean_fps']} fps")
+        await websocket.send_json({"type": "summary", "prediction": prediction, **summary})
+        await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        # The client went away; nothing left to send
+        logger.info(f"Live stream disconnected after {stats.processed} frames")
+    finally:
+        receiver.cancel()
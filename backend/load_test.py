@@ -0,0 +1,597 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import random
+import urllib.request
+import urllib.error
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from synthetic_media import make_video
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Endpoints that should answer in milliseconds whatever the analysis load
+LIGHT_ENDPOINTS = ["/", "/model/status"]
+
+
+def prepare_workdir(workdir: str):
+    """Share the backend's models and micro-expression dataset with a server running in workdir"""
+    for name in ("models", "micro_expression_dataset"):
+        source = os.path.join(BACKEND_DIR, name)
+        if os.path.exists(source):
+            os.symlink(source, os.path.join(workdir, name))
+
+
+def server_env(backend: str, processes: int) -> dict:
+    """Get the configuration (environment variables) of a started server"""
+    return {
+        "ANALYZER_BACKEND": backend,
+        "ANALYSIS_PROCESSES": str(processes),
+        # Every upload is a new video; matching them against each other would skip the work
+        "FINGERPRINT_MATCHING": "0",
+        "STAGE_CACHE_MAX_BYTES": "0"
+    }
+
+
+def start_server(backend: str, processes: int, port: int, workdir: str) -> subprocess.Popen:
+    """
+    Start simple_app under uvicorn in a scratch directory (sharing the
+    backend's models) and wait until it answers
+    """
+    prepare_workdir(workdir)
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, **server_env(backend, processes))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "simple_app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=open(os.path.join(workdir, "server.log"), "wb"), stderr=subprocess.STDOUT
+    )
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited, see {os.path.join(workdir, 'server.log')}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return server
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("Server did not start within 120s")
+
+
+@contextmanager
+def serve_in_process(backend: str, processes: int, port: int, workdir: str):
+    """
+    Serve simple_app with uvicorn on a thread of this process, from a
+    scratch directory, for the enclosed block. Handy for profiling the
+    server together with the load; the clients share the interpreter (and
+    the GIL) with it, so a separate server gives truer numbers.
+
+    simple_app reads its configuration from the environment and resolves
+    relative paths against the working directory, so both are changed
+    while the server runs and restored once it has stopped.
+
+    Yields:
+        The uvicorn server
+    """
+    saved_environ = dict(os.environ)
+    saved_cwd = os.getcwd()
+    try:
+        prepare_workdir(workdir)
+        os.environ.update(server_env(backend, processes))
+        os.chdir(workdir)
+        import uvicorn
+        import simple_app
+
+        server = uvicorn.Server(uvicorn.Config(simple_app.app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True, name="uvicorn")
+        thread.start()
+        try:
+            deadline = time.monotonic() + 120
+            while not server.started:
+                if not thread.is_alive():
+                    raise RuntimeError("In-process server exited")
+                if time.monotonic() > deadline:
+                    raise RuntimeError("In-process server did not start within 120s")
+                time.sleep(0.1)
+            yield server
+        finally:
+            server.should_exit = True
+            thread.join(timeout=60)
+    finally:
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+
+def wait_for_workers(url: str, timeout: float = 300):
+    """
+    Wait until the server's analysis workers have loaded their models, so
+    model loading isn't measured as load
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with urllib.request.urlopen(f"{url}/jobs/stats", timeout=10) as response:
+            pool = json.loads(response.read()).get("analysis_pool")
+        if pool is None or pool["ready"] >= pool["processes"]:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"Analysis workers not ready within {timeout:.0f}s")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def submit(url: str, video: bytes, wait: float, suffix: Optional[bytes] = None) -> dict:
+    """
+    Upload a video, returning its job (finished if it was cached or done
+    within wait). Trailing bytes, random unless given, make the upload a
+    distinct file, so it isn't answered from the result cache; uploads
+    with the same suffix are the same file.
+    """
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"load.avi\"\r\n"
+            f"Content-Type: video/x-msvideo\r\n\r\n").encode() + video + (suffix or os.urandom(32)) + \
+        f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(f"{url}/upload?wait={wait}", data=body, method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(request, timeout=wait + 30) as response:
+        return json.loads(response.read())
+
+
+def poll(url: str, job: dict, wait: float) -> dict:
+    """
+    Poll a job until it has finished
+    """
+    while job["status"] in ("queued", "running"):
+        with urllib.request.urlopen(f"{url}/results/{job['job_id']}?wait={wait}", timeout=wait + 30) as response:
+            job = json.loads(response.read())
+    return job
+
+
+def upload(url: str, video: bytes, wait: float) -> dict:
+    """
+    Upload a distinct copy of a video and wait for its result
+    """
+    return poll(url, submit(url, video, wait), wait)
+
+
+class LoadRecorder:
+    """
+    Latencies of the light requests, and the uploads finished, per phase
+    """
+    def __init__(self):
+        self.phase = None
+        self.latencies = {}
+        self.uploads = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add_latency(self, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(self.phase, []).append(seconds)
+
+    def add_upload(self, seconds: float, status: str):
+        with self._lock:
+            self.uploads.setdefault(self.phase, []).append((seconds, status))
+
+
+def light_client(url: str, recorder: LoadRecorder, stop: threading.Event, interval: float):
+    i = 0
+    while not stop.is_set():
+        endpoint = LIGHT_ENDPOINTS[i % len(LIGHT_ENDPOINTS)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            urllib.request.urlopen(f"{url}{endpoint}", timeout=30).read()
+            recorder.add_latency(time.perf_counter() - started)
+        except Exception:
+            recorder.errors += 1
+        stop.wait(interval)
+
+
+def heavy_client(url: str, video: bytes, recorder: LoadRecorder, stop: threading.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            job = upload(url, video, wait=60)
+            recorder.add_upload(time.perf_counter() - started, job["status"])
+        except Exception as e:
+            logger.warning(f"Upload failed: {str(e)}")
+            recorder.errors += 1
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ms = np.array(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(ms, 99)), 1),
+        "max_ms": round(float(ms.max()), 1)
+    }
+
+
+def run_load_test(url: str, video: bytes, duration: float, light_clients: int, heavy_clients: int,
+                  light_interval: float) -> dict:
+    """
+    Measure light endpoint latency alone (baseline), then while uploads are
+    analyzed continuously (load)
+
+    Returns:
+        Report with per-phase latency percentiles and upload counts
+    """
+    recorder = LoadRecorder()
+    stop_light = threading.Event()
+    stop_heavy = threading.Event()
+
+    recorder.phase = "baseline"
+    light_threads = [threading.Thread(target=light_client, args=(url, recorder, stop_light, light_interval), daemon=True)
+                     for _ in range(light_clients)]
+    for thread in light_threads:
+        thread.start()
+    logger.info(f"Baseline: {light_clients} light clients for {duration:.0f}s")
+    time.sleep(duration)
+
+    # Heavy clients start first so the load phase only measures a saturated server
+    heavy_threads = [threading.Thread(target=heavy_client, args=(url, video, recorder, stop_heavy), daemon=True)
+                     for _ in range(heavy_clients)]
+    recorder.phase = "warmup"
+    for thread in heavy_threads:
+        thread.start()
+    time.sleep(min(5.0, duration / 4))
+    recorder.phase = "load"
+    logger.info(f"Load: {light_clients} light clients and {heavy_clients} uploading clients for {duration:.0f}s")
+    time.sleep(duration)
+
+    stop_light.set()
+    recorder.phase = "drain"
+    stop_heavy.set()
+    for thread in light_threads + heavy_threads:
+        thread.join(timeout=120)
+
+    report = {"url": url, "duration": duration, "light_clients": light_clients,
+              "heavy_clients": heavy_clients, "errors": recorder.errors}
+    for phase in ("baseline", "load"):
+        report[phase] = percentiles(recorder.latencies.get(phase, []))
+    uploads = recorder.uploads.get("load", []) + recorder.uploads.get("drain", [])
+    report["uploads"] = {
+        "finished": len(uploads),
+        "failed": sum(1 for _, status in uploads if status != "done"),
+        "mean_seconds": round(float(np.mean([s for s, _ in uploads])), 2) if uploads else None
+    }
+    if report["baseline"]["count"] and report["load"]["count"]:
+        report["p99_ratio"] = round(report["load"]["p99_ms"] / max(report["baseline"]["p99_ms"], 1e-3), 2)
+    return report
+
+
+# Outcomes of an open-loop upload: analyzed (a new job ran), cached (exact
+# result cache hit), fingerprint (perceptual match of a cached video),
+# coalesced (joined the active job of an identical upload), failed (the job
+# failed), rejected (429/503 from admission control), error (other HTTP or
+# connection errors) and dropped (not sent: --max-in-flight requests pending)
+OUTCOMES = ["analyzed", "cached", "fingerprint", "coalesced", "failed", "rejected", "error", "dropped"]
+CACHE_HITS = ("cached", "fingerprint")
+# Metrics compared across reports: (key path in a step, higher is better)
+COMPARED = [
+    (("throughput_rps",), True),
+    (("latency", "p50_ms"), False),
+    (("latency", "p95_ms"), False),
+    (("latency", "p99_ms"), False),
+    (("error_rate",), False),
+    (("rejection_rate",), False),
+    (("cache_hit_ratio",), True),
+]
+
+
+class OpenLoopRecorder:
+    """
+    Outcomes and latencies of the uploads of one open-loop step
+    """
+    def __init__(self):
+        self.requests = []
+        self.jobs = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.last_finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def joined(self, job_id: str) -> bool:
+        """Register a job, returning True if an earlier upload of this step already got it"""
+        with self._lock:
+            if job_id in self.jobs:
+                return True
+            self.jobs.add(job_id)
+            return False
+
+    def add(self, kind: str, outcome: str, seconds: Optional[float], sent: bool = True):
+        with self._lock:
+            self.requests.append((kind, outcome, seconds))
+            if sent:
+                self.in_flight -= 1
+                self.last_finished = time.perf_counter()
+
+
+def open_loop_request(url: str, video: bytes, suffix: bytes, kind: str, arrival: float,
+                      recorder: OpenLoopRecorder, wait: float):
+    """
+    Upload a video and follow its job to the end, recording the outcome and
+    the latency from the scheduled arrival
+    """
+    outcome = None
+    try:
+        job = submit(url, video, 0, suffix)
+        if job["status"] == "done" and job["stage"] == "cached":
+            outcome = "cached"
+        elif recorder.joined(job["job_id"]):
+            outcome = "coalesced"
+        job = poll(url, job, wait)
+        if job["status"] != "done":
+            outcome = "failed"
+        elif outcome is None:
+            outcome = "fingerprint" if job["result"].get("cache_hit") == "fingerprint" else "analyzed"
+    except urllib.error.HTTPError as e:
+        outcome = "rejected" if e.code in (429, 503) else "error"
+    except Exception as e:
+        logger.warning(f"Upload failed: {str(e)}")
+        outcome = "error"
+    recorder.add(kind, outcome, time.perf_counter() - arrival)
+
+
+def step_report(recorder: OpenLoopRecorder, rate: float, duration: float, started: float, unfinished: int) -> dict:
+    """
+    Summarize an open-loop step (uploads unfinished after the drain timeout count as errors)
+
+    Returns:
+        Arrivals and offered rate, throughput (finished analyses and cache
+        hits per second), outcome counts, error, rejection and cache hit
+        ratios, and latency percentiles overall and per upload kind
+    """
+    requests = recorder.requests
+    outcomes = {outcome: sum(1 for _, o, _ in requests if o == outcome) for outcome in OUTCOMES}
+    outcomes["error"] += unfinished
+    succeeded = [(kind, outcome, seconds) for kind, outcome, seconds in requests
+                 if outcome not in ("failed", "rejected", "error", "dropped")]
+    arrivals = len(requests) + unfinished
+    elapsed = (recorder.last_finished or started) - started
+    return {
+        "rate": rate,
+        "arrivals": arrivals,
+        "offered_rps": round(arrivals / duration, 3),
+        "throughput_rps": round(len(succeeded) / elapsed, 3) if elapsed > 0 else 0.0,
+        "outcomes": outcomes,
+        "error_rate": round((outcomes["failed"] + outcomes["error"] + outcomes["dropped"]) / arrivals, 4) if arrivals else 0.0,
+        "rejection_rate": round(outcomes["rejected"] / arrivals, 4) if arrivals else 0.0,
+        "cache_hit_ratio": round(sum(outcomes[o] for o in CACHE_HITS) / len(succeeded), 4) if succeeded else 0.0,
+        "peak_in_flight": recorder.peak_in_flight,
+        "unfinished": unfinished,
+        "latency": percentiles([seconds for _, _, seconds in succeeded]),
+        "latency_by_kind": {kind: percentiles([seconds for k, _, seconds in succeeded if k == kind])
+                            for kind in ("unique", "duplicate")}
+    }
+
+
+def run_open_loop(url: str, video: bytes, rates: List[float], duration: float, duplicate_ratio: float,
+                  max_in_flight: int, wait: float, drain_timeout: float, seed: int) -> List[dict]:
+    """
+    Upload at each target rate in turn for duration seconds, with Poisson
+    arrivals that don't wait for earlier uploads to finish (open loop), so
+    a server slower than the rate builds a queue and its latency shows it
+
+    Args:
+        url: Server to test
+        video: Video to upload (unique uploads append random bytes to it)
+        rates: Target upload rates (per second), one step each
+        duration: Seconds of arrivals per step
+        duplicate_ratio: Share of uploads repeating an earlier unique upload of the run
+        max_in_flight: Pending uploads beyond which arrivals are dropped (client limit)
+        wait: Long-poll seconds of the result requests
+        drain_timeout: Seconds to wait for pending uploads after a step's arrivals
+        seed: Seed of the arrival times and the unique/duplicate choices
+
+    Returns:
+        One report per step (see step_report)
+    """
+    rng = random.Random(seed)
+    # Suffixes of the unique uploads so far, which duplicates repeat
+    uploaded = []
+    steps = []
+    for rate in rates:
+        recorder = OpenLoopRecorder()
+        threads = []
+        logger.info(f"Open loop: {rate:g} uploads/s for {duration:.0f}s ({duplicate_ratio:.0%} duplicates)")
+        started = time.perf_counter()
+        arrival = started
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival >= started + duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            if uploaded and rng.random() < duplicate_ratio:
+                kind, suffix = "duplicate", rng.choice(uploaded)
+            else:
+                # Random rather than seeded, so a rerun against the same server isn't all cache hits
+                kind, suffix = "unique", os.urandom(32)
+                uploaded.append(suffix)
+            if recorder.in_flight >= max_in_flight:
+                recorder.add(kind, "dropped", None, sent=False)
+                continue
+            recorder.start()
+            thread = threading.Thread(target=open_loop_request,
+                                      args=(url, video, suffix, kind, arrival, recorder, wait), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        deadline = time.monotonic() + drain_timeout
+        for thread in threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        unfinished = sum(1 for thread in threads if thread.is_alive())
+        step = step_report(recorder, rate, duration, started, unfinished)
+        logger.info(f"{rate:g}/s: {step['throughput_rps']:.2f} done/s, p99 {step['latency'].get('p99_ms')} ms, "
+                    f"errors {step['error_rate']:.1%}, rejected {step['rejection_rate']:.1%}, "
+                    f"cache hits {step['cache_hit_ratio']:.1%}")
+        steps.append(step)
+    return steps
+
+
+def compare_reports(previous: dict, current: dict) -> List[Dict]:
+    """
+    Compare the steps of two open-loop reports that ran at the same rates
+
+    Returns:
+        One row per step and metric: the previous and current values, the
+        relative change and whether it is an improvement
+    """
+    rows = []
+    previous_steps = {step["rate"]: step for step in previous.get("steps", [])}
+    for step in current.get("steps", []):
+        before = previous_steps.get(step["rate"])
+        if before is None:
+            continue
+        for path, higher_is_better in COMPARED:
+            old, new = before, step
+            for key in path:
+                old, new = (old or {}).get(key), (new or {}).get(key)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else None
+            rows.append({
+                "rate": step["rate"],
+                "metric": ".".join(path),
+                "previous": old,
+                "current": new,
+                "change": round(change, 4) if change is not None else None,
+                "better": new == old or (new > old) == higher_is_better
+            })
+    return rows
+
+
+def parse_rates(value: str) -> List[float]:
+    """
+    Parse the comma-separated upload rates of --rate (each must be positive)
+    """
+    try:
+        rates = [float(rate) for rate in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a list of numbers: {value}")
+    if any(not rate > 0 for rate in rates):
+        raise argparse.ArgumentTypeError(f"rates must be positive: {value}")
+    return rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API: check that light endpoints stay responsive while "
+                                                 "uploads are analyzed, or (with --rate) upload at target rates")
+    parser.add_argument("--url", type=str, default=None, help="Server to test (default: start one)")
+    parser.add_argument("--in-process", action="store_true", help="Start the server on a thread of this process")
+    parser.add_argument("--backend", type=str, default="full", help="ANALYZER_BACKEND of the started server")
+    parser.add_argument("--processes", type=int, default=2, help="ANALYSIS_PROCESSES of the started server")
+    parser.add_argument("--video", type=str, default=None, help="Video to upload (default: a synthetic face video)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per phase (or per rate)")
+    parser.add_argument("--light-clients", type=int, default=4, help="Concurrent clients of the light endpoints")
+    parser.add_argument("--heavy-clients", type=int, default=4, help="Concurrent uploading clients")
+    parser.add_argument("--light-interval", type=float, default=0.05, help="Pause between a light client's requests")
+    parser.add_argument("--rate", type=parse_rates, default=None,
+                        help="Comma-separated upload rates (per second): run an open-loop test at each in turn")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="Share of open-loop uploads repeating an earlier upload")
+    parser.add_argument("--max-in-flight", type=int, default=256,
+                        help="Pending open-loop uploads beyond which arrivals are dropped")
+    parser.add_argument("--wait", type=float, default=60, help="Long-poll seconds of the result requests")
+    parser.add_argument("--drain-timeout", type=float, default=300,
+                        help="Seconds to wait for pending uploads after each rate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the open-loop arrivals")
+    parser.add_argument("--compare", type=str, default=None, help="Open-loop report to compare the results with")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    cwd = os.getcwd()
+    server = None
+    in_process = ExitStack()
+    try:
+        video_path = args.video
+        if video_path is None:
+            video_path = os.path.join(workdir, "face.avi")
+            make_video(video_path)
+        with open(video_path, "rb") as f:
+            video = f.read()
+
+        url = args.url
+        if url is not None:
+            wait_for_workers(url)
+        else:
+            port = free_port()
+            logger.info(f"Starting server ({args.backend} analyzer, {args.processes} analysis processes) on port {port}"
+                        f"{' in process' if args.in_process else ''}")
+            if args.in_process:
+                in_process.enter_context(serve_in_process(args.backend, args.processes, port, workdir))
+            else:
+                server = start_server(args.backend, args.processes, port, workdir)
+            url = f"http://127.0.0.1:{port}"
+            wait_for_workers(url)
+
+        if args.rate is None:
+            report = run_load_test(url.rstrip("/"), video, args.duration, args.light_clients,
+                                   args.heavy_clients, args.light_interval)
+        else:
+            # Only settings go next to the steps (no ports or timestamps), so reports of two releases diff cleanly
+            report = {
+                "mode": "open_loop",
+                "target": "url" if args.url else "in_process" if args.in_process else "server",
+                "backend": None if args.url else args.backend,
+                "processes": None if args.url else args.processes,
+                "video_bytes": len(video),
+                "duration": args.duration,
+                "duplicate_ratio": args.duplicate_ratio,
+                "max_in_flight": args.max_in_flight,
+                "seed": args.seed,
+                "steps": run_open_loop(url.rstrip("/"), video, args.rate, args.duration, args.duplicate_ratio,
+                                       args.max_in_flight, args.wait, args.drain_timeout, args.seed)
+            }
+        print(json.dumps(report, indent=2, sort_keys=True))
+        if args.output:
+            with open(os.path.join(cwd, args.output), "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+        if args.compare:
+            with open(os.path.join(cwd, args.compare)) as f:
+                previous = json.load(f)
+            for row in compare_reports(previous, report):
+                change = f"{row['change']:+.1%}" if row["change"] is not None else "n/a"
+                print(f"{row['rate']:>8g}/s  {row['metric']:<16} {row['previous']:>10} -> {row['current']:<10} "
+                      f"{change:>8}  {'ok' if row['better'] else 'worse'}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        in_process.close()
+        shutil.rmtree(workdir, ignore_errors=True)
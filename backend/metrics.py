@@ -0,0 +1,400 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from profiling import current_trace
+from process_memory import memory_tracker
+
+logger = logging.getLogger(__name__)
+
+# Prefix of every exported metric name
+NAMESPACE = "truthsense"
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Upper bounds (bytes) of the memory histogram buckets: 1 MiB to 8 GiB
+SIZE_BUCKETS = tuple(float(2 ** i * 1024 * 1024) for i in range(14))
+
+# Exported metrics: name -> (type, help)
+METRICS = {
+    "stage_duration_seconds": ("histogram", "Time spent in a pipeline stage (per video, per frame for gallery_scoring)"),
+    "http_requests_total": ("counter", "HTTP requests by method, route and status code"),
+    "http_request_duration_seconds": ("histogram", "Time to respond to an HTTP request (until the response starts)"),
+    "cache_lookups_total": ("counter", "Result cache lookups by outcome"),
+    "jobs_finished_total": ("counter", "Analysis jobs finished, by status"),
+    "stage_memory_growth_bytes_total": ("counter", "Memory a pipeline stage grew the process by (RSS, or tracemalloc-traced allocations)"),
+    "request_peak_memory_bytes": ("histogram", "Peak memory of an analysis above the process's memory when it started"),
+}
+
+# Histograms not measured in seconds: name -> bucket upper bounds
+BUCKETS = {
+    "request_peak_memory_bytes": SIZE_BUCKETS,
+}
+
+# Snapshot in a shared directory that the snapshots of exited processes are added up in
+RETIRED_SNAPSHOT = "exited.json"
+
+# Labels are stored as a sorted tuple of (name, value) pairs
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """
+    Counters and histograms of this process, exported in the Prometheus
+    text format (see render).
+
+    Recording is cheap enough to leave on in production: a histogram
+    observation is a bisect over the bucket bounds and two additions under
+    a lock, with no allocation once the series exists. Stages are timed
+    with span (a context manager) or record.
+
+    Other processes report into one place with snapshots: analysis worker
+    processes drain theirs after every task and the server merges them
+    (see analysis_pool.py), and pre-forked server workers write theirs to a
+    shared directory that /metrics reads (see start_sharing).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> [count per bucket (the last one is +Inf)..., sum]
+        self._histograms = {}
+        self._sharing_stop = None
+        self._sharing_thread = None
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        """
+        Increase a counter
+
+        Args:
+            name: Metric name (see METRICS)
+            amount: Amount to add
+            labels: Label values of the series
+        """
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Add an observation (in seconds, or bytes for the memory histograms) to a histogram
+
+        Args:
+            name: Metric name (see METRICS)
+            value: Observed value
+            labels: Label values of the series
+        """
+        key = (name, _labels(labels))
+        buckets = BUCKETS.get(name, DURATION_BUCKETS)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def record(self, stage: str, seconds: float):
+        """
+        Record the time spent in a pipeline stage
+        """
+        self.observe("stage_duration_seconds", seconds, stage=stage)
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Time the enclosed block as a pipeline stage (also when it raises),
+        add it to the trace of the request if it is traced, and account the
+        memory the process grew by during it (see process_memory.MemoryTracker)
+        """
+        trace = current_trace()
+        memory = memory_tracker.begin_stage()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.record(stage, seconds)
+            if trace is not None:
+                trace.add(stage, time.time() - seconds, seconds)
+            if memory is not None:
+                for source, growth in memory_tracker.end_stage(memory).items():
+                    self.inc("stage_memory_growth_bytes_total", growth, stage=stage, source=source)
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        Get the recorded values as JSON-serializable data (for merge)
+
+        Args:
+            reset: Clear the recorded values, so the next snapshot only has what
+                was recorded since (e.g. to ship them to another process)
+        """
+        with self._lock:
+            snapshot = _snapshot(self._counters, self._histograms)
+            if reset:
+                self._counters = {}
+                self._histograms = {}
+        return snapshot
+
+    def drain(self) -> Dict[str, Any]:
+        """
+        Take the values recorded since the last drain
+        """
+        return self.snapshot(reset=True)
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """
+        Add the values of a snapshot (e.g. drained in another process) to this process's
+        """
+        with self._lock:
+            _merge_into(self._counters, self._histograms, snapshot)
+
+    def render(self, snapshots: Iterable[Dict[str, Any]] = (),
+               gauges: Iterable[Tuple[str, str, Dict[str, Any], float]] = ()) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format
+
+        Args:
+            snapshots: Snapshots of other processes to add to this process's values
+            gauges: (name, help, labels, value) of values sampled at scrape time
+                (queue depths, cache sizes)
+
+        Returns:
+            The exposition text
+        """
+        counters, histograms = {}, {}
+        _merge_into(counters, histograms, self.snapshot())
+        for snapshot in snapshots:
+            _merge_into(counters, histograms, snapshot)
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            full_name = f"{NAMESPACE}_{name}"
+            if kind == "counter":
+                series = sorted((labels, value) for (series_name, labels), value in counters.items()
+                                if series_name == name)
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} counter")
+                for labels, value in series:
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+            else:
+                series = sorted((labels, values) for (series_name, labels), values in histograms.items()
+                                if series_name == name)
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, values in series:
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS.get(name, DURATION_BUCKETS) + (float("inf"),), values[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+
+        described = set()
+        for name, help_text, labels, value in gauges:
+            full_name = f"{NAMESPACE}_{name}"
+            if full_name not in described:
+                described.add(full_name)
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name}{_format_labels(_labels(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def start_sharing(self, directory: str, interval: float):
+        """
+        Write this process's snapshot to a directory shared by the processes
+        of one server every interval seconds (see shared_snapshots)
+
+        Args:
+            directory: Shared directory
+            interval: Seconds between writes
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._sharing_stop = threading.Event()
+
+        def share():
+            while not self._sharing_stop.wait(interval):
+                self.write_snapshot(directory)
+
+        self._sharing_thread = threading.Thread(target=share, daemon=True, name="metrics-sharing")
+        self._sharing_thread.start()
+
+    def stop_sharing(self, directory: Optional[str] = None):
+        """
+        Stop writing snapshots, writing a last one to directory if given
+        """
+        if self._sharing_stop is not None:
+            self._sharing_stop.set()
+            self._sharing_thread.join(timeout=5)
+            self._sharing_stop = None
+        if directory is not None:
+            self.write_snapshot(directory)
+
+    def write_snapshot(self, directory: str):
+        """Write this process's snapshot to <directory>/<pid>.json"""
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+    @staticmethod
+    def shared_snapshots(directory: str) -> List[Dict[str, Any]]:
+        """
+        Read the snapshots the other processes wrote to a shared directory.
+        Those of exited processes are added up in RETIRED_SNAPSHOT (see
+        retire_snapshot), so counters never go back.
+        """
+        own = f"{os.getpid()}.json"
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        snapshots = {}
+        for name in names:
+            if not name.endswith(".json") or name == own:
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots[name] = json.load(f)
+            except FileNotFoundError:
+                # Retired meanwhile
+                continue
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read metrics snapshot {name}: {str(e)}")
+        # A snapshot being retired may still be there after it was added up
+        retired = {f"{pid}.json" for pid in snapshots.get(RETIRED_SNAPSHOT, {}).get("pids", [])}
+        return [snapshot for name, snapshot in snapshots.items() if name not in retired]
+
+    @staticmethod
+    def retire_snapshot(directory: str, pid: int):
+        """
+        Add the snapshot of an exited process to RETIRED_SNAPSHOT and delete
+        it, so the directory holds one file per live process (called by the
+        process that reaped it, the only writer of RETIRED_SNAPSHOT)
+
+        Args:
+            directory: Shared directory
+            pid: Process id of the exited process
+        """
+        path = os.path.join(directory, f"{pid}.json")
+        retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+        try:
+            # Left behind if the process died while writing
+            os.remove(f"{path}.tmp")
+        except OSError:
+            pass
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read metrics snapshot of pid {pid}: {str(e)}")
+            snapshot = {}
+
+        counters, histograms, pids = {}, {}, []
+        try:
+            with open(retired_path) as f:
+                retired = json.load(f)
+            _merge_into(counters, histograms, retired)
+            # Pids whose snapshot is still there (removing it failed)
+            pids = [p for p in retired.get("pids", []) if os.path.exists(os.path.join(directory, f"{p}.json"))]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read retired metrics snapshot: {str(e)}")
+        _merge_into(counters, histograms, snapshot)
+        retired = dict(_snapshot(counters, histograms), pids=pids + [pid])
+
+        tmp_path = f"{retired_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(retired, f)
+            os.replace(tmp_path, retired_path)
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not retire metrics snapshot of pid {pid}: {str(e)}")
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware counting HTTP requests and timing them until their
+    response starts (streamed responses such as SSE would otherwise count
+    their whole lifetime). Requests are labelled with their route template,
+    so /results/{job_id} is one series rather than one per job.
+    """
+    def __init__(self, app, registry: Optional[Metrics] = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500, "seconds": None}
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["seconds"] = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            seconds = status["seconds"] if status["seconds"] is not None else time.perf_counter() - started
+            self.registry.inc("http_requests_total", method=scope["method"], route=path, status=status["code"])
+            self.registry.observe("http_request_duration_seconds", seconds, route=path)
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _snapshot(counters: Dict, histograms: Dict) -> Dict[str, Any]:
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, list(labels), list(values)] for (name, labels), values in histograms.items()]
+    }
+
+
+def _merge_into(counters: Dict, histograms: Dict, snapshot: Dict[str, Any]):
+    for name, labels, value in snapshot.get("counters", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0.0) + value
+    for name, labels, values in snapshot.get("histograms", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histograms[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                histogram[i] += value
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Metrics of this process
+metrics = Metrics()
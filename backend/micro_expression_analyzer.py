@@ -5,6 +5,9 @@ import logging
 from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
+from metrics import metrics
+from cancellation import check
+
 logger = logging.getLogger(__name__)
 
 class MicroExpressionAnalyzer:
@@ -129,32 +132,18 @@ class MicroExpressionAnalyzer:
         """
         Compute local binary pattern for facial texture analysis
         """
-        # Simple LBP implementation
+        # Simple LBP implementation, vectorized: each neighbour sets one bit
+        # of the code for every interior pixel at once
         lbp = np.zeros_like(image)
-        for i in range(radius, image.shape[0] - radius):
-            for j in range(radius, image.shape[1] - radius):
-                center = image[i, j]
-                binary_code = 0
-                
-                # Compare with neighbors
-                if image[i - radius, j - radius] >= center:
-                    binary_code += 1
-                if image[i - radius, j] >= center:
-                    binary_code += 2
-                if image[i - radius, j + radius] >= center:
-                    binary_code += 4
-                if image[i, j + radius] >= center:
-                    binary_code += 8
-                if image[i + radius, j + radius] >= center:
-                    binary_code += 16
-                if image[i + radius, j] >= center:
-                    binary_code += 32
-                if image[i + radius, j - radius] >= center:
-                    binary_code += 64
-                if image[i, j - radius] >= center:
-                    binary_code += 128
-                
-                lbp[i, j] = binary_code
+        height, width = image.shape
+        center = image[radius:height - radius, radius:width - radius]
+        neighbours = [(-radius, -radius), (-radius, 0), (-radius, radius), (0, radius),
+                      (radius, radius), (radius, 0), (radius, -radius), (0, -radius)]
+        codes = np.zeros(center.shape, dtype=np.int64)
+        for bit, (di, dj) in enumerate(neighbours):
+            neighbour = image[radius + di:height - radius + di, radius + dj:width - radius + dj]
+            codes += (neighbour >= center).astype(np.int64) << bit
+        lbp[radius:height - radius, radius:width - radius] = codes
         
         return lbp
     
@@ -172,6 +161,11 @@ class MicroExpressionAnalyzer:
             logger.warning("Dataset not loaded, cannot analyze frame")
             return "unknown", 0.5
         
+        with metrics.span("gallery_scoring"):
+            return self._score_against_gallery(face_frame)
+    
+    def _score_against_gallery(self, face_frame) -> Tuple[str, float]:
+        """Compare a face with the truth and lie reference expressions (see analyze_frame)"""
         # Resize for consistency
         face_frame = cv2.resize(face_frame, (224, 224))
         # Convert to grayscale for feature extraction
@@ -244,12 +238,15 @@ class MicroExpressionAnalyzer:
                 chi += ((hist1[i] - hist2[i]) ** 2) / (hist1[i] + hist2[i])
         return chi
     
-    def analyze_video_frames(self, face_frames: List[np.ndarray]) -> Dict[str, Any]:
+    def analyze_video_frames(self, face_frames: List[np.ndarray],
+                             frame_results: Optional[List[Tuple[str, float]]] = None) -> Dict[str, Any]:
         """
         Analyze multiple facial frames from a video
         
         Args:
             face_frames: List of BGR images of faces
+            frame_results: analyze_frame results of the frames if already
+                computed (e.g. while the faces were extracted)
             
         Returns:
             Dictionary with prediction results
@@ -263,10 +260,13 @@ class MicroExpressionAnalyzer:
             }
         
         # Analyze individual frames
-        frame_results = []
-        for frame in face_frames:
-            prediction, confidence = self.analyze_frame(frame)
-            frame_results.append((prediction, confidence))
+        if frame_results is None or len(frame_results) != len(face_frames):
+            frame_results = []
+            for frame in face_frames:
+                # Stop here if the branch running this timed out (see Predictor.predict)
+                check()
+                prediction, confidence = self.analyze_frame(frame)
+                frame_results.append((prediction, confidence))
         
         # Count predictions
         truth_count = sum(1 for res in frame_results if res[0] == "truth")
@@ -63,14 +63,45 @@ class LieDetectionModel(nn.Module):
             nn.Linear(32, num_classes)
         )
     
+    def encode_frames(self, frames):
+        """
+        Run the CNN on a batch of frames
+        
+        Args:
+            frames: (N, 3, H, W) tensor
+            
+        Returns:
+            (N, 128) per-frame embeddings
+        """
+        return self.cnn(frames).squeeze(-1).squeeze(-1)
+    
+    def classify(self, lstm_features, audio_features):
+        """
+        Fuse the last LSTM output with the audio features and classify
+        
+        Args:
+            lstm_features: (batch, 64) LSTM output
+            audio_features: (batch, 20) audio features
+            
+        Returns:
+            (batch, num_classes) logits
+        """
+        # Process audio features
+        audio_features = self.audio_fc(audio_features)  # (batch, 32)
+        
+        # Concatenate visual and audio features
+        combined_features = torch.cat([lstm_features, audio_features], dim=1)
+        
+        # Classification
+        return self.classifier(combined_features)
+    
     def forward(self, frames, audio_features):
         batch_size, seq_len, c, h, w = frames.shape
         
         # Process each frame with CNN
         cnn_features = []
         for t in range(seq_len):
-            frame_features = self.cnn(frames[:, t])  # (batch, 128, 1, 1)
-            frame_features = frame_features.squeeze(-1).squeeze(-1)  # (batch, 128)
+            frame_features = self.encode_frames(frames[:, t])  # (batch, 128)
             cnn_features.append(frame_features)
         
         # Stack features for LSTM
@@ -80,16 +111,7 @@ class LieDetectionModel(nn.Module):
         lstm_out, _ = self.lstm(cnn_features)  # (batch, seq_len, 64)
         lstm_features = lstm_out[:, -1, :]  # Take the last output
         
-        # Process audio features
-        audio_features = self.audio_fc(audio_features)  # (batch, 32)
-        
-        # Concatenate visual and audio features
-        combined_features = torch.cat([lstm_features, audio_features], dim=1)
-        
-        # Classification
-        output = self.classifier(combined_features)
-        
-        return output
+        return self.classify(lstm_features, audio_features)
 
 class VideoDataset(Dataset):
     def __init__(self, data_dir, transform=None):
@@ -304,8 +326,15 @@ class ModelTrainer:
                 "model_path": final_model_path
             }
             
-            with open(os.path.join(self.model_dir, "model_metadata.json"), "w") as f:
+            # Per-version metadata next to the checkpoint, for the model registry
+            with open(os.path.splitext(final_model_path)[0] + ".json", "w") as f:
+                json.dump(metadata, f, indent=4)
+            
+            # Publish the new version atomically; running predictors may be watching this file
+            metadata_path = os.path.join(self.model_dir, "model_metadata.json")
+            with open(metadata_path + ".tmp", "w") as f:
                 json.dump(metadata, f, indent=4)
+            os.replace(metadata_path + ".tmp", metadata_path)
             
             logger.info(f"Model training completed in {time.time() - start_time:.2f} seconds")
             logger.info(f"Best accuracy: {best_accuracy:.2f}%")
@@ -0,0 +1,229 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlparse, unquote
+
+from upload_ingest import IngestedUpload
+from sqlite_store import SQLiteStore
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Size of the reads when hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class PathNotAllowed(Exception):
+    """Raised when a path is outside the allow-listed roots (or path ingestion is disabled)"""
+
+
+def is_within(path: str, root: str) -> bool:
+    """
+    Check whether a path is inside a directory, after resolving symlinks and ".."
+    """
+    path = os.path.realpath(path)
+    root = os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def resolve_path(path: str, roots: List[str]) -> str:
+    """
+    Resolve a server-side path or file:// URI to a file inside an allow-listed root
+
+    Args:
+        path: Absolute path, path relative to one of the roots, or file:// URI
+        roots: Directories files may be ingested from
+
+    Returns:
+        The real path of the file
+
+    Raises:
+        PathNotAllowed: If no roots are configured, the URI scheme isn't
+            file://, or the file (after resolving symlinks) is outside every root
+        FileNotFoundError: If the path is allowed but isn't a regular file
+    """
+    if not roots:
+        raise PathNotAllowed("Path ingestion is disabled (INGEST_ROOTS not set)")
+    if "://" in path:
+        uri = urlparse(path)
+        if uri.scheme != "file" or uri.netloc not in ("", "localhost"):
+            raise PathNotAllowed(f"Only file:// URIs can be ingested, not {uri.scheme}://")
+        path = unquote(uri.path)
+
+    # A relative path is looked up in every root, in order
+    candidates = [path] if os.path.isabs(path) else [os.path.join(root, path) for root in roots]
+    allowed = False
+    for candidate in candidates:
+        real_path = os.path.realpath(candidate)
+        if any(is_within(real_path, root) for root in roots):
+            allowed = True
+            if os.path.isfile(real_path):
+                return real_path
+    if allowed:
+        raise FileNotFoundError(f"No such file: {path}")
+    raise PathNotAllowed(f"Path is outside the ingestion roots: {path}")
+
+
+def hash_file(path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    Compute the SHA-256 of a file, reading it in chunks into one reused buffer
+
+    Args:
+        path: File to hash
+        chunk_size: Size of the reads
+
+    Returns:
+        Hex digest
+    """
+    hasher = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            # The file is read once from start to end: let the kernel read ahead further
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+class FileHashIndex(SQLiteStore):
+    """
+    Index of the SHA-256 of files on disk, keyed by path and validated by
+    stat, so an unchanged file (same size, mtime and inode) is never read
+    again to identify it.
+
+    Stored in SQLite, so every server process and batch_score.py run share
+    the hashes computed by any of them.
+    """
+    def __init__(self, db_path: str, chunk_size: int = HASH_CHUNK_SIZE):
+        """
+        Initialize the index
+
+        Args:
+            db_path: Path of the SQLite database
+            chunk_size: Size of the reads when hashing a file
+        """
+        super().__init__(db_path)
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        self.bytes_hashed = 0
+        self._stats_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, "
+                "inode INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, "
+                "hashed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS file_hashes_sha256 ON file_hashes (sha256)")
+
+    def hash(self, path: str) -> str:
+        """
+        Get the SHA-256 of a file, hashing it only if it is new or has changed
+
+        Args:
+            path: File to hash
+
+        Returns:
+            Hex digest
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        row = self._connection().execute(
+            "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+            (path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        ).fetchone()
+        if row is not None:
+            with self._stats_lock:
+                self.hits += 1
+            return row[0]
+
+        started = time.perf_counter()
+        sha256 = hash_file(path, self.chunk_size)
+        metrics.record("hashing", time.perf_counter() - started)
+        with self._stats_lock:
+            self.misses += 1
+            self.bytes_hashed += stat.st_size
+        # A file written to while it was read gets no entry; it is hashed again next time
+        if _stat_key(os.stat(path)) == _stat_key(stat):
+            self._connection().execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, inode, sha256, hashed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, sha256, time.time())
+            )
+        logger.info(f"Hashed {path} ({stat.st_size} bytes) in {time.perf_counter() - started:.2f}s")
+        return sha256
+
+    def path_for(self, sha256: str, roots: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Get a file with a hash that is unchanged since it was hashed (e.g. a
+        video ingested in place, to rescore it)
+
+        Args:
+            sha256: Hex digest of the file
+            roots: Only return files inside these directories (all if None)
+
+        Returns:
+            Path of the file, or None if no indexed file still has the hash
+        """
+        rows = self._connection().execute(
+            "SELECT path, size, mtime_ns, inode FROM file_hashes WHERE sha256 = ? ORDER BY hashed_at DESC", (sha256,)
+        ).fetchall()
+        for path, size, mtime_ns, inode in rows:
+            if roots is not None and not any(is_within(path, root) for root in roots):
+                continue
+            try:
+                if _stat_key(os.stat(path)) == (size, mtime_ns, inode):
+                    return path
+            except OSError:
+                continue
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the number of indexed files and the hit counters (counters are per process)
+        """
+        files = self._connection().execute("SELECT COUNT(*) FROM file_hashes").fetchone()[0]
+        return {"files": files, "hits": self.hits, "misses": self.misses, "bytes_hashed": self.bytes_hashed}
+
+
+def _stat_key(stat: os.stat_result):
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def ingest_path(path: str, roots: List[str], hash_index: FileHashIndex) -> IngestedUpload:
+    """
+    Ingest a server-side file in place: nothing is copied, the file is
+    analyzed where it is (and never deleted, see simple_app.release_upload)
+
+    Args:
+        path: Path or file:// URI (see resolve_path)
+        roots: Directories files may be ingested from
+        hash_index: Index of the hashes of known files
+
+    Returns:
+        The ingested file
+
+    Raises:
+        PathNotAllowed: If the file is outside the roots
+        FileNotFoundError: If there is no such file
+    """
+    real_path = resolve_path(path, roots)
+    sha256 = hash_index.hash(real_path)
+    upload = IngestedUpload(real_path, os.path.basename(real_path), sha256, os.path.getsize(real_path))
+    logger.info(f"Ingested {real_path} in place ({upload.size} bytes)")
+    return upload
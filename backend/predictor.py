@@ -2,33 +2,94 @@ import os
 import numpy as np
 import torch
 import logging
-import json
-from datetime import datetime
 from typing import Dict, Any, List, Optional
 import cv2
+import threading
+import time
 import traceback
+import concurrent.futures
+import contextvars
+import weakref
 
 logger = logging.getLogger(__name__)
 
-# Import the model definition
-from model_trainer import LieDetectionModel
+# Number of frames the CNN-LSTM model consumes per sequence
+SEQUENCE_LENGTH = 30
+# Side length of the square face crops fed to the model
+FRAME_SIZE = 224
+
+# Black crop used to pad sequences shorter than SEQUENCE_LENGTH
+BLACK_FRAME = np.zeros((FRAME_SIZE, FRAME_SIZE, 3), dtype=np.uint8)
+
+# Memory budget of the per-frame CNN embedding cache
+EMBEDDING_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Default per-branch timeouts (seconds) for Predictor.predict
+MODEL_BRANCH_TIMEOUT = 30.0
+MICRO_EXPR_BRANCH_TIMEOUT = 60.0
+# Threads running the prediction branches of all requests
+BRANCH_THREADS = 4
+# Timed-out branches still running after which the executor is replaced, so
+# they can't take up the threads of new requests
+MAX_ABANDONED_BRANCHES = BRANCH_THREADS // 2
+
+# Names used when logging prediction branch failures
+BRANCH_LABELS = {
+    "model": "CNN-LSTM model prediction",
+    "micro_expression": "micro-expression analysis"
+}
+
+# Import the model registry
+from model_registry import ModelRegistry
+from streaming_inference import StreamingSession, stream_predictions
+from embedding_cache import EmbeddingCache
+from metrics import metrics
+from profiling import traced
+from cancellation import cancellable, check
+
+# Predictors whose executor is replaced in a forked child (see Predictor._after_fork)
+_predictors = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for predictor in list(_predictors):
+        predictor._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
 
 class Predictor:
-    def __init__(self):
+    def __init__(self, watch_interval: Optional[float] = None, embedding_spill_dir: Optional[str] = None):
         """
         Initialize the predictor with the trained model
+        
+        Args:
+            watch_interval: If set, poll models/model_metadata.json every this many
+                seconds and hot-reload newly trained models
+            embedding_spill_dir: Directory to spill evicted CNN embeddings to (optional)
         """
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model_dir = "models"
-        self.model = None
-        self.model_loaded = False
-        self.model_version = None
-        self.last_trained = None
-        self.accuracy = None
+        self.registry = ModelRegistry(self.model_dir, self.device)
         self.micro_expr_analyzer = None
+        # Per-thread preallocated model input buffers (see _prepare_frames)
+        self._buffers = threading.local()
+        
+        # Cache of per-frame CNN embeddings, keyed by crop content and model version
+        self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_MAX_BYTES, embedding_spill_dir)
+        
+        # Executor shared by the prediction branches of all requests. Its threads don't
+        # survive a fork, so a forked process (see serve.py) gets a new one
+        self._executor_lock = threading.Lock()
+        self._create_executor()
+        _predictors.add(self)
+        self.model_timeout = MODEL_BRANCH_TIMEOUT
+        self.micro_expr_timeout = MICRO_EXPR_BRANCH_TIMEOUT
         
         # Try to load the latest model
         self._load_model()
+        if watch_interval:
+            self.registry.start_watching(watch_interval)
         
         # Try to initialize micro-expression analyzer (but don't fail if it doesn't work)
         try:
@@ -43,67 +104,101 @@ class Predictor:
         
         logger.info(f"Predictor initialized (device: {self.device}, model_loaded: {self.model_loaded})")
     
+    def _create_executor(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=BRANCH_THREADS, thread_name_prefix="predictor")
+        # Branches of this executor that timed out but are still running
+        self._abandoned = set()
+    
+    def _after_fork(self):
+        """The executor's threads (and a lock held by one of them) don't survive a fork"""
+        self._executor_lock = threading.Lock()
+        self._create_executor()
+    
+    def _submit_branch(self, fn, *args):
+        """
+        Run a prediction branch on the executor, in a copy of the caller's
+        context (so it is part of the request's trace)
+        
+        Returns:
+            Tuple of (future, cancellation event)
+        """
+        cancel = threading.Event()
+        # Under the lock, so _abandon can't shut the executor down between reading and submitting
+        with self._executor_lock:
+            future = self.executor.submit(contextvars.copy_context().run, self._run_branch, cancel, fn, *args)
+        return future, cancel
+    
+    def _abandon(self, future):
+        """
+        Account for a timed-out branch that keeps its thread until it reaches a
+        cancellation check. Once too many are running, new branches get a new
+        executor; the old one's threads exit as their branches finish.
+        """
+        with self._executor_lock:
+            abandoned = self._abandoned
+            abandoned.add(future)
+            future.add_done_callback(abandoned.discard)
+            if len(abandoned) < MAX_ABANDONED_BRANCHES:
+                return
+            old_executor = self.executor
+            self._create_executor()
+        logger.warning(f"{len(abandoned)} timed-out prediction branches still running; replacing the executor")
+        old_executor.shutdown(wait=False)
+    
     def _load_model(self):
         """
-        Load the latest trained model
+        Load the latest trained model (falls back to a dummy model)
         """
-        try:
-            # Check if model metadata exists
-            metadata_path = os.path.join(self.model_dir, "model_metadata.json")
-            if os.path.exists(metadata_path):
-                with open(metadata_path, "r") as f:
-                    metadata = json.load(f)
-                
-                model_path = metadata.get("model_path")
-                # Check if model path exists, and if it's relative, make it absolute
-                if model_path:
-                    if not os.path.isabs(model_path):
-                        model_path = os.path.join(os.path.dirname(__file__), model_path)
-                    
-                    if os.path.exists(model_path):
-                        # Initialize model
-                        self.model = LieDetectionModel()
-                        self.model.load_state_dict(torch.load(model_path, map_location=self.device))
-                        self.model.to(self.device)
-                        self.model.eval()
-                    
-                    # Update model info
-                    self.model_loaded = True
-                    self.model_version = os.path.basename(model_path)
-                    self.last_trained = metadata.get("timestamp")
-                    self.accuracy = metadata.get("accuracy")
-                    
-                    logger.info(f"Model loaded: {model_path}")
-                    return True
-            
-            # If no model found, use a dummy model for demonstration
-            logger.warning("No trained model found, using dummy model")
-            self._initialize_dummy_model()
-            return False
-            
-        except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
-            self._initialize_dummy_model()
-            return False
+        return self.registry.load_active()
+    
+    @property
+    def model(self):
+        return self.registry.current().model
+    
+    @property
+    def model_loaded(self):
+        return self.registry.current() is not None
+    
+    @property
+    def model_version(self):
+        return self.registry.current().version
     
-    def _initialize_dummy_model(self):
+    @property
+    def last_trained(self):
+        return self.registry.current().last_trained
+    
+    @property
+    def accuracy(self):
+        return self.registry.current().accuracy
+    
+    def config(self) -> Dict[str, Any]:
         """
-        Initialize a dummy model for demonstration purposes
+        Get the parameters that affect predictions, apart from the model version
+        (part of the result cache scope)
         """
-        self.model = LieDetectionModel()
-        self.model.to(self.device)
-        self.model.eval()
-        self.model_loaded = True
-        self.model_version = "dummy_model"
-        self.last_trained = datetime.now().isoformat()
-        self.accuracy = 85.0  # Updated to match our trained model accuracy
+        return {
+            "sequence_length": SEQUENCE_LENGTH,
+            "frame_size": FRAME_SIZE,
+            "micro_expression": self.micro_expr_analyzer is not None and self.micro_expr_analyzer.dataset_loaded
+        }
     
-    def predict(self, processed_data: Dict[str, Any]) -> Dict[str, Any]:
+    @traced("predict")
+    def predict(self, processed_data: Dict[str, Any], loaded_model=None,
+                model_prediction: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Make a prediction using the trained model and micro-expression analysis
+        
+        Args:
+            processed_data: Output of VideoProcessor.process_video
+            loaded_model: Model snapshot to use (e.g. one that is about to be
+                swapped in); defaults to the active model
+            model_prediction: CNN-LSTM model output already computed for this
+                video (see predict_batch); the model is run if None
         """
         try:
-            is_dummy = self.model_version == "dummy_model"
+            # Snapshot the active model so a concurrent hot reload can't swap it mid-request
+            loaded_model = loaded_model or self.registry.current()
+            is_dummy = loaded_model.is_dummy
             
             # Extract face frames and audio features
             face_frames = processed_data.get("face_frames", [])
@@ -117,26 +212,34 @@ class Predictor:
             
             # Initialize result dictionary
             result = {}
+            dispatched_at = time.perf_counter()
             
-            # 1. Get prediction from CNN-LSTM model if available
-            model_prediction = None
-            if not is_dummy:
-                try:
-                    model_prediction = self._get_model_prediction(face_frames, audio_features)
-                    logger.info(f"CNN-LSTM model prediction: {model_prediction['prediction']} with {model_prediction['confidence']:.2f}% confidence")
-                except Exception as e:
-                    logger.error(f"Error with CNN-LSTM model prediction: {str(e)}")
-                    model_prediction = None
-            
-            # 2. Get prediction from micro-expression analysis if available
-            micro_expr_prediction = None
+            # 1./2. Run the CNN-LSTM model and the micro-expression analysis concurrently.
+            # Both only read the face frames and spend most of their time in native code.
+            # Each runs in a copy of the caller's context, so it is part of the request's trace.
+            branches = {}
+            if not is_dummy and model_prediction is None:
+                branches["model"] = (
+                    *self._submit_branch(self._get_model_prediction, face_frames, audio_features, loaded_model),
+                    self.model_timeout
+                )
             if self.micro_expr_analyzer is not None and self.micro_expr_analyzer.dataset_loaded:
-                try:
-                    micro_expr_prediction = self.micro_expr_analyzer.analyze_video_frames(face_frames)
-                    logger.info(f"Micro-expression prediction: {micro_expr_prediction['prediction']} with {micro_expr_prediction['confidence']:.2f}% confidence")
-                except Exception as e:
-                    logger.error(f"Error with micro-expression analysis: {str(e)}")
-                    micro_expr_prediction = None
+                branches["micro_expression"] = (
+                    *self._submit_branch(self.micro_expr_analyzer.analyze_video_frames, face_frames,
+                                         processed_data.get("micro_expression_frames")),
+                    self.micro_expr_timeout
+                )
+            
+            branch_results, branch_latencies = self._collect_branches(branches, dispatched_at)
+            
+            if model_prediction is None:
+                model_prediction = branch_results.get("model")
+            if model_prediction:
+                logger.info(f"CNN-LSTM model prediction: {model_prediction['prediction']} with {model_prediction['confidence']:.2f}% confidence")
+            
+            micro_expr_prediction = branch_results.get("micro_expression")
+            if micro_expr_prediction:
+                logger.info(f"Micro-expression prediction: {micro_expr_prediction['prediction']} with {micro_expr_prediction['confidence']:.2f}% confidence")
             
             # 3. Combine predictions or use fallbacks
             if model_prediction and micro_expr_prediction:
@@ -191,6 +294,11 @@ class Predictor:
                 result = self._generate_dummy_prediction()
                 result["is_dummy_model"] = True
             
+            result["metadata"] = {
+                "model_version": loaded_model.version,
+                "branch_latency_ms": branch_latencies
+            }
+            
             logger.info(f"Final prediction: {result['prediction']} with {result['confidence']:.2f}% confidence")
             return result
             
@@ -201,32 +309,157 @@ class Predictor:
             logger.error(f"Audio features shape: {audio_features.shape if hasattr(audio_features, 'shape') else 'unknown'}")
             return self._generate_dummy_prediction()
     
-    def _get_model_prediction(self, face_frames, audio_features):
+    def predict_batch(self, processed_batch: List[Dict[str, Any]], loaded_model=None) -> List[Dict[str, Any]]:
         """
-        Get prediction from the CNN-LSTM model
+        Make predictions for several videos, running the CNN-LSTM model over
+        all of them as one batch instead of one forward pass per video
+        
+        Args:
+            processed_batch: Outputs of VideoProcessor.process_video
+            loaded_model: Model snapshot to use; defaults to the active model
+            
+        Returns:
+            The prediction of each video, in order (as from predict)
         """
-        # Prepare input data for the model
-        frames = []
-        for frame in face_frames[:30]:  # Limit to 30 frames
-            # Convert to RGB if needed
-            if len(frame.shape) == 3 and frame.shape[2] == 3:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            else:
-                frame_rgb = frame
+        loaded_model = loaded_model or self.registry.current()
+        model_predictions = [None] * len(processed_batch)
+        indices = [i for i, processed_data in enumerate(processed_batch)
+                   if len(processed_data.get("face_frames", [])) > 0]
+        if not loaded_model.is_dummy and indices:
+            start = time.perf_counter()
+            try:
+                batched = self._get_model_predictions(
+                    [processed_batch[i]["face_frames"] for i in indices],
+                    [processed_batch[i].get("audio_features", np.array([])) for i in indices],
+                    loaded_model
+                )
+                for i, prediction in zip(indices, batched):
+                    model_predictions[i] = prediction
+                logger.info(f"Batched model prediction of {len(indices)} videos in "
+                            f"{(time.perf_counter() - start) * 1000:.0f} ms")
+            except Exception as e:
+                # Each video then runs the model on its own
+                logger.error(f"Error with batched model prediction: {str(e)}")
+        
+        return [self.predict(processed_data, loaded_model, model_prediction)
+                for processed_data, model_prediction in zip(processed_batch, model_predictions)]
+    
+    def predict_stream(self, face_frames, audio_features, window_size: int = SEQUENCE_LENGTH):
+        """
+        Run the CNN-LSTM model over an arbitrarily long stream of face frames
+        
+        Unlike predict, which only looks at the first SEQUENCE_LENGTH frames, every
+        frame is used: frames are processed window by window and the LSTM state is
+        carried across windows, so memory stays bounded for long recordings.
+        
+        Args:
+            face_frames: Iterable of BGR face crops (e.g. VideoProcessor.iter_face_frames)
+            audio_features: Audio feature array
+            window_size: Number of frames per window (at most SEQUENCE_LENGTH)
+            
+        Returns:
+            Iterator yielding the running prediction after each window
+        """
+        session = StreamingSession(self, audio_features, min(window_size, SEQUENCE_LENGTH))
+        return stream_predictions(session, face_frames)
+    
+    @staticmethod
+    def _run_branch(cancel, fn, *args):
+        """
+        Run one prediction branch on the executor, until it finishes or cancel is set
+        
+        Returns:
+            Tuple of (result, error, elapsed seconds); exactly one of result and error is set
+        """
+        start = time.perf_counter()
+        try:
+            with cancellable(cancel):
+                return fn(*args), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+    
+    def _collect_branches(self, branches, dispatched_at):
+        """
+        Wait for the concurrently running prediction branches
+        
+        Args:
+            branches: Dict of branch name -> (future, cancellation event, timeout in seconds)
+            dispatched_at: perf_counter() value from just before the branches were submitted
+            
+        Returns:
+            Tuple of (results, latencies in ms). A branch that failed or timed out
+            maps to a None result, as it did when the branches ran inline.
+        """
+        results = {}
+        latencies = {}
+        for name, (future, cancel, timeout) in branches.items():
+            label = BRANCH_LABELS[name]
+            remaining = max(0.0, timeout - (time.perf_counter() - dispatched_at))
+            try:
+                result, error, elapsed = future.result(timeout=remaining)
+            except concurrent.futures.TimeoutError:
+                # The branch stops at its next cancellation check; its result is discarded
+                logger.error(f"Error with {label}: timed out after {timeout:.1f} seconds")
+                cancel.set()
+                if not future.cancel():
+                    self._abandon(future)
+                results[name] = None
+                latencies[name] = (time.perf_counter() - dispatched_at) * 1000
+                continue
+            
+            if error is not None:
+                logger.error(f"Error with {label}: {str(error)}")
+            results[name] = result
+            latencies[name] = elapsed * 1000
+        
+        return results, latencies
+    
+    def _prepare_frames(self, face_frames) -> torch.Tensor:
+        """
+        Build the (1, SEQUENCE_LENGTH, 3, FRAME_SIZE, FRAME_SIZE) float32 model input
+        
+        The BGR face crops are copied once into a single uint8 (N, C, H, W) array,
+        transposing and reversing the channel axis (BGR -> RGB) on the way. The
+        float32 cast and scaling then run over contiguous memory into a
+        preallocated buffer that is reused by every request served on the same
+        thread.
+        
+        Args:
+            face_frames: List of BGR face crops (normally already FRAME_SIZE x FRAME_SIZE)
             
-            # Resize and normalize
-            frame_rgb = cv2.resize(frame_rgb, (224, 224))
-            frame_rgb = frame_rgb / 255.0
-            frame_rgb = np.transpose(frame_rgb, (2, 0, 1))  # (H, W, C) -> (C, H, W)
-            frames.append(frame_rgb)
+        Returns:
+            The input tensor; it is only valid until the next call on this thread
+        """
+        crops = face_frames[:SEQUENCE_LENGTH]
+        batch = np.empty((len(crops), 3, FRAME_SIZE, FRAME_SIZE), dtype=np.uint8)
+        for i, frame in enumerate(crops):
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            # Crops from VideoProcessor are already the right size, so this rarely runs
+            if frame.shape[:2] != (FRAME_SIZE, FRAME_SIZE):
+                frame = cv2.resize(frame, (FRAME_SIZE, FRAME_SIZE))
+            # (H, W, BGR) -> (RGB, H, W)
+            batch[i] = frame.transpose(2, 0, 1)[::-1]
+        
+        buffer = getattr(self._buffers, "frames", None)
+        if buffer is None:
+            buffer = torch.empty((1, SEQUENCE_LENGTH, 3, FRAME_SIZE, FRAME_SIZE), dtype=torch.float32)
+            self._buffers.frames = buffer
         
-        # Pad if needed
-        while len(frames) < 30:
-            frames.append(np.zeros_like(frames[0]))
+        # uint8 -> float32 in [0, 1]
+        frames_view = buffer[0, :len(crops)]
+        frames_view.copy_(torch.from_numpy(batch))
+        frames_view.div_(255.0)
         
-        # Convert to tensors
-        frames_tensor = torch.tensor(np.array(frames), dtype=torch.float32).unsqueeze(0)  # Add batch dimension
+        # Pad the rest of the sequence with black frames
+        buffer[0, len(crops):].zero_()
         
+        return buffer
+    
+    def _prepare_audio(self, audio_features) -> torch.Tensor:
+        """
+        Bring audio features into the [1, 20] shape the model expects
+        """
         # Process audio features to ensure correct dimensions (batch_size, features)
         logger.info(f"Original audio features shape: {audio_features.shape}")
         
@@ -245,32 +478,122 @@ class Predictor:
             audio_features = np.random.rand(20)
         
         # Convert to tensor - ensure it's exactly [1, 20]
-        audio_tensor = torch.tensor(audio_features, dtype=torch.float32).reshape(1, 20)
+        return torch.tensor(audio_features, dtype=torch.float32).reshape(1, 20).to(self.device)
+    
+    def _encode_frames(self, face_frames, loaded_model) -> torch.Tensor:
+        """
+        Get the CNN embeddings of face crops, running the CNN only on crops
+        that are not in the embedding cache
+        
+        Args:
+            face_frames: List of BGR face crops
+            loaded_model: Model snapshot whose CNN produces the embeddings
+            
+        Returns:
+            (N, 128) float32 tensor on self.device
+        """
+        # The dummy model has random weights per process, so its embeddings are never cached
+        use_cache = not loaded_model.is_dummy
+        if use_cache:
+            keys = [EmbeddingCache.frame_key(frame, loaded_model.version) for frame in face_frames]
+            embeddings = self.embedding_cache.get_many(keys)
+        else:
+            embeddings = [None] * len(face_frames)
         
-        # Move to device
-        frames_tensor = frames_tensor.to(self.device)
-        audio_tensor = audio_tensor.to(self.device)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        for start in range(0, len(missing), SEQUENCE_LENGTH):
+            check()
+            indices = missing[start:start + SEQUENCE_LENGTH]
+            frames_tensor = self._prepare_frames([face_frames[i] for i in indices])[0, :len(indices)].to(self.device)
+            with torch.no_grad():
+                computed = loaded_model.model.encode_frames(frames_tensor).cpu().numpy()
+            
+            computed = [embedding.copy() for embedding in computed]
+            for i, embedding in zip(indices, computed):
+                embeddings[i] = embedding
+            if use_cache:
+                self.embedding_cache.put_many([keys[i] for i in indices], computed)
+        
+        return torch.from_numpy(np.stack(embeddings)).to(self.device)
+    
+    def _get_model_prediction(self, face_frames, audio_features, loaded_model=None):
+        """
+        Get prediction from the CNN-LSTM model
+        
+        Args:
+            face_frames: List of BGR face crops
+            audio_features: Audio feature array
+            loaded_model: Model snapshot to run; defaults to the currently active one
+        """
+        return self._get_model_predictions([face_frames], [audio_features], loaded_model)[0]
+    
+    def _get_model_predictions(self, face_frames_batch, audio_features_batch, loaded_model=None):
+        """
+        Get predictions from the CNN-LSTM model for a batch of videos
+        
+        The CNN encodes the crops of all videos together (full SEQUENCE_LENGTH
+        chunks rather than one partial chunk per video), and the LSTM and
+        classifier run once over the (batch, SEQUENCE_LENGTH) sequences.
+        
+        Args:
+            face_frames_batch: List of face crop lists, one per video
+            audio_features_batch: List of audio feature arrays, one per video
+            loaded_model: Model snapshot to run; defaults to the currently active one
+            
+        Returns:
+            List of model predictions, one per video
+        """
+        with metrics.span("model_forward"):
+            return self._run_model(face_frames_batch, audio_features_batch, loaded_model)
+    
+    def _run_model(self, face_frames_batch, audio_features_batch, loaded_model=None):
+        """Run the CNN-LSTM model over a batch of videos (see _get_model_predictions)"""
+        if loaded_model is None:
+            loaded_model = self.registry.current()
+        model = loaded_model.model
+        
+        # Prepare input data for the model: per-frame CNN embeddings, padded
+        # with the embedding of a black frame up to SEQUENCE_LENGTH
+        crops_batch = [list(face_frames[:SEQUENCE_LENGTH]) for face_frames in face_frames_batch]
+        embeddings = self._encode_frames([crop for crops in crops_batch for crop in crops], loaded_model)
+        padding = None
+        if any(len(crops) < SEQUENCE_LENGTH for crops in crops_batch):
+            padding = self._encode_frames([BLACK_FRAME], loaded_model)
+        sequences = []
+        offset = 0
+        for crops in crops_batch:
+            sequence = embeddings[offset:offset + len(crops)]
+            offset += len(crops)
+            if len(crops) < SEQUENCE_LENGTH:
+                sequence = torch.cat([sequence, padding.expand(SEQUENCE_LENGTH - len(crops), -1)])
+            sequences.append(sequence)
+        sequences = torch.stack(sequences)
         
-        logger.info(f"Frames tensor shape: {frames_tensor.shape}, Audio tensor shape: {audio_tensor.shape}")
+        audio_tensor = torch.cat([self._prepare_audio(audio_features) for audio_features in audio_features_batch])
+        
+        logger.info(f"Embeddings shape: {sequences.shape}, Audio tensor shape: {audio_tensor.shape}")
         
         # Make prediction
         with torch.no_grad():
-            logger.info(f"Running model with frames: {frames_tensor.shape} and audio: {audio_tensor.shape}")
-            
-            outputs = self.model(frames_tensor, audio_tensor)
-            probabilities = torch.softmax(outputs, dim=1)
-            prediction = torch.argmax(probabilities, dim=1).item()
-            
-            # Get the actual probabilities for each class
-            fake_prob = probabilities[0][0].item()
-            truth_prob = probabilities[0][1].item()
-            
-            # Set confidence based on the prediction probability
-            # For truth, use truth_prob; for fake, use fake_prob
-            confidence = (truth_prob if prediction == 1 else fake_prob) * 100
-            
+            lstm_out, _ = model.lstm(sequences)
+            outputs = model.classify(lstm_out[:, -1, :], audio_tensor)
+            probabilities = torch.softmax(outputs, dim=1).cpu().numpy()
             logger.info(f"Model produced valid output: shape {outputs.shape}")
-            logger.info(f"Truth probability: {truth_prob:.4f}, Fake probability: {fake_prob:.4f}")
+        
+        return [self._model_result(float(truth_prob), float(fake_prob))
+                for fake_prob, truth_prob in probabilities[:, :2]]
+    
+    def _model_result(self, truth_prob: float, fake_prob: float) -> Dict[str, Any]:
+        """
+        Turn the class probabilities of the CNN-LSTM model into a prediction with feature scores
+        """
+        prediction = 1 if truth_prob > fake_prob else 0
+        
+        # Set confidence based on the prediction probability
+        # For truth, use truth_prob; for fake, use fake_prob
+        confidence = (truth_prob if prediction == 1 else fake_prob) * 100
+        
+        logger.info(f"Truth probability: {truth_prob:.4f}, Fake probability: {fake_prob:.4f}")
         
         # Extract real insights from model probabilities
         is_truth = prediction == 1
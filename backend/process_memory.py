@@ -0,0 +1,409 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Requests kept in the memory report (per process)
+HISTORY_SIZE = 100
+# Allocation sites listed per request and in the report when tracemalloc is on
+TOP_ALLOCATIONS = 10
+
+
+def process_memory(pid: Optional[int] = None) -> Optional[Dict[str, float]]:
+    """
+    Get the memory of a process in MB, split into pages shared with other
+    processes (e.g. model weights inherited from a pre-fork parent) and
+    pages private to it
+
+    Args:
+        pid: Process id (defaults to this process)
+
+    Returns:
+        Dict with rss, pss (proportional set size: shared pages divided among
+        the processes sharing them), shared and private; only rss where the
+        breakdown isn't available, and None if the process doesn't exist or
+        its memory can't be read
+    """
+    pid = pid or os.getpid()
+    try:
+        # Linux 4.14+: totals of /proc/<pid>/smaps
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+        return {
+            "rss": fields.get("Rss", 0) / MB,
+            "pss": fields.get("Pss", 0) / MB,
+            "shared": (fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / MB,
+            "private": (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / MB
+        }
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.debug(f"Could not read smaps_rollup of {pid}: {str(e)}")
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return {"rss": int(line.split()[1]) * 1024 / MB}
+    except OSError:
+        pass
+
+    return None
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Get the resident set size of this process in bytes (cheap enough to
+    call around every pipeline stage), or None where it can't be read
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """Get the peak resident set size of this process since the last reset (see _reset_peak_rss)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak resident set size of this process to the current one (Linux 4.0+)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Record of the request the current code runs for (see MemoryTracker.request)
+_current_request = contextvars.ContextVar("memory_request", default=None)
+
+
+class MemoryTracker:
+    """
+    Memory accounting of the analysis, to find what makes workers grow and
+    to size their memory limits.
+
+    The resident set size is sampled around every pipeline stage (see
+    metrics.Metrics.span), so growth is attributed to the stage it happened
+    in. Every analysis is tracked as a request: its peak memory above what
+    the process used when it started, and what it used after. A process
+    whose memory rises over most of the last requests is flagged as
+    growing. With tracemalloc on, Python allocations (numpy arrays
+    included) are sampled too, and each request lists the allocation
+    sites it left memory behind at.
+
+    Peaks are of the whole process while the request ran. The kernel's
+    high-water mark is only reset when no other request of the process is
+    running, and a request that overlapped another has no peak observed
+    (its record is marked overlapped), so concurrent analyses don't reset
+    or inflate each other's peaks.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.tracemalloc_frames = 0
+        self.growth_window = 20
+        self.growth_threshold_mb = 64.0
+        # Records of the last requests, and those not yet drained (see drain)
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._undrained = []
+        # pid -> memory after each of the last requests of that process
+        self._after = {}
+        self._growing = set()
+        # Records of the requests running in this process
+        self._active = []
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool = True, tracemalloc_frames: int = 0, growth_window: int = 20,
+                  growth_threshold_mb: float = 64.0):
+        """
+        Set up the tracker
+
+        Args:
+            enabled: Sample memory around stages and requests
+            tracemalloc_frames: Frames of traceback tracemalloc keeps per
+                allocation, 0 leaves tracemalloc off (it slows Python
+                allocations down noticeably)
+            growth_window: Requests a process's memory is followed over to flag growth
+            growth_threshold_mb: Growth over the window (in MB) that flags a process
+        """
+        self.enabled = enabled
+        self.tracemalloc_frames = tracemalloc_frames if enabled else 0
+        self.growth_window = max(2, growth_window)
+        self.growth_threshold_mb = growth_threshold_mb
+        if self.tracemalloc_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            logger.info(f"tracemalloc started ({self.tracemalloc_frames} frames per allocation)")
+
+    def begin_stage(self) -> Optional[Tuple[Optional[int], int]]:
+        """
+        Sample memory at the start of a stage
+
+        Returns:
+            What end_stage needs, or None if memory isn't tracked
+        """
+        if not self.enabled:
+            return None
+        return rss_bytes(), tracemalloc.get_traced_memory()[0] if self.tracemalloc_frames else 0
+
+    def end_stage(self, start: Tuple[Optional[int], int]) -> Dict[str, int]:
+        """
+        Sample memory at the end of a stage
+
+        Args:
+            start: Result of begin_stage
+
+        Returns:
+            Bytes the process grew by during the stage, per source ("rss",
+            and "tracemalloc" when on); shrinking counts as 0
+        """
+        rss = rss_bytes()
+        growth = {}
+        if rss is not None and start[0] is not None:
+            growth["rss"] = max(0, rss - start[0])
+        if self.tracemalloc_frames:
+            growth["tracemalloc"] = max(0, tracemalloc.get_traced_memory()[0] - start[1])
+        record = _current_request.get()
+        if record is not None and rss is not None:
+            record["peak_rss"] = max(record["peak_rss"], rss)
+        return growth
+
+    @contextmanager
+    def request(self, label: str):
+        """
+        Track the memory of the enclosed block as one request
+
+        Args:
+            label: What the request is (e.g. the job id), shown in the report
+
+        Yields:
+            The request's record, complete once the block has finished
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        rss = rss_bytes() or 0
+        record = {"label": label, "pid": os.getpid(), "started_at": time.time(), "rss_before": rss, "peak_rss": rss}
+        with self._lock:
+            for other in self._active:
+                other["overlapped"] = True
+            if self._active:
+                record["overlapped"] = True
+            self._active.append(record)
+            # Resetting the high-water marks would lose the peaks of the requests running
+            first = len(self._active) == 1
+            if first and _reset_peak_rss():
+                record["peak_rss_reset"] = True
+        snapshot = None
+        if self.tracemalloc_frames:
+            if first:
+                tracemalloc.reset_peak()
+            record["traced_before"] = tracemalloc.get_traced_memory()[0]
+            snapshot = _take_snapshot()
+        token = _current_request.set(record)
+        try:
+            yield record
+        finally:
+            _current_request.reset(token)
+            with self._lock:
+                self._active.remove(record)
+            self._finish(record, snapshot)
+
+    def _finish(self, record: Dict[str, Any], snapshot):
+        from metrics import metrics
+
+        rss = rss_bytes() or 0
+        peak = max(record["peak_rss"], rss)
+        overlapped = record.get("overlapped", False)
+        if record.pop("peak_rss_reset", False) and not overlapped:
+            peak = max(peak, _peak_rss_bytes() or 0)
+        record.update(
+            seconds=round(time.time() - record["started_at"], 3),
+            rss_after=rss,
+            peak_rss=peak,
+            peak_growth=peak - record["rss_before"],
+            retained=rss - record["rss_before"]
+        )
+        if not overlapped:
+            metrics.observe("request_peak_memory_bytes", record["peak_growth"], source="rss")
+        if snapshot is not None:
+            current, traced_peak = tracemalloc.get_traced_memory()
+            record["traced_peak_growth"] = traced_peak - record["traced_before"]
+            record["traced_retained"] = current - record["traced_before"]
+            # Where the memory this request left behind was allocated
+            record["retained_sites"] = _top_sites(_take_snapshot().compare_to(snapshot, "lineno"))
+            if not overlapped:
+                metrics.observe("request_peak_memory_bytes", record["traced_peak_growth"], source="tracemalloc")
+        self.merge([record])
+
+    def merge(self, records: List[Dict[str, Any]]):
+        """
+        Add request records (e.g. drained in an analysis worker process) to
+        the history, and check the processes they ran in for growth
+        """
+        with self._lock:
+            for record in records:
+                self.history.append(record)
+                self._undrained.append(record)
+                if record["pid"] not in self._after:
+                    self._forget_exited()
+                after = self._after.setdefault(record["pid"], deque(maxlen=self.growth_window))
+                after.append(record["rss_after"])
+                growing = self._is_growing(after)
+                if growing and record["pid"] not in self._growing:
+                    self._growing.add(record["pid"])
+                    # Records merged from an analysis worker process were warned about there
+                    if record["pid"] == os.getpid():
+                        logger.warning(f"Memory of process {record['pid']} rose after most of its last {len(after)} "
+                                       f"requests, by {(after[-1] - after[0]) / MB:.0f} MB in total")
+                elif not growing:
+                    self._growing.discard(record["pid"])
+            if len(self._undrained) > HISTORY_SIZE:
+                del self._undrained[:-HISTORY_SIZE]
+
+    def _forget_exited(self):
+        """Drop the growth of processes that have exited (e.g. replaced analysis workers)"""
+        for pid in [pid for pid in self._after if not _pid_alive(pid)]:
+            del self._after[pid]
+            self._growing.discard(pid)
+
+    def _is_growing(self, after) -> bool:
+        """Whether memory rose after at least 80% of the requests of a full window, by the threshold in total"""
+        if len(after) < self.growth_window:
+            return False
+        values = list(after)
+        rises = sum(1 for previous, current in zip(values, values[1:]) if current > previous)
+        return rises >= 0.8 * (len(values) - 1) and values[-1] - values[0] >= self.growth_threshold_mb * MB
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Take the request records added since the last drain (to ship them to another process)"""
+        with self._lock:
+            records, self._undrained = self._undrained, []
+        return records
+
+    def growth(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Get, per process that ran requests, its memory after the last
+        request, its growth per request over the window (least squares
+        slope) and whether it is flagged as growing
+        """
+        with self._lock:
+            processes = {}
+            for pid, after in self._after.items():
+                values = list(after)
+                n = len(values)
+                slope = 0.0
+                if n >= 2:
+                    mean_x, mean_y = (n - 1) / 2, sum(values) / n
+                    slope = (sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+                             / sum((x - mean_x) ** 2 for x in range(n)))
+                processes[pid] = {
+                    "requests": n,
+                    "rss_after_last": values[-1],
+                    "growth_per_request": slope,
+                    "growing": pid in self._growing
+                }
+            return processes
+
+    def reset_baseline(self):
+        """Take the tracemalloc snapshot later reports compare this process's allocations to"""
+        if tracemalloc.is_tracing():
+            self._baseline = _take_snapshot()
+
+    def report(self, requests: int = 20) -> Dict[str, Any]:
+        """
+        Get the memory report: this process's memory, growth per process and
+        the last requests (plus, with tracemalloc, where this process's
+        Python allocations grew since the baseline)
+
+        Args:
+            requests: Number of recent requests listed
+        """
+        report = {
+            "enabled": self.enabled,
+            "process": {"pid": os.getpid(), **(process_memory() or {})},
+            "growth_window": self.growth_window,
+            "growth_threshold_mb": self.growth_threshold_mb,
+            "processes": {str(pid): {
+                "requests": info["requests"],
+                "rss_after_last_mb": round(info["rss_after_last"] / MB, 1),
+                "growth_per_request_mb": round(info["growth_per_request"] / MB, 2),
+                "growing": info["growing"]
+            } for pid, info in self.growth().items()},
+            "requests": [_in_mb(record) for record in list(self.history)[-requests:]][::-1]
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["tracemalloc"] = {"traced_mb": round(current / MB, 1), "peak_mb": round(peak / MB, 1)}
+            if self._baseline is None:
+                self.reset_baseline()
+            report["tracemalloc"]["growth_since_baseline"] = _top_sites(
+                _take_snapshot().compare_to(self._baseline, "lineno")
+            )
+        return report
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    """Take a tracemalloc snapshot, leaving out what tracemalloc and this module allocated"""
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__)
+    ])
+
+
+def _top_sites(differences) -> List[Dict[str, Any]]:
+    """The allocation sites that grew the most, from a tracemalloc snapshot comparison"""
+    return [{"site": str(stat.traceback[0]), "size_kb": round(stat.size_diff / 1024, 1), "count": stat.count_diff}
+            for stat in differences[:TOP_ALLOCATIONS] if stat.size_diff > 0]
+
+
+def _in_mb(record: Dict[str, Any]) -> Dict[str, Any]:
+    """A request record with its sizes in MB"""
+    view = {}
+    for key, value in record.items():
+        if key in ("rss_before", "rss_after", "peak_rss", "peak_growth", "retained", "traced_before",
+                   "traced_peak_growth", "traced_retained"):
+            view[f"{key}_mb"] = round(value / MB, 1)
+        else:
+            view[key] = value
+    return view
+
+
+# Memory accounting of this process
+memory_tracker = MemoryTracker()
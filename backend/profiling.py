@@ -0,0 +1,402 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import secrets
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from stack_sampler import StackSampler
+
+logger = logging.getLogger(__name__)
+
+# Seconds between stack samples of a profiled block
+SAMPLE_INTERVAL = 0.005
+# Sampled call stacks are shown on a lane of their own next to the thread's spans
+SAMPLE_LANE_OFFSET = 1 << 32
+
+# Trace of the request or job the current code runs for (None when not tracing)
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Spans recorded for one traced request, in the Chrome trace event format.
+
+    A trace follows its request to the job thread that analyzes the upload
+    and to the analysis worker process running it; each of them records its
+    own part, and TraceStore puts the parts back together. With profile
+    set, the blocks marked with traced (VideoProcessor.process_video and
+    Predictor.predict) also sample the call stack of their thread.
+    """
+    def __init__(self, trace_id: str, profile: bool = False, sample_interval: float = SAMPLE_INTERVAL):
+        """
+        Initialize a trace part
+
+        Args:
+            trace_id: Id shared by every part of the trace
+            profile: Sample the call stacks of the traced blocks
+            sample_interval: Seconds between stack samples
+        """
+        self.trace_id = trace_id
+        self.profile = profile
+        self.sample_interval = sample_interval
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def context(self) -> Tuple[str, bool, float]:
+        """Get what another process needs to record its part of the trace (see Trace(*context))"""
+        return self.trace_id, self.profile, self.sample_interval
+
+    def add(self, name: str, start: float, seconds: float, args: Optional[Dict[str, Any]] = None,
+            category: str = "stage", lane: int = 0):
+        """
+        Add a span of the current thread
+
+        Args:
+            name: Span name (e.g. the pipeline stage)
+            start: Start time (seconds since the epoch, so processes agree)
+            seconds: Duration
+            args: Details shown with the span
+            category: Chrome trace category
+            lane: Offset of the thread id, to show the span on a separate lane
+        """
+        thread_id = threading.get_native_id()
+        event = {
+            "name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": thread_id + lane,
+            "ts": round(start * 1e6, 1), "dur": round(seconds * 1e6, 1)
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            if (thread_id + lane) not in self._threads:
+                thread_name = threading.current_thread().name
+                self._threads[thread_id + lane] = f"{thread_name} (samples)" if lane else thread_name
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """Record the enclosed block as a span (also when it raises)"""
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - started, args or None)
+
+    def merge(self, events: List[Dict[str, Any]]):
+        """Add the events of another part (e.g. recorded in an analysis worker process)"""
+        with self._lock:
+            self.events.extend(events)
+
+    def export(self) -> List[Dict[str, Any]]:
+        """Get the events of this part, with the names of its threads"""
+        with self._lock:
+            names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": name}}
+                     for thread_id, name in self._threads.items()]
+            return names + list(self.events)
+
+
+def current_trace() -> Optional[Trace]:
+    """Get the trace of the request or job being run, or None"""
+    return _current.get()
+
+
+@contextmanager
+def activate(trace: Optional[Trace]):
+    """Record the spans of the enclosed block (and of code it calls in this thread) to a trace"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Record the enclosed block as a span of the current trace (nothing
+    happens when not tracing)
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **args):
+        yield
+
+
+@contextmanager
+def traced(name: str):
+    """
+    Record the enclosed block (or decorated function) as a span of the
+    current trace, sampling its call stack if the trace profiles. Meant
+    for the hot paths; costs a context variable lookup when not tracing.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    if not trace.profile:
+        with trace.span(name):
+            yield
+        return
+
+    sampler = StackSampler(threading.get_ident(), sys._getframe(), trace.sample_interval)
+    sampler.start()
+    try:
+        with trace.span(name):
+            yield
+    finally:
+        sampler.stop()
+        for frame_name, start, seconds in sampler.spans():
+            trace.add(frame_name, start, seconds, category="sample", lane=SAMPLE_LANE_OFFSET)
+
+
+class TraceStore:
+    """
+    Traces of requests, kept in a directory shared by the server processes
+    (one subdirectory per trace, one file per part), so a trace can be
+    read from whichever process answers.
+    """
+    def __init__(self, directory: str, max_traces: int = 50, sample_interval: float = SAMPLE_INTERVAL):
+        """
+        Initialize the store
+
+        Args:
+            directory: Directory of the traces
+            max_traces: Number of traces kept; the oldest are removed first
+            sample_interval: Seconds between stack samples of profiled traces
+        """
+        self.directory = directory
+        self.max_traces = max_traces
+        self.sample_interval = sample_interval
+
+    def start(self, profile: bool = False, **info) -> Trace:
+        """
+        Start a trace
+
+        Args:
+            profile: Sample the call stacks of the traced blocks
+            info: Details shown in the trace list (e.g. the request)
+
+        Returns:
+            The trace, to be saved with save
+        """
+        trace = Trace(uuid.uuid4().hex, profile, self.sample_interval)
+        path = os.path.join(self.directory, trace.trace_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "trace.json"), "w") as f:
+            json.dump({"trace_id": trace.trace_id, "profile": profile, "created_at": time.time(), **info}, f)
+        self._prune()
+        return trace
+
+    def resume(self, trace_id: str) -> Optional[Trace]:
+        """
+        Get a new part of a started trace (e.g. for the job of a traced
+        upload), or None if it has been removed
+        """
+        info = self.info(trace_id)
+        if info is None:
+            return None
+        return Trace(trace_id, info["profile"], self.sample_interval)
+
+    def save(self, trace: Trace):
+        """Write a part of a trace"""
+        path = os.path.join(self.directory, trace.trace_id)
+        if not os.path.isdir(path):
+            return
+        part_path = os.path.join(path, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        try:
+            with open(f"{part_path}.tmp", "w") as f:
+                json.dump(trace.export(), f)
+            os.replace(f"{part_path}.tmp", part_path)
+        except OSError as e:
+            logger.warning(f"Could not save trace {trace.trace_id}: {str(e)}")
+
+    def info(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Get the details of a trace, or None if there is no such trace"""
+        if not trace_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.directory, trace_id, "trace.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Get the details of the kept traces, newest first"""
+        traces = []
+        for trace_id in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            info = self.info(trace_id)
+            if info is not None:
+                info["parts"] = len(self._part_names(trace_id))
+                traces.append(info)
+        return sorted(traces, key=lambda info: info["created_at"], reverse=True)
+
+    def events(self, trace_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Get the events of every saved part of a trace, or None if there is no such trace"""
+        if self.info(trace_id) is None:
+            return None
+        events = []
+        for name in self._part_names(trace_id):
+            try:
+                with open(os.path.join(self.directory, trace_id, name)) as f:
+                    events.extend(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read part {name} of trace {trace_id}: {str(e)}")
+        return events
+
+    def _part_names(self, trace_id: str) -> List[str]:
+        try:
+            names = os.listdir(os.path.join(self.directory, trace_id))
+        except FileNotFoundError:
+            # Removed by another process meanwhile
+            return []
+        return [name for name in names if name.endswith(".json") and name != "trace.json"]
+
+    def _prune(self):
+        traces = self.list()
+        for info in traces[self.max_traces:]:
+            shutil.rmtree(os.path.join(self.directory, info["trace_id"]), ignore_errors=True)
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware tracing the requests that ask for it with an
+    X-Debug-Trace header or trace query parameter ("1", or "profile" to also
+    sample call stacks). Tracing has a cost, so it must be enabled and the
+    request must carry the admin token; the trace id is returned in the
+    X-Trace-Id response header.
+    """
+    def __init__(self, app, store: TraceStore, admin_token: Optional[str] = None):
+        self.app = app
+        self.store = store
+        self.admin_token = admin_token
+
+    async def __call__(self, scope, receive, send):
+        mode = _requested_mode(scope) if scope["type"] == "http" else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        token = dict(scope["headers"]).get(b"x-admin-token", b"").decode("latin-1")
+        if not self.admin_token:
+            await _reject(send, 403, "Tracing is disabled (ADMIN_TOKEN not set)")
+            return
+        if not secrets.compare_digest(token, self.admin_token):
+            await _reject(send, 401, "Tracing a request requires the admin token")
+            return
+
+        request = f"{scope['method']} {scope['path']}"
+        trace = self.store.start(profile=mode == "profile", request=request)
+        logger.info(f"Tracing {request} as {trace.trace_id}")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        try:
+            with activate(trace), trace.span("request", request=request):
+                await self.app(scope, receive, send_with_id)
+        finally:
+            self.store.save(trace)
+
+
+async def _reject(send, status: int, detail: str):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()})
+
+
+def _requested_mode(scope) -> Optional[str]:
+    """Get the tracing mode a request asks for ("1" or "profile"), or None"""
+    for name, value in scope["headers"]:
+        if name == b"x-debug-trace":
+            mode = value.decode("latin-1").strip().lower()
+            break
+    else:
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        mode = query.get("trace", [""])[0].lower()
+    if mode in ("", "0", "false"):
+        return None
+    return "profile" if mode == "profile" else "1"
+
+
+def chrome_trace(info: Dict[str, Any], events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build a Chrome trace (for chrome://tracing or ui.perfetto.dev)
+
+    Args:
+        info: Details of the trace (see TraceStore.info)
+        events: Events of the trace
+
+    Returns:
+        The trace document
+    """
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": info}
+
+
+def speedscope_profile(info: Dict[str, Any], events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build a speedscope profile (for speedscope.app), with one evented
+    profile per thread (and per sampled stack lane)
+
+    Args:
+        info: Details of the trace (see TraceStore.info)
+        events: Events of the trace
+
+    Returns:
+        The profile document
+    """
+    thread_names = {(event["pid"], event["tid"]): event["args"]["name"]
+                    for event in events if event["ph"] == "M" and event["name"] == "thread_name"}
+    lanes = {}
+    for event in events:
+        if event["ph"] == "X":
+            lanes.setdefault((event["pid"], event["tid"]), []).append(event)
+
+    frames, frame_ids, profiles = [], {}, []
+    for (pid, tid), spans in sorted(lanes.items()):
+        spans.sort(key=lambda event: (event["ts"], -event["dur"]))
+        opened, stack = [], []
+        for event in spans:
+            start = event["ts"]
+            while stack and stack[-1][1] <= start:
+                frame, end = stack.pop()
+                opened.append({"type": "C", "frame": frame, "at": end})
+            end = start + event["dur"]
+            if stack:
+                # Spans are properly nested; clamp what clock rounding pushed past the parent
+                end = min(end, stack[-1][1])
+            frame = frame_ids.get(event["name"])
+            if frame is None:
+                frame = frame_ids[event["name"]] = len(frames)
+                frames.append({"name": event["name"]})
+            opened.append({"type": "O", "frame": frame, "at": start})
+            stack.append((frame, end))
+        while stack:
+            frame, end = stack.pop()
+            opened.append({"type": "C", "frame": frame, "at": end})
+        profiles.append({
+            "type": "evented",
+            "name": f"{thread_names.get((pid, tid), tid)} (pid {pid})",
+            "unit": "microseconds",
+            "startValue": opened[0]["at"],
+            "endValue": opened[-1]["at"],
+            "events": opened
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{info.get('request', 'trace')} {info['trace_id']}",
+        "exporter": "truthsense",
+        "shared": {"frames": frames},
+        "profiles": profiles
+    }
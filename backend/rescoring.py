@@ -0,0 +1,171 @@
+import os
+import glob
+import time
+import logging
+import threading
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UploadRetention:
+    """
+    Keeps recently uploaded videos on disk, by content hash, so their cached
+    results can be recomputed under a new model. The oldest videos are
+    deleted once the directory exceeds its size budget.
+    """
+    def __init__(self, retain_dir: str, max_bytes: int):
+        """
+        Initialize the retention directory
+
+        Args:
+            retain_dir: Directory to keep videos in
+            max_bytes: Disk budget for retained videos
+        """
+        self.retain_dir = retain_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(retain_dir, exist_ok=True)
+        self._bytes = sum(os.path.getsize(path) for path in self._files())
+
+    def _files(self):
+        return glob.glob(os.path.join(self.retain_dir, "*"))
+
+    def retain(self, path: str, video_hash: str):
+        """
+        Move an uploaded file into the retention directory (or drop it if the video is already kept)
+
+        Args:
+            path: Path of the uploaded file
+            video_hash: SHA-256 of the file
+        """
+        existing = self.path_for(video_hash)
+        if existing is not None:
+            # Already kept; refresh it so it is pruned last
+            os.utime(existing)
+            os.remove(path)
+            return
+
+        size = os.path.getsize(path)
+        os.replace(path, os.path.join(self.retain_dir, video_hash + os.path.splitext(path)[1]))
+        with self._lock:
+            self._bytes += size
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self._prune()
+
+    def path_for(self, video_hash: str) -> Optional[str]:
+        """
+        Get the path of a retained video, or None if it isn't kept
+        """
+        matches = glob.glob(os.path.join(self.retain_dir, video_hash + "*"))
+        return matches[0] if matches else None
+
+    def _prune(self):
+        """Delete the least recently uploaded videos until within 90% of the budget"""
+        with self._lock:
+            files = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in self._files()))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        return {"bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class Rescorer:
+    """
+    Recomputes the most requested cached results under a new cache scope
+    (e.g. a newly trained model) in the background once it goes live, so the
+    hit rate recovers quickly after results of the old scope stop being served.
+    """
+    def __init__(self, result_cache, limit: int, time_budget: float):
+        """
+        Initialize the rescorer
+
+        Args:
+            result_cache: ResultCache holding the results
+            limit: Maximum number of results to recompute per run
+            time_budget: Seconds after which a run stops recomputing
+        """
+        self.result_cache = result_cache
+        self.limit = limit
+        self.time_budget = time_budget
+        self.last_run = None
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def start(self, from_scope: str, to_scope: str,
+              analyze: Callable[[str], Optional[Dict[str, Any]]]) -> threading.Thread:
+        """
+        Run in a background thread (see run); a run still going is stopped, as
+        its scope is no longer served
+
+        Returns:
+            The thread of the run
+        """
+        stop = threading.Event()
+        with self._lock:
+            if self._stop is not None:
+                self._stop.set()
+            self._stop = stop
+        thread = threading.Thread(target=self.run, args=(from_scope, to_scope, analyze, stop),
+                                  name="rescore", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, from_scope: str, to_scope: str, analyze: Callable[[str], Optional[Dict[str, Any]]],
+            stop: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """
+        Recompute the hottest results of one scope into another
+
+        Args:
+            from_scope: Scope served before
+            to_scope: Scope served now
+            analyze: Function analyzing a video, by hash, under the new scope;
+                returns None if the video's inputs are no longer available
+            stop: Optional event that ends the run early when set
+
+        Returns:
+            Summary of the run
+        """
+        started = time.perf_counter()
+        summary = {"from_scope": from_scope, "to_scope": to_scope, "rescored": 0,
+                   "already_cached": 0, "unavailable": 0, "failed": 0, "timed_out": False, "stopped": False}
+
+        if from_scope != to_scope:
+            for video_hash in self.result_cache.hottest(from_scope, self.limit):
+                if stop is not None and stop.is_set():
+                    summary["stopped"] = True
+                    break
+                if time.perf_counter() - started > self.time_budget:
+                    summary["timed_out"] = True
+                    break
+                # Another worker, or an upload since the swap, may have computed it already
+                if self.result_cache.has_result(video_hash, to_scope):
+                    summary["already_cached"] += 1
+                    continue
+                try:
+                    result = analyze(video_hash)
+                    if result is None:
+                        summary["unavailable"] += 1
+                        continue
+                    self.result_cache.store_result(video_hash, result, scope=to_scope)
+                    summary["rescored"] += 1
+                except Exception as e:
+                    summary["failed"] += 1
+                    logger.warning(f"Could not rescore {video_hash[:8]}...: {str(e)}")
+
+        summary["seconds"] = time.perf_counter() - started
+        summary["finished_at"] = time.time()
+        self.last_run = summary
+        logger.info(f"Rescored {summary['rescored']} cached results for scope {to_scope} "
+                    f"in {summary['seconds']:.1f}s ({summary['unavailable']} videos no longer available)")
+        return summary
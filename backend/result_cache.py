@@ -1,104 +1,746 @@
 import os
 import json
+import time
+import sqlite3
 import hashlib
 import logging
-from typing import Dict, Any, Optional
+import argparse
+import threading
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
+import numpy as np
+
+from sqlite_store import SQLiteStore, dumps
+from video_fingerprint import NearDuplicate, band_keys, fingerprint_distance
+from metrics import metrics
+
+
 logger = logging.getLogger(__name__)
 
-class ResultCache:
+# Scope of entries written before results were scoped, until adopt_legacy
+# moves them into a served scope (and of unscoped lookups)
+LEGACY_SCOPE = ""
+
+# Most videos sharing band keys with a fingerprint that are aligned against it
+FINGERPRINT_CANDIDATES = 20
+
+# Cache hits are recorded in memory and written (last access time, hit count)
+# once this many videos have pending accesses, or after this many seconds,
+# so lookups don't take the database write lock
+ACCESS_FLUSH_BATCH = 64
+ACCESS_FLUSH_INTERVAL = 30.0
+
+def cache_scope(config: Dict[str, Any]) -> str:
+    """
+    Compute the cache scope of a pipeline configuration
+
+    Args:
+        config: JSON-serializable description of everything that affects a
+            result (analyzer, model version, sampling and detection parameters)
+
+    Returns:
+        A short hex fingerprint of the configuration
+    """
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+class ResultCache(SQLiteStore):
     """
     A persistent cache to store and retrieve video analysis results
     to ensure consistency when the same video is uploaded multiple times.
+
+    Results live in an SQLite database in WAL mode, so lookups and inserts
+    are O(1), nothing is read up front, and several threads or processes
+    can read and write the cache at the same time. With cache_dir=None the
+    database is kept in memory instead.
+
+    Every result belongs to a scope (see cache_scope): the same video gets
+    a separate entry per model version and pipeline configuration, so a
+    retrained model or changed parameters never serve stale predictions,
+    and entries of other scopes can be invalidated selectively.
+
+    The cache can be bounded by number of entries, total size and a TTL per
+    entry; entries beyond the limits are evicted least recently used first.
+    Accesses are written in batches (see flush_accesses), and always before
+    this process evicts, so the LRU order only lags behind other processes'
+    most recent hits.
+
+    Results can also carry a perceptual fingerprint of their video (see
+    video_fingerprint), so re-encoded or trimmed copies of a cached video
+    can be found with find_similar.
     """
-    def __init__(self, cache_dir="cache"):
+    def __init__(self, cache_dir="cache", db_name="prediction_cache.db", legacy_json="prediction_cache.json",
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None, compaction_interval: Optional[float] = None,
+                 legacy_scope: Optional[str] = None):
         """
         Initialize the result cache
-        
+
         Args:
-            cache_dir: Directory to store cache files
+            cache_dir: Directory to store cache files (None for an in-memory cache)
+            db_name: File name of the SQLite database inside cache_dir
+            legacy_json: File name of a JSON cache from older versions to import
+                once on startup (None to skip)
+            max_entries: Maximum number of cached results (unbounded if None)
+            max_bytes: Maximum total size of the cached results (unbounded if None)
+            ttl_seconds: Time after which a cached result expires (never if None)
+            compaction_interval: Seconds between background compactions (disabled if None)
+            legacy_scope: Scope to serve results from older versions under (e.g. the
+                current one): unscoped results and the legacy_json import; both are
+                left alone if None
         """
         self.cache_dir = cache_dir
-        self.cache_file = os.path.join(cache_dir, "prediction_cache.json")
-        
-        # Create cache directory if it doesn't exist
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Load cache from disk or create empty cache
-        self.cache = self._load_cache()
-        
-        logger.info(f"Result cache initialized with {len(self.cache)} entries")
-    
-    def _load_cache(self) -> Dict[str, Any]:
-        """Load cache from disk if it exists"""
-        if os.path.exists(self.cache_file):
-            try:
-                with open(self.cache_file, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading cache: {str(e)}")
-                return {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.fingerprint_hits = 0
+        self.fingerprint_misses = 0
+        self._stats_lock = threading.Lock()
+        # (video_hash, scope) -> (hits, last access) not yet written
+        self._accesses = {}
+        self._accesses_since = None
+
+        if cache_dir is None:
+            # Shared-cache in-memory database; the keep-alive connection keeps it from disappearing
+            super().__init__(f"file:result_cache_{id(self)}?mode=memory&cache=shared", uri=True)
+            self._keep_alive = sqlite3.connect(self.db_path, uri=True, check_same_thread=False)
         else:
-            return {}
-    
-    def _save_cache(self):
-        """Save cache to disk"""
+            super().__init__(os.path.join(cache_dir, db_name))
+            # Create cache directory if it doesn't exist
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._init_db()
+
+        if legacy_scope is not None:
+            self.adopt_legacy(legacy_scope)
+            # One-shot import of the whole-file JSON cache used by older versions
+            if legacy_json and cache_dir is not None:
+                legacy_path = os.path.join(cache_dir, legacy_json)
+                if os.path.exists(legacy_path):
+                    self.import_json(legacy_path, legacy_scope)
+
+        self._compaction_stop = threading.Event()
+        if compaction_interval:
+            self.start_compaction(compaction_interval)
+
+        logger.info(f"Result cache initialized ({self.db_path}, max_entries: {max_entries}, "
+                    f"max_bytes: {max_bytes}, ttl: {ttl_seconds})")
+
+    def start_compaction(self, interval: float):
+        """
+        Compact the cache in a background thread every interval seconds
+        """
+        self._compaction_stop.clear()
+        threading.Thread(
+            target=self._compaction_loop, args=(interval,), name="result-cache-compaction", daemon=True
+        ).start()
+
+    def stop_compaction(self):
+        self._compaction_stop.set()
+
+    def close(self):
+        self.flush_accesses()
+        super().close()
+
+    def _configure(self, conn: sqlite3.Connection):
+        if self.cache_dir is not None:
+            # Must come before WAL mode writes the header of a new database; a no-op on existing ones
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            super()._configure(conn)
+
+    def _init_db(self):
+        """Create the cache tables if they don't exist"""
+        conn = self._connection()
+        # Workers starting at the same time must not race on the schema setup
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "video_hash TEXT NOT NULL, "
+                "scope TEXT NOT NULL DEFAULT '', "
+                "result TEXT NOT NULL, "
+                "timestamp TEXT NOT NULL, "
+                "size_bytes INTEGER NOT NULL DEFAULT 0, "
+                "last_access REAL NOT NULL DEFAULT 0, "
+                "expires_at REAL, "
+                "hits INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (video_hash, scope))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+            # Databases created before eviction support lack the accounting columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+            if "size_bytes" not in columns:
+                conn.execute("ALTER TABLE results ADD COLUMN size_bytes INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE results ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE results ADD COLUMN expires_at REAL")
+                conn.execute("UPDATE results SET size_bytes = length(result)")
+
+            # Databases created before scoped results are keyed by video hash alone;
+            # the table is rebuilt with the new key and old entries get the legacy scope
+            if "scope" not in columns:
+                conn.execute(
+                    "CREATE TABLE results_scoped ("
+                    "video_hash TEXT NOT NULL, "
+                    "scope TEXT NOT NULL DEFAULT '', "
+                    "result TEXT NOT NULL, "
+                    "timestamp TEXT NOT NULL, "
+                    "size_bytes INTEGER NOT NULL DEFAULT 0, "
+                    "last_access REAL NOT NULL DEFAULT 0, "
+                    "expires_at REAL, "
+                    "hits INTEGER NOT NULL DEFAULT 0, "
+                    "PRIMARY KEY (video_hash, scope))"
+                )
+                conn.execute(
+                    "INSERT INTO results_scoped (video_hash, scope, result, timestamp, size_bytes, last_access, expires_at) "
+                    "SELECT video_hash, ?, result, timestamp, size_bytes, last_access, expires_at FROM results",
+                    (LEGACY_SCOPE,)
+                )
+                # Drops the old indexes and triggers too; they are recreated below
+                conn.execute("DROP TABLE results")
+                conn.execute("ALTER TABLE results_scoped RENAME TO results")
+
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at) WHERE expires_at IS NOT NULL")
+
+            # Entry count and total size are kept up to date by triggers, so enforcing
+            # the limits never has to scan the table (and stays right across processes)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_stats ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), "
+                "entries INTEGER NOT NULL, "
+                "bytes INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO cache_stats (id, entries, bytes) "
+                "SELECT 0, COUNT(*), COALESCE(SUM(size_bytes), 0) FROM results"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN "
+                "UPDATE cache_stats SET entries = entries + 1, bytes = bytes + NEW.size_bytes WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN "
+                "UPDATE cache_stats SET entries = entries - 1, bytes = bytes - OLD.size_bytes WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size_bytes ON results BEGIN "
+                "UPDATE cache_stats SET bytes = bytes - OLD.size_bytes + NEW.size_bytes WHERE id = 0; END"
+            )
+
+            # Perceptual fingerprints and their band index; dropped with the last result of their video
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "video_hash TEXT PRIMARY KEY, "
+                "hashes BLOB NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprint_bands ("
+                "band_key INTEGER NOT NULL, "
+                "video_hash TEXT NOT NULL, "
+                "PRIMARY KEY (band_key, video_hash)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS fingerprint_bands_video ON fingerprint_bands (video_hash)")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS results_delete_fingerprint AFTER DELETE ON results "
+                "WHEN NOT EXISTS (SELECT 1 FROM results WHERE video_hash = OLD.video_hash) BEGIN "
+                "DELETE FROM fingerprints WHERE video_hash = OLD.video_hash; "
+                "DELETE FROM fingerprint_bands WHERE video_hash = OLD.video_hash; END"
+            )
+
+        if self.cache_dir is not None:
+            self._enable_auto_vacuum(conn)
+
+    def _enable_auto_vacuum(self, conn: sqlite3.Connection):
+        """
+        Convert a database created without incremental auto-vacuum (which lets
+        compaction return free pages to the OS); this takes a one-time VACUUM
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        started = time.perf_counter()
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        except sqlite3.OperationalError as e:
+            # Another process is using the database; the next start tries again
+            logger.warning(f"Could not enable incremental auto-vacuum: {str(e)}")
+            return
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.warning("Incremental auto-vacuum did not take effect")
+            return
+        logger.info(f"Enabled incremental auto-vacuum in {time.perf_counter() - started:.1f}s")
+
+    def adopt_legacy(self, scope: str) -> int:
+        """
+        Move the results written before results were scoped (see LEGACY_SCOPE)
+        into a scope that is looked up
+
+        Args:
+            scope: Scope to serve them under (e.g. the current one)
+
+        Returns:
+            Number of results moved
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Results already in the scope are newer; the ones they shadow are dropped
+            moved = conn.execute(
+                "UPDATE OR IGNORE results SET scope = ? WHERE scope = ?", (scope, LEGACY_SCOPE)
+            ).rowcount
+            conn.execute("DELETE FROM results WHERE scope = ?", (LEGACY_SCOPE,))
+        if moved:
+            logger.info(f"Moved {moved} unscoped cached results into scope {scope}")
+        return moved
+
+    def import_json(self, json_path: str, scope: str, force: bool = False) -> int:
+        """
+        Import entries from a JSON cache file written by older versions
+
+        Args:
+            json_path: Path of the JSON cache file
+            scope: Scope to serve the imported results under (e.g. the current one)
+            force: Import even if this file was imported before
+
+        Returns:
+            Number of entries imported
+        """
+        meta_key = f"imported:{os.path.abspath(json_path)}"
+        conn = self._connection()
+        if not force and conn.execute("SELECT 1 FROM meta WHERE key = ?", (meta_key,)).fetchone():
+            return 0
+
         try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self.cache, f, indent=2)
+            with open(json_path, 'r') as f:
+                legacy_cache = json.load(f)
         except Exception as e:
-            logger.error(f"Error saving cache: {str(e)}")
-    
+            logger.error(f"Error loading legacy cache {json_path}: {str(e)}")
+            return 0
+
+        now = time.time()
+        rows = []
+        for video_hash, entry in legacy_cache.items():
+            if not isinstance(entry, dict) or "result" not in entry:
+                continue
+            payload = dumps(entry["result"])
+            rows.append((video_hash, scope, payload, entry.get("timestamp", datetime.now().isoformat()),
+                         len(payload), now, self._expiry(now)))
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Entries already in the database are newer than the legacy file
+            conn.executemany(
+                "INSERT OR IGNORE INTO results (video_hash, scope, result, timestamp, size_bytes, last_access, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (meta_key, str(len(rows))))
+            self._enforce_limits(conn)
+
+        logger.info(f"Imported {len(rows)} cached results from {json_path} into scope {scope}")
+        return len(rows)
+
     def compute_video_hash(self, video_data: bytes) -> str:
         """
         Compute a hash for a video file to be used as a unique identifier
-        
+
         Args:
             video_data: Binary data of the video file
-            
+
         Returns:
             A hex string hash representing the video
         """
         return hashlib.sha256(video_data).hexdigest()
-    
-    def get_result(self, video_hash: str) -> Optional[Dict[str, Any]]:
+
+    def _expiry(self, now: float) -> Optional[float]:
+        return now + self.ttl_seconds if self.ttl_seconds else None
+
+    def get_result(self, video_hash: str, scope: str = LEGACY_SCOPE) -> Optional[Dict[str, Any]]:
         """
         Get a cached result for a video if it exists
-        
+
         Args:
             video_hash: Hash of the video
-            
+            scope: Cache scope of the pipeline asking (see cache_scope)
+
         Returns:
             Cached result or None if not found
         """
-        if video_hash in self.cache:
+        with metrics.span("cache_lookup"):
+            result = self._lookup(video_hash, scope)
+        metrics.inc("cache_lookups_total", outcome="hit" if result is not None else "miss")
+        return result
+
+    def _lookup(self, video_hash: str, scope: str) -> Optional[Dict[str, Any]]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT result, expires_at FROM results WHERE video_hash = ? AND scope = ?", (video_hash, scope)
+        ).fetchone()
+
+        now = time.time()
+        if row is not None and row[1] is not None and row[1] <= now:
+            conn.execute(
+                "DELETE FROM results WHERE video_hash = ? AND scope = ? AND expires_at <= ?", (video_hash, scope, now)
+            )
+            with self._stats_lock:
+                self.expirations += 1
+            row = None
+
+        if row is not None:
+            with self._stats_lock:
+                self.hits += 1
+                hits, _ = self._accesses.get((video_hash, scope), (0, now))
+                self._accesses[(video_hash, scope)] = (hits + 1, now)
+                if self._accesses_since is None:
+                    self._accesses_since = now
+                flush = len(self._accesses) >= ACCESS_FLUSH_BATCH or now - self._accesses_since >= ACCESS_FLUSH_INTERVAL
+            if flush:
+                self.flush_accesses()
             logger.info(f"Cache hit for video: {video_hash[:8]}...")
-            return self.cache[video_hash]["result"]
-        
+            return json.loads(row[0])
+
+        with self._stats_lock:
+            self.misses += 1
         logger.info(f"Cache miss for video: {video_hash[:8]}...")
         return None
-    
-    def store_result(self, video_hash: str, result: Dict[str, Any]):
+
+    def flush_accesses(self):
+        """
+        Write the last access times and hit counts recorded by lookups
+        """
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                self._write_accesses(conn)
+        except Exception as e:
+            logger.warning(f"Could not record cache accesses: {str(e)}")
+
+    def _write_accesses(self, conn: sqlite3.Connection):
+        """Write the pending accesses (must be called inside a write transaction)"""
+        with self._stats_lock:
+            accesses, self._accesses, self._accesses_since = self._accesses, {}, None
+        if accesses:
+            conn.executemany(
+                "UPDATE results SET last_access = MAX(last_access, ?), hits = hits + ? WHERE video_hash = ? AND scope = ?",
+                [(last_access, hits, video_hash, scope) for (video_hash, scope), (hits, last_access) in accesses.items()]
+            )
+
+    def store_result(self, video_hash: str, result: Dict[str, Any], scope: str = LEGACY_SCOPE):
         """
-        Store a result in the cache
-        
+        Store a result in the cache, evicting least recently used entries if it is full
+
         Args:
             video_hash: Hash of the video
             result: Prediction result to cache
+            scope: Cache scope of the pipeline that produced the result
         """
-        self.cache[video_hash] = {
-            "result": result,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Save cache to disk
-        self._save_cache()
-        
+        with metrics.span("cache_store"):
+            self._store(video_hash, result, scope)
+
+    def _store(self, video_hash: str, result: Dict[str, Any], scope: str):
+        payload = dumps(result)
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT INTO results (video_hash, scope, result, timestamp, size_bytes, last_access, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (video_hash, scope) DO UPDATE SET result = excluded.result, timestamp = excluded.timestamp, "
+                    "size_bytes = excluded.size_bytes, last_access = excluded.last_access, expires_at = excluded.expires_at",
+                    (video_hash, scope, payload, datetime.now().isoformat(), len(payload), now, self._expiry(now))
+                )
+                self._write_accesses(conn)
+                self._enforce_limits(conn)
+        except Exception as e:
+            logger.error(f"Error saving cache: {str(e)}")
+            return
+
         logger.info(f"Stored result in cache for video: {video_hash[:8]}...")
 
+    def has_result(self, video_hash: str, scope: str = LEGACY_SCOPE) -> bool:
+        """
+        Check whether a result is cached, without counting a lookup or refreshing it
+        """
+        return self._connection().execute(
+            "SELECT 1 FROM results WHERE video_hash = ? AND scope = ?", (video_hash, scope)
+        ).fetchone() is not None
+
+    def hottest(self, scope: str, limit: int) -> List[str]:
+        """
+        Get the most requested videos of a scope
+
+        Args:
+            scope: Cache scope
+            limit: Maximum number of videos
+
+        Returns:
+            Video hashes, most hits first (ties broken by most recent access)
+        """
+        self.flush_accesses()
+        rows = self._connection().execute(
+            "SELECT video_hash FROM results WHERE scope = ? ORDER BY hits DESC, last_access DESC LIMIT ?",
+            (scope, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def invalidate(self, video_hash: Optional[str] = None, scope: Optional[str] = None,
+                   keep_scope: Optional[str] = None) -> int:
+        """
+        Remove cached results selectively; the given conditions are combined
+
+        Args:
+            video_hash: Only remove results of this video
+            scope: Only remove results of this scope
+            keep_scope: Keep results of this scope (e.g. the current one, to drop everything stale)
+
+        Returns:
+            Number of results removed
+        """
+        conditions, params = [], []
+        if video_hash is not None:
+            conditions.append("video_hash = ?")
+            params.append(video_hash)
+        if scope is not None:
+            conditions.append("scope = ?")
+            params.append(scope)
+        if keep_scope is not None:
+            conditions.append("scope != ?")
+            params.append(keep_scope)
+        if not conditions:
+            raise ValueError("invalidate needs a video_hash, scope or keep_scope; use clear_cache to remove everything")
+
+        removed = self._connection().execute(
+            f"DELETE FROM results WHERE {' AND '.join(conditions)}", params
+        ).rowcount
+        logger.info(f"Invalidated {removed} cached results")
+        return removed
+
+    def store_fingerprint(self, video_hash: str, fingerprint: np.ndarray):
+        """
+        Store the perceptual fingerprint of a cached video
+
+        Args:
+            video_hash: Hash of the video (its result should already be stored)
+            fingerprint: uint64 array of frame hashes from compute_fingerprint
+        """
+        keys = band_keys(fingerprint)
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT OR REPLACE INTO fingerprints (video_hash, hashes) VALUES (?, ?)",
+                    (video_hash, fingerprint.astype("<u8").tobytes())
+                )
+                conn.execute("DELETE FROM fingerprint_bands WHERE video_hash = ?", (video_hash,))
+                conn.executemany(
+                    "INSERT INTO fingerprint_bands (band_key, video_hash) VALUES (?, ?)",
+                    [(key, video_hash) for key in keys]
+                )
+        except Exception as e:
+            logger.error(f"Error saving fingerprint: {str(e)}")
+
+    def find_similar(self, fingerprint: np.ndarray, max_distance: float,
+                     scope: str = LEGACY_SCOPE) -> Optional[Tuple[str, float]]:
+        """
+        Find a cached video that is a near-duplicate of a fingerprint
+
+        Videos with a result in the scope that share the most band keys with
+        the fingerprint are aligned against it and the closest one within
+        max_distance is returned.
+
+        Args:
+            fingerprint: uint64 array of frame hashes from compute_fingerprint
+            max_distance: Largest mean Hamming distance (in bits, out of 64) between aligned frames
+            scope: Cache scope the match must have a result in
+
+        Returns:
+            Tuple of (video hash, distance) of the best match, or None
+        """
+        keys = band_keys(fingerprint)
+        best = None
+        if keys:
+            conn = self._connection()
+            # Bound parameters per statement stay well below SQLite's limit
+            counts = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT video_hash, COUNT(*) FROM fingerprint_bands "
+                    f"WHERE band_key IN ({','.join('?' * len(chunk))}) "
+                    f"AND video_hash IN (SELECT video_hash FROM results WHERE scope = ?) GROUP BY video_hash",
+                    chunk + [scope]
+                ).fetchall()
+                for video_hash, count in rows:
+                    counts[video_hash] = counts.get(video_hash, 0) + count
+
+            candidates = sorted(counts, key=counts.get, reverse=True)[:FINGERPRINT_CANDIDATES]
+            for video_hash in candidates:
+                row = conn.execute("SELECT hashes FROM fingerprints WHERE video_hash = ?", (video_hash,)).fetchone()
+                if row is None:
+                    continue
+                match = fingerprint_distance(fingerprint, np.frombuffer(row[0], dtype="<u8").astype(np.uint64))
+                if match is not None and match[0] <= max_distance and (best is None or match[0] < best[1]):
+                    best = (video_hash, match[0])
+
+        self.record_fingerprint_lookup(best is not None)
+        if best is not None:
+            logger.info(f"Fingerprint match: {best[0][:8]}... (distance {best[1]:.1f} bits)")
+        return best
+
+    def record_fingerprint_lookup(self, matched: bool):
+        """
+        Count a near-duplicate lookup (also for lookups made in analysis workers)
+        """
+        with self._stats_lock:
+            if matched:
+                self.fingerprint_hits += 1
+            else:
+                self.fingerprint_misses += 1
+
+    def _enforce_limits(self, conn: sqlite3.Connection):
+        """
+        Evict least recently used entries until the cache is within its limits
+        (must be called inside a write transaction)
+        """
+        if self.max_entries is None and self.max_bytes is None:
+            return
+
+        entries, total_bytes = conn.execute("SELECT entries, bytes FROM cache_stats WHERE id = 0").fetchone()
+        excess_entries = entries - self.max_entries if self.max_entries is not None else 0
+        excess_bytes = total_bytes - self.max_bytes if self.max_bytes is not None else 0
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return
+
+        victims = []
+        for rowid, size_bytes in conn.execute("SELECT rowid, size_bytes FROM results ORDER BY last_access"):
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            victims.append((rowid,))
+            excess_entries -= 1
+            excess_bytes -= size_bytes
+
+        conn.executemany("DELETE FROM results WHERE rowid = ?", victims)
+        with self._stats_lock:
+            self.evictions += len(victims)
+        logger.info(f"Evicted {len(victims)} cached results")
+
+    def compact(self):
+        """
+        Remove expired entries, enforce the size limits and return free space to the OS
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute(
+                "DELETE FROM results WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+            self._write_accesses(conn)
+            self._enforce_limits(conn)
+
+        with self._stats_lock:
+            self.expirations += expired
+
+        if self.cache_dir is not None:
+            conn.execute("PRAGMA incremental_vacuum")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        if expired:
+            logger.info(f"Cache compaction removed {expired} expired results")
+
+    def _compaction_loop(self, interval: float):
+        while not self._compaction_stop.wait(interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting cache: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache size, limits and hit/miss/eviction counters (counters are per process)
+        """
+        entries, total_bytes = self._connection().execute(
+            "SELECT entries, bytes FROM cache_stats WHERE id = 0"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "fingerprint_hits": self.fingerprint_hits,
+            "fingerprint_misses": self.fingerprint_misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def __len__(self):
+        return self._connection().execute("SELECT entries FROM cache_stats WHERE id = 0").fetchone()[0]
+
     def clear_cache(self):
         """Clear the entire cache"""
-        self.cache = {}
-        self._save_cache()
-        logger.info("Cache cleared")
\ No newline at end of file
+        self._connection().execute("DELETE FROM results")
+        logger.info("Cache cleared")
+
+class FingerprintMatcher:
+    """
+    on_fingerprint callback for analyzers: keeps the fingerprint of the
+    analyzed video and stops the analysis with NearDuplicate when it matches
+    a result cached in the scope
+    """
+    def __init__(self, cache: ResultCache, max_distance: float, scope: str):
+        """
+        Args:
+            cache: Cache to look near-duplicates up in
+            max_distance: Largest mean Hamming distance (in bits, out of 64) between aligned frames
+            scope: Cache scope the match must have a result in
+        """
+        self.cache = cache
+        self.max_distance = max_distance
+        self.scope = scope
+        self.fingerprint = None
+
+    def __call__(self, fingerprint: Optional[np.ndarray]):
+        self.fingerprint = fingerprint
+        if fingerprint is None:
+            return
+        match = self.cache.find_similar(fingerprint, self.max_distance, self.scope)
+        if match is not None:
+            raise NearDuplicate(*match)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Import a JSON prediction cache into the SQLite result cache")
+    parser.add_argument("json_file", type=str, help="JSON cache file to import (e.g. cache/simple_prediction_cache.json)")
+    parser.add_argument("--cache-dir", type=str, default="cache", help="Cache directory")
+    parser.add_argument("--db", type=str, default="prediction_cache.db", help="Database file name inside the cache directory")
+    parser.add_argument("--force", action="store_true", help="Import again even if the file was imported before")
+    parser.add_argument("--scope", type=str, default=None,
+                        help="Scope to serve the results under (default: the current scope of --backend)")
+    parser.add_argument("--backend", type=str, default=os.environ.get("ANALYZER_BACKEND", "simple"),
+                        help="ANALYZER_BACKEND whose current scope is the default (loads its model)")
+
+    args = parser.parse_args()
+
+    scope = args.scope
+    if scope is None:
+        from analyzers import create_analyzer
+        scope = create_analyzer(args.backend).cache_scope()
+
+    cache = ResultCache(args.cache_dir, db_name=args.db, legacy_json=None)
+    count = cache.import_json(args.json_file, scope, force=args.force)
+    print(f"Imported {count} entries into {cache.db_path} ({len(cache)} entries total)")
@@ -0,0 +1,366 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import time
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from process_memory import process_memory
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Seconds between reports of the workers' memory
+MEMORY_REPORT_INTERVAL = float(os.environ.get("MEMORY_REPORT_INTERVAL", "30"))
+# Seconds before a worker that exited is replaced, and that stopping workers get to finish
+RESTART_DELAY = 1.0
+SHUTDOWN_TIMEOUT = 30.0
+
+
+class PreforkServer:
+    """
+    Serves simple_app from several worker processes forked from one parent.
+
+    The parent imports the app once, which loads the model weights, the
+    micro-expression reference gallery and the analyzer, then forks the
+    workers. They share those pages copy-on-write instead of each loading
+    its own copy; gc.freeze keeps the garbage collector from touching (and
+    so copying) the inherited objects. The workers accept connections on
+    one listening socket and coordinate through the SQLite-backed result
+    cache, job queue and event channel.
+
+    The parent supervises: it replaces workers that exit, reports each
+    worker's memory (shared and private, and growth since it started), and
+    on a new model (model_metadata.json changing, or SIGHUP) loads it once
+    and replaces the workers so they share it again.
+    """
+    def __init__(self, host: str, port: int, workers: int, memory_interval: float = MEMORY_REPORT_INTERVAL):
+        """
+        Initialize the server
+
+        Args:
+            host: Address to listen on
+            port: Port to listen on
+            workers: Number of worker processes
+            memory_interval: Seconds between memory reports
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.memory_interval = memory_interval
+
+        self.app_module = None
+        self.registry = None
+        self.model_watch_interval = 0.0
+        self.socket = None
+        # Worker pid -> {"slot", "started_at", "baseline"}
+        self.children = {}
+        self.restarts = 0
+        self._stopping = False
+        self._reload_requested = False
+        self._model_mtime = None
+
+    def run(self):
+        # The workers analyze in their own job threads; a pool per worker would load
+        # unshared copies of the model in its processes
+        os.environ.setdefault("ANALYSIS_PROCESSES", "0")
+        self._limit_torch_threads()
+        started = time.perf_counter()
+        import simple_app
+        from analyzers import FullPipelineAnalyzer
+        self.app_module = simple_app
+        if simple_app.ANALYSIS_PROCESSES > 0:
+            logger.warning(f"ANALYSIS_PROCESSES={simple_app.ANALYSIS_PROCESSES}: every worker starts its own "
+                           "analysis processes, which don't share the preloaded model")
+        if isinstance(simple_app.video_analyzer, FullPipelineAnalyzer):
+            self.registry = simple_app.video_analyzer.predictor.registry
+            # The parent watches for new models and replaces the workers instead
+            self.model_watch_interval = simple_app.MODEL_WATCH_INTERVAL
+            simple_app.MODEL_WATCH_INTERVAL = 0
+            self._model_mtime = self._metadata_mtime()
+        logger.info(f"Loaded {simple_app.ANALYZER_BACKEND} analyzer in {time.perf_counter() - started:.1f}s")
+
+        # Workers write their metrics here for /metrics to add up; those of exited workers
+        # are added up in one file so counters don't go back, so start from an empty directory
+        simple_app.METRICS_DIR = os.path.join(simple_app.CACHE_DIR, "metrics")
+        shutil.rmtree(simple_app.METRICS_DIR, ignore_errors=True)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(2048)
+        self.socket.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        self._prepare_fork()
+        for slot in range(self.workers):
+            self._spawn(slot)
+        logger.info(f"Serving on http://{self.host}:{self.port} with {self.workers} workers")
+
+        try:
+            self._supervise()
+        finally:
+            self._shutdown()
+
+    @staticmethod
+    def _limit_torch_threads():
+        """
+        Run torch single-threaded in the parent, before the app loads the
+        model. Its OpenMP and inter-op thread pools don't survive a fork: a
+        worker using a pool its parent had started can deadlock. With one
+        thread the parent never starts one, and each worker starts its own
+        after the fork (see _run_worker).
+        """
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(1)
+        torch.set_num_interop_threads(1)
+
+    def _prepare_fork(self):
+        """Leave nothing in the parent that a forked worker can't use"""
+        app = self.app_module
+        # SQLite connections must not be carried across a fork; they are reopened on use
+        app.result_cache.close()
+        app.job_queue.close()
+        app.job_events.close()
+        app.file_hashes.close()
+
+        if "torch" in sys.modules and sys.modules["torch"].get_num_threads() != 1:
+            logger.warning("torch is multi-threaded in the parent; its thread pools may deadlock the forked workers")
+
+        # (the predictor's executor threads are replaced in forked processes)
+        threads = [thread.name for thread in threading.enumerate()
+                   if thread is not threading.main_thread() and not thread.name.startswith("predictor")]
+        if threads:
+            logger.warning(f"Forking with background threads running, which the workers won't have: {threads}")
+
+        # Move everything loaded so far out of the collector's reach, so collections in
+        # the workers don't write to (and so copy) the shared pages
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker(slot)
+                code = 0
+            except Exception as e:
+                logger.error(f"Worker {slot} failed: {str(e)}")
+            finally:
+                os._exit(code)
+        self.children[pid] = {"slot": slot, "started_at": time.time(), "baseline": None}
+        logger.info(f"Started worker {slot} (pid {pid})")
+
+    def _run_worker(self, slot: int):
+        import uvicorn
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        self.socket.set_inheritable(False)
+        # Anything the parent recorded before forking is not this worker's
+        from metrics import metrics
+        metrics.drain()
+
+        # Forked workers would otherwise draw the same random numbers
+        random.seed()
+        np = sys.modules.get("numpy")
+        if np is not None:
+            np.random.seed()
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            # Split the cores between the workers instead of every worker using all of them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+
+        config = uvicorn.Config(self.app_module.app, log_level="info", lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.socket])
+
+    def _supervise(self):
+        last_report = time.monotonic()
+        last_model_check = time.monotonic()
+        while not self._stopping:
+            self._reap()
+
+            if self.model_watch_interval and time.monotonic() - last_model_check >= self.model_watch_interval:
+                last_model_check = time.monotonic()
+                mtime = self._metadata_mtime()
+                if mtime is not None and mtime != self._model_mtime:
+                    logger.info("Model metadata changed")
+                    self._reload_requested = True
+            if self._reload_requested:
+                self._reload_requested = False
+                self._reload_model()
+
+            if time.monotonic() - last_report >= self.memory_interval:
+                last_report = time.monotonic()
+                self._report_memory()
+            time.sleep(0.5)
+
+    def _reap(self):
+        """Replace workers that have exited"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            child = self.children.pop(pid, None)
+            if child is None:
+                continue
+            self._retire_metrics(pid)
+            if self._stopping:
+                continue
+            if child.get("retiring"):
+                logger.info(f"Worker {child['slot']} (pid {pid}) stopped")
+                continue
+            logger.warning(f"Worker {child['slot']} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; "
+                           f"restarting it")
+            self.restarts += 1
+            time.sleep(RESTART_DELAY)
+            self._spawn(child["slot"])
+
+    def _retire_metrics(self, pid: int):
+        """Fold the metrics snapshot of an exited worker into the exited workers' one"""
+        from metrics import Metrics
+        Metrics.retire_snapshot(self.app_module.METRICS_DIR, pid)
+
+    def _reload_model(self):
+        """Load the new model once in the parent, then replace the workers"""
+        registry = self.registry
+        if registry is None:
+            return
+        self._model_mtime = self._metadata_mtime()
+        previous = registry.current().version
+        registry.reload(wait=True)
+        if registry.current().version == previous:
+            logger.info(f"Model {previous} unchanged; workers keep running")
+            return
+
+        logger.info(f"Replacing workers to share model {registry.current().version}")
+        self._prepare_fork()
+        for pid, child in list(self.children.items()):
+            if child.get("retiring"):
+                continue
+            self._spawn(child["slot"])
+            # The old worker finishes its requests before exiting
+            child["retiring"] = True
+            os.kill(pid, signal.SIGTERM)
+
+    def _report_memory(self) -> Dict[str, Any]:
+        """Log the workers' memory and write it to the report served at /workers"""
+        workers = []
+        for pid, child in sorted(self.children.items(), key=lambda item: item[1]["slot"]):
+            memory = process_memory(pid)
+            if memory is None:
+                continue
+            if child["baseline"] is None:
+                child["baseline"] = memory
+            growth = {key: round(memory[key] - child["baseline"][key], 1) for key in ("rss", "private") if key in memory}
+            workers.append({
+                "slot": child["slot"],
+                "pid": pid,
+                "started_at": datetime.fromtimestamp(child["started_at"]).isoformat(),
+                "memory_mb": {key: round(value, 1) for key, value in memory.items()},
+                "growth_mb": growth
+            })
+            logger.info(f"Worker {child['slot']} (pid {pid}): rss {memory['rss']:.1f} MB "
+                        f"(shared {memory.get('shared', 0):.1f}, private {memory.get('private', 0):.1f}), "
+                        f"{growth.get('rss', 0):+.1f} MB since start")
+
+        parent = process_memory() or {}
+        report = {
+            "updated_at": datetime.now().isoformat(),
+            "parent": {"pid": os.getpid(), "memory_mb": {key: round(value, 1) for key, value in parent.items()}},
+            "workers": workers,
+            "restarts": self.restarts
+        }
+        if parent.get("pss") is not None and all("pss" in w["memory_mb"] for w in workers):
+            total_rss = parent["rss"] + sum(w["memory_mb"]["rss"] for w in workers)
+            total_pss = parent["pss"] + sum(w["memory_mb"]["pss"] for w in workers)
+            # Shared pages are counted in every process's RSS but only once in the PSS total
+            report["total_mb"] = {"rss": round(total_rss, 1), "pss": round(total_pss, 1),
+                                  "saved_by_sharing": round(total_rss - total_pss, 1)}
+            logger.info(f"Server memory: {total_pss:.1f} MB in {len(workers) + 1} processes "
+                        f"({total_rss - total_pss:.1f} MB saved by sharing)")
+
+        path = self.app_module.WORKERS_REPORT_PATH
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write worker report: {str(e)}")
+        return report
+
+    def _metadata_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.registry.metadata_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _shutdown(self):
+        logger.info("Stopping workers")
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+            elif self.children.pop(pid, None) is not None:
+                self._retire_metrics(pid)
+        for pid in self.children:
+            logger.warning(f"Worker pid {pid} did not stop in time; killing it")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.socket.close()
+        try:
+            os.remove(self.app_module.WORKERS_REPORT_PATH)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing one loaded model")
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVE_WORKERS", os.cpu_count() or 1)),
+                        help="Number of worker processes (default: SERVE_WORKERS or the number of CPUs)")
+    parser.add_argument("--memory-interval", type=float, default=MEMORY_REPORT_INTERVAL,
+                        help="Seconds between reports of the workers' memory")
+    args = parser.parse_args()
+
+    PreforkServer(args.host, args.port, args.workers, args.memory_interval).run()
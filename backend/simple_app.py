@@ -1,23 +1,76 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 import logging
 import os
-import shutil
-import numpy as np
-import uuid
-import hashlib
 import json
+import time
+import asyncio
 import cv2
+import numpy as np
+import secrets
 import traceback
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+from result_cache import ResultCache, FingerprintMatcher
+from upload_ingest import ingest_upload, ingest_uploads, IngestedUpload, UploadTooLarge, InvalidUpload
+from path_ingest import FileHashIndex, PathNotAllowed, ingest_path, is_within
+from job_queue import JobQueue, public_job, ACTIVE_STATUSES, INTERACTIVE, BATCH, PRIORITIES
+from events import EventChannel, FINISHED, SUBSCRIPTION_TTL
+from admission import AdmissionController, Overloaded
+from coalescing import SingleFlight
+from video_fingerprint import NearDuplicate
+from rescoring import UploadRetention, Rescorer
+from analyzers import create_analyzer, FullPipelineAnalyzer
+from analysis_pool import AnalysisPool
+from live_stream import LiveAnalysisSession, serve_live_stream, DEFAULT_SAMPLE_RATE
+from metrics import Metrics, RequestMetricsMiddleware, metrics
+from process_memory import memory_tracker, rss_bytes
+from profiling import TraceStore, TraceMiddleware, activate, current_trace, chrome_trace, speedscope_profile
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the background threads, analysis workers and the job queue with
+    the server. They are not started on import, as the analysis worker
+    processes import the main module again when it is this file, and
+    serve.py forks its workers after importing it.
+    """
+    global analysis_pool
+    if RESULT_CACHE_COMPACTION_INTERVAL:
+        result_cache.start_compaction(RESULT_CACHE_COMPACTION_INTERVAL)
+    if isinstance(video_analyzer, FullPipelineAnalyzer) and MODEL_WATCH_INTERVAL:
+        video_analyzer.predictor.registry.start_watching(MODEL_WATCH_INTERVAL)
+    if ANALYSIS_PROCESSES > 0:
+        analysis_pool = AnalysisPool(ANALYSIS_PROCESSES, ANALYZER_BACKEND, {
+            "watch_interval": None,
+            "embedding_spill_dir": EMBEDDING_SPILL_DIR,
+            "stage_cache_dir": os.path.join(CACHE_DIR, "stages"),
+            "stage_cache_max_bytes": STAGE_CACHE_MAX_BYTES
+        }, memory=MEMORY_SETTINGS, result_cache={"cache_dir": CACHE_DIR, "db_name": RESULT_CACHE_DB})
+        analysis_pool.warm_up()
+    if METRICS_DIR:
+        metrics.start_sharing(METRICS_DIR, METRICS_SHARE_INTERVAL)
+    job_queue.start()
+    yield
+    job_queue.stop()
+    if METRICS_DIR:
+        metrics.stop_sharing(METRICS_DIR)
+    result_cache.stop_compaction()
+    if isinstance(video_analyzer, FullPipelineAnalyzer):
+        video_analyzer.predictor.registry.stop_watching()
+    if analysis_pool is not None:
+        analysis_pool.shutdown()
+
 # Create FastAPI app with minimal setup
-app = FastAPI(title="Lie Detection API")
+app = FastAPI(title="Lie Detection API", lifespan=lifespan)
 
 # Configure CORS - allow requests from the frontend
 app.add_middleware(
@@ -26,105 +79,439 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+# Count and time every request (see /metrics)
+app.add_middleware(RequestMetricsMiddleware)
+
 # Create necessary directories
 UPLOADS_DIR = "uploads"
 CACHE_DIR = "cache"
+# Result cache database inside CACHE_DIR (also opened by the analysis workers)
+RESULT_CACHE_DB = "simple_prediction_cache.db"
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 os.makedirs(CACHE_DIR, exist_ok=True)
 
-# Simple cache for storing video results
-class ResultCache:
-    def __init__(self, cache_dir=CACHE_DIR):
-        self.cache_dir = cache_dir
-        self.cache_file = os.path.join(cache_dir, "simple_prediction_cache.json")
-        self.cache = self._load_cache()
-        logger.info(f"Cache initialized with {len(self.cache)} entries")
-    
-    def _load_cache(self):
-        if os.path.exists(self.cache_file):
-            try:
-                with open(self.cache_file, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading cache: {str(e)}")
-                return {}
-        return {}
-    
-    def _save_cache(self):
-        try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self.cache, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving cache: {str(e)}")
-    
-    def get_result(self, video_hash):
-        if video_hash in self.cache:
-            logger.info(f"Cache hit for video: {video_hash[:8]}...")
-            return self.cache[video_hash]["result"]
-        logger.info(f"Cache miss for video: {video_hash[:8]}...")
-        return None
-    
-    def store_result(self, video_hash, result):
-        self.cache[video_hash] = {
-            "result": result,
-            "timestamp": datetime.now().isoformat()
-        }
-        self._save_cache()
-        logger.info(f"Stored result in cache for video: {video_hash[:8]}...")
+# Which analyzer serves /upload: "simple" (the dataset-based analyzer below) or
+# "full" (VideoProcessor + Predictor, needs torch and ideally a trained model)
+ANALYZER_BACKEND = os.environ.get("ANALYZER_BACKEND", "simple")
+# Seconds between checks of models/model_metadata.json for a newly trained model (0 disables)
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "10"))
+# Directory the full pipeline spills evicted CNN frame embeddings to (disabled if unset)
+EMBEDDING_SPILL_DIR = os.environ.get("EMBEDDING_SPILL_DIR")
+# Result cache bounds (unbounded when unset) and background compaction interval in seconds
+RESULT_CACHE_MAX_ENTRIES = int(os.environ["RESULT_CACHE_MAX_ENTRIES"]) if os.environ.get("RESULT_CACHE_MAX_ENTRIES") else None
+RESULT_CACHE_MAX_BYTES = int(os.environ["RESULT_CACHE_MAX_BYTES"]) if os.environ.get("RESULT_CACHE_MAX_BYTES") else None
+RESULT_CACHE_TTL = float(os.environ["RESULT_CACHE_TTL"]) if os.environ.get("RESULT_CACHE_TTL") else None
+RESULT_CACHE_COMPACTION_INTERVAL = float(os.environ.get("RESULT_CACHE_COMPACTION_INTERVAL", "300"))
+# Serve re-encoded or trimmed copies of cached videos from the cache, matched by
+# perceptual fingerprint, and the largest mean per-frame hash distance (bits of 64) to accept
+FINGERPRINT_MATCHING = os.environ.get("FINGERPRINT_MATCHING", "1") == "1"
+FINGERPRINT_MAX_DISTANCE = float(os.environ.get("FINGERPRINT_MAX_DISTANCE", "8"))
+# Disk budget of the full pipeline's cache of extracted face crops and audio features (0 disables)
+STAGE_CACHE_MAX_BYTES = int(os.environ.get("STAGE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Disk budget for keeping uploaded videos, so cached results can be recomputed
+# with a new model even without stage cache entries (0 disables), and how many
+# of the hottest results to recompute in the background after a model swap
+# (0 disables) for at most how many seconds
+RESCORE_RETAIN_BYTES = int(os.environ.get("RESCORE_RETAIN_BYTES", "0"))
+RESCORE_HOTTEST = int(os.environ.get("RESCORE_HOTTEST", "50"))
+RESCORE_TIME_BUDGET = float(os.environ.get("RESCORE_TIME_BUDGET", "120"))
+# Largest accepted upload in bytes, and the size of the chunks uploads are written to disk in
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Most videos in one /batch upload
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "16"))
+# Directories (separated by os.pathsep) whose files /upload and /batch analyze in
+# place when given their path; path ingestion is disabled when unset
+INGEST_ROOTS = [root for root in os.environ.get("INGEST_ROOTS", "").split(os.pathsep) if root]
+# Analysis worker threads per server process, how long finished jobs are kept
+# (seconds), and the longest a request may wait for a job to finish
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", str(24 * 3600)))
+MAX_WAIT_SECONDS = float(os.environ.get("MAX_WAIT_SECONDS", "60"))
+# Seconds between checks for new job events of an SSE stream (jobs publish progress at most
+# every second), and between keep-alive comments
+EVENT_POLL_INTERVAL = float(os.environ.get("EVENT_POLL_INTERVAL", "1.0"))
+EVENT_KEEPALIVE_SECONDS = float(os.environ.get("EVENT_KEEPALIVE_SECONDS", "15"))
+# Most jobs that may wait for a worker before uploads are rejected with 503
+# (0 disables admission control), and most batch jobs before batch uploads
+# are rejected with 429 (half of MAX_QUEUED_JOBS when unset)
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "32"))
+MAX_QUEUED_BATCH_JOBS = int(os.environ["MAX_QUEUED_BATCH_JOBS"]) if os.environ.get("MAX_QUEUED_BATCH_JOBS") else None
+# Worker processes running the analysis, each with its own copy of the model
+# (0 runs it in the job threads of the server process)
+ANALYSIS_PROCESSES = int(os.environ.get("ANALYSIS_PROCESSES", "2" if ANALYZER_BACKEND == "full" else "0"))
+# Most concurrent live streams on /stream, and face frames per incremental model step
+MAX_LIVE_SESSIONS = int(os.environ.get("MAX_LIVE_SESSIONS", "4"))
+LIVE_WINDOW_FRAMES = int(os.environ.get("LIVE_WINDOW_FRAMES", "1"))
+# Memory report of the worker processes, written by serve.py
+WORKERS_REPORT_PATH = os.path.join(CACHE_DIR, "workers.json")
+# Directory the serve.py workers share their metrics through (set by serve.py),
+# and seconds between the writes of each worker
+METRICS_DIR = None
+METRICS_SHARE_INTERVAL = float(os.environ.get("METRICS_SHARE_INTERVAL", "5"))
+# Record traces of the requests that ask for one (with the admin token), how many
+# are kept, and the seconds between call stack samples of profiled traces
+TRACE_REQUESTS = os.environ.get("TRACE_REQUESTS", "0") == "1"
+TRACE_MAX = int(os.environ.get("TRACE_MAX", "50"))
+TRACE_SAMPLE_INTERVAL = float(os.environ.get("TRACE_SAMPLE_INTERVAL", "0.005"))
+# Memory accounting of the analysis (off by default, as it reads /proc around every stage):
+# RSS around every stage and per analysis, tracemalloc (frames kept per allocation, 0
+# disables), and the growth over how many analyses flags a process
+MEMORY_TRACKING = os.environ.get("MEMORY_TRACKING", "0") == "1"
+MEMORY_TRACEMALLOC_FRAMES = int(os.environ.get("MEMORY_TRACEMALLOC_FRAMES", "0"))
+MEMORY_GROWTH_WINDOW = int(os.environ.get("MEMORY_GROWTH_WINDOW", "20"))
+MEMORY_GROWTH_THRESHOLD_MB = float(os.environ.get("MEMORY_GROWTH_THRESHOLD_MB", "64"))
+MEMORY_SETTINGS = {
+    "enabled": MEMORY_TRACKING,
+    "tracemalloc_frames": MEMORY_TRACEMALLOC_FRAMES,
+    "growth_window": MEMORY_GROWTH_WINDOW,
+    "growth_threshold_mb": MEMORY_GROWTH_THRESHOLD_MB
+}
+memory_tracker.configure(**MEMORY_SETTINGS)
 
-# Initialize cache
-result_cache = ResultCache()
+# Token expected in the X-Admin-Token header; the /admin endpoints are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
 
-# Simple implementation to use micro-expression dataset
-class MicroExpressionAnalyzer:
-    def __init__(self):
-        self.truth_dir = os.path.join("micro_expression_dataset", "truth")
-        self.lie_dir = os.path.join("micro_expression_dataset", "lie")
-        
-        # Check if the dataset exists
-        self.dataset_loaded = (os.path.exists(self.truth_dir) and 
-                              os.path.exists(self.lie_dir) and
-                              len(os.listdir(self.truth_dir)) > 0 and
-                              len(os.listdir(self.lie_dir)) > 0)
-        
-        if self.dataset_loaded:
-            self.truth_count = len(os.listdir(self.truth_dir))
-            self.lie_count = len(os.listdir(self.lie_dir))
-            logger.info(f"Micro-expression dataset loaded: {self.truth_count} truth images, {self.lie_count} lie images")
-        else:
-            logger.warning("Micro-expression dataset not found or empty")
-    
-    def analyze_video(self, video_path):
-        # This is a simplified version that doesn't actually analyze the video
-        # but simulates the result based on whether the dataset exists
-        if not self.dataset_loaded:
-            # Random result if dataset isn't loaded
-            is_truth = np.random.random() > 0.5
-        else:
-            # Deterministic but pseudo-random result based on the video path
-            # This ensures the same video will always get the same result
-            video_hash = hashlib.md5(video_path.encode()).hexdigest()
-            hash_value = int(video_hash[:8], 16)
-            is_truth = (hash_value % 100) > 50  # Deterministic outcome
-        
-        confidence = 70.0 + np.random.random() * 25.0
-        
-        # In a real implementation, we'd extract frames and compare with the dataset
-        return {
-            "prediction": "Truth" if is_truth else "Fake",
-            "confidence": confidence,
-            "features": {
-                "facialExpressions": 65 + np.random.random() * 25,
-                "voiceAnalysis": 60 + np.random.random() * 30,
-                "microGestures": 70 + np.random.random() * 20
+# /upload reads the multipart body itself, so its schema is declared by hand for the API docs
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
             },
-            "using_dataset": self.dataset_loaded
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"path": {"type": "string", "description": "Server-side path or file:// URI"}},
+                    "required": ["path"]
+                }
+            }
         }
+    }
+}
+
+# /batch takes the same file field, repeated once per video
+BATCH_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"]
+                }
+            },
+            "application/json": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"paths": {"type": "array", "items": {"type": "string"}}},
+                    "required": ["paths"]
+                }
+            }
+        }
+    }
+}
+
+# Initialize the analyzer serving /upload (it watches for new models once the server has started)
+video_analyzer = create_analyzer(ANALYZER_BACKEND, {
+    "watch_interval": None,
+    "embedding_spill_dir": EMBEDDING_SPILL_DIR,
+    "stage_cache_dir": os.path.join(CACHE_DIR, "stages"),
+    "stage_cache_max_bytes": STAGE_CACHE_MAX_BYTES
+})
+
+# Initialize cache (results from older versions, including the old
+# simple_prediction_cache.json imported once, are served under the current
+# scope); it is compacted in the background once the server has started
+result_cache = ResultCache(
+    CACHE_DIR,
+    db_name=RESULT_CACHE_DB,
+    legacy_json="simple_prediction_cache.json",
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=RESULT_CACHE_TTL,
+    legacy_scope=video_analyzer.cache_scope()
+)
+
+# CPU-bound analysis runs in worker processes (created on startup), each with its
+# own copy of the analyzer on top of this process's (about 0.5 GB each with the
+# full backend, see the README); they follow this process's model version and
+# don't watch for new models
+analysis_pool = None
+
+upload_retention = None
+if RESCORE_RETAIN_BYTES > 0:
+    upload_retention = UploadRetention(os.path.join(UPLOADS_DIR, "retained"), RESCORE_RETAIN_BYTES)
+
+def rescore_video(video_hash: str, loaded_model) -> Optional[Dict[str, Any]]:
+    """
+    Re-analyze a cached video with a new model, from its stage cache entry,
+    its retained upload or the file it was ingested in place from (None if
+    none is available)
+    """
+    video_path = upload_retention.path_for(video_hash) if upload_retention is not None else None
+    if video_path is None and INGEST_ROOTS:
+        # Files ingested in place are never retained, but are still where they were
+        video_path = file_hashes.path_for(video_hash, INGEST_ROOTS)
+    return video_analyzer.rescore(video_hash, video_path, loaded_model)
+
+def start_rescoring(previous_model, loaded_model):
+    """
+    Swap hook: recompute the hottest results of the previous model with the new one in the background
+    """
+    if previous_model is None:
+        return
+    rescorer.start(
+        video_analyzer.cache_scope(previous_model.version),
+        video_analyzer.cache_scope(loaded_model.version),
+        lambda video_hash: rescore_video(video_hash, loaded_model)
+    )
+
+# Recompute the hottest results with each new model once it is swapped in
+rescorer = None
+if (isinstance(video_analyzer, FullPipelineAnalyzer) and RESCORE_HOTTEST > 0 and
+        (video_analyzer.stage_cache is not None or upload_retention is not None or INGEST_ROOTS)):
+    rescorer = Rescorer(result_cache, RESCORE_HOTTEST, RESCORE_TIME_BUDGET)
+    video_analyzer.predictor.registry.add_swap_hook(start_rescoring)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Dependency guarding the /admin endpoints
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled (ADMIN_TOKEN not set)")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def analyze_and_store(video_path: str, video_hash: str, scope: str, model_version: Optional[str] = None,
+                      progress=None) -> Dict[str, Any]:
+    """
+    Analyze a video with the configured analyzer (in the analysis pool if
+    enabled) and cache the result. Near-duplicates of a cached video get
+    the cached result instead: their fingerprint is taken from the frames
+    the analysis decodes, and the analysis stops before the prediction.
+    """
+    if progress is not None:
+        progress(0.1, "analyzing")
+    try:
+        prediction_result, fingerprint = run_analyzer(video_path, video_hash, scope if FINGERPRINT_MATCHING else None,
+                                                      model_version, progress)
+    except NearDuplicate as duplicate:
+        cached_result = result_cache.get_result(duplicate.video_hash, scope)
+        if cached_result is not None:
+            # Exact re-uploads of this copy become plain cache hits
+            result_cache.store_result(video_hash, cached_result, scope)
+            cached_result["cache_hit"] = "fingerprint"
+            cached_result["fingerprint_distance"] = duplicate.distance
+            return cached_result
+        # The match was evicted in the meantime
+        prediction_result, fingerprint = run_analyzer(video_path, video_hash, None, model_version, progress)
+
+    result_cache.store_result(video_hash, prediction_result, scope)
+    if fingerprint is not None:
+        result_cache.store_fingerprint(video_hash, fingerprint)
+    return prediction_result
+
+def run_analyzer(video_path: str, video_hash: str, match_scope: Optional[str], model_version: Optional[str] = None,
+                 progress=None) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    """
+    Run the analyzer on a video (in the analysis pool if enabled)
+
+    Args:
+        video_path: Path to the video
+        video_hash: SHA-256 of the video
+        match_scope: Cache scope to look near-duplicates up in (None to skip the lookup)
+        model_version: Model version to analyze with
+        progress: Optional progress(fraction, stage, partial=None) callback
+
+    Returns:
+        Tuple of (prediction result, fingerprint of the video or None)
+
+    Raises:
+        NearDuplicate: If the video is a near-duplicate of a result cached in match_scope
+    """
+    if analysis_pool is not None:
+        near_duplicates = (match_scope, FINGERPRINT_MAX_DISTANCE) if match_scope is not None else None
+        try:
+            prediction_result, fingerprint = analysis_pool.analyze(video_path, video_hash, model_version, progress,
+                                                                   near_duplicates)
+        except NearDuplicate:
+            result_cache.record_fingerprint_lookup(True)
+            raise
+        if fingerprint is not None:
+            result_cache.record_fingerprint_lookup(False)
+        return prediction_result, fingerprint
+
+    matcher = FingerprintMatcher(result_cache, FINGERPRINT_MAX_DISTANCE, match_scope) if match_scope is not None else None
+    with memory_tracker.request(video_hash):
+        prediction_result = video_analyzer.analyze_video(
+            video_path, video_hash, progress, video_analyzer.model_for_version(model_version), matcher
+        )
+    return prediction_result, matcher.fingerprint if matcher is not None else None
+
+def release_upload(video_path: Optional[str], video_hash: str):
+    """
+    Delete an uploaded file that is no longer needed (or keep it for rescoring)
+    """
+    if not video_path or not os.path.exists(video_path):
+        return
+    # Files ingested in place by path belong to their storage, not to the server
+    if not is_within(video_path, UPLOADS_DIR):
+        return
+    try:
+        if upload_retention is not None:
+            upload_retention.retain(video_path, video_hash)
+        else:
+            os.remove(video_path)
+            logger.info(f"Temporary file removed: {video_path}")
+    except Exception as e:
+        logger.warning(f"Could not remove temporary file: {str(e)}")
+
+def run_analysis_job(job: Dict[str, Any], progress) -> Dict[str, Any]:
+    """
+    Job handler: analyze an uploaded video, then release the upload. The
+    job of a traced upload records its part of the trace.
+    """
+    trace = trace_store.resume(job["trace_id"]) if job["trace_id"] else None
+    if trace is None:
+        return analyze_job_upload(job, progress)
+    trace.add("queue_wait", job["created_at"], job["started_at"] - job["created_at"], {"job_id": job["id"]})
+    try:
+        with activate(trace), trace.span("job", job_id=job["id"]):
+            return analyze_job_upload(job, progress)
+    finally:
+        trace_store.save(trace)
+
+def analyze_job_upload(job: Dict[str, Any], progress) -> Dict[str, Any]:
+    """
+    Analyze the upload of a job (unless an identical job has cached the result meanwhile), then release it
+    """
+    try:
+        # The model may have been swapped while the job was queued; the result
+        # is computed with, and cached under, the version active now
+        model_version = video_analyzer.model_version()
+        scope = video_analyzer.cache_scope(model_version)
+        # An identical job may have finished while this one was queued
+        cached_result = result_cache.get_result(job["video_hash"], scope)
+        if cached_result is not None:
+            return cached_result
+
+        def compute():
+            if not job["video_path"] or not os.path.exists(job["video_path"]):
+                raise FileNotFoundError("The uploaded video is no longer available")
+            return analyze_and_store(job["video_path"], job["video_hash"], scope, model_version, progress)
+
+        # Jobs queued under different scopes (so not coalesced by the queue) that
+        # end up analyzed under the same one, in any worker process, run once
+        return single_flight.run(f"{job['video_hash']}-{scope}", compute,
+                                 lambda: result_cache.get_result(job["video_hash"], scope))
+    finally:
+        release_job_upload(job)
+
+def release_job_upload(job: Dict[str, Any]):
+    """
+    Release the upload of a job (also called by the queue for jobs cancelled before their handler finished)
+    """
+    release_upload(job["video_path"], job["video_hash"])
+
+# Hashes of the files ingested in place, so unchanged files are not read again
+file_hashes = FileHashIndex(os.path.join(CACHE_DIR, "file_hashes.db"))
+
+# Traces of the requests that asked for one, in a directory shared by the serve.py workers
+trace_store = TraceStore(os.path.join(CACHE_DIR, "traces"), TRACE_MAX, TRACE_SAMPLE_INTERVAL)
+if TRACE_REQUESTS:
+    app.add_middleware(TraceMiddleware, store=trace_store, admin_token=ADMIN_TOKEN)
+
+# Progress and provisional results of jobs, for /results/{job_id}/events
+job_events = EventChannel(os.path.join(CACHE_DIR, "events.db"))
+
+# Concurrent analyses of the same video and scope (in this process or other
+# worker processes on this host) share one run
+single_flight = SingleFlight(os.path.join(CACHE_DIR, "locks"))
+
+# Uploads are analyzed by a pool of worker threads; jobs persist across restarts
+job_queue = JobQueue(os.path.join(CACHE_DIR, "jobs.db"), run_analysis_job,
+                     workers=JOB_WORKERS, retention_seconds=JOB_RETENTION, events=job_events,
+                     release=release_job_upload)
+
+admission = AdmissionController(job_queue, MAX_QUEUED_JOBS, MAX_QUEUED_BATCH_JOBS) if MAX_QUEUED_JOBS > 0 else None
+# Number of open /stream sessions
+live_sessions = 0
+
+def submit_upload(upload, scope: str, priority: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Create the job of an ingested upload: a finished one if its result is
+    cached, otherwise a queued one (or the active job for the same video)
+
+    Returns:
+        Tuple of (job, taken). taken is True if the job took over the
+        uploaded file, which it releases once it has run.
+    """
+    # Check if we already have a result for this exact video
+    cached_result = result_cache.get_result(upload.sha256, scope)
+    if cached_result:
+        logger.info(f"Returning cached result for {upload.filename}")
+        job, _ = job_queue.submit(upload.sha256, scope, None, upload.filename, cached_result, priority)
+        return job, False
+    # Identical uploads while a job for this video is active join that job
+    trace = current_trace()
+    return job_queue.submit(upload.sha256, scope, upload.path, upload.filename, None, priority,
+                            trace.trace_id if trace is not None else None)
+
+def is_json_request(request: Request) -> bool:
+    return request.headers.get("content-type", "").split(";")[0].strip().lower() == "application/json"
+
+async def ingest_request_paths(request: Request, max_files: int = 1) -> List[IngestedUpload]:
+    """
+    Ingest the server-side files named by a JSON request body, {"path": ...}
+    or {"paths": [...]}, in place (see path_ingest.py)
+
+    Raises:
+        InvalidUpload: If the body names no files, or more than max_files
+        PathNotAllowed: If a file is outside INGEST_ROOTS
+        FileNotFoundError: If a file doesn't exist
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        raise InvalidUpload("Request body is not valid JSON")
+    paths = None
+    if isinstance(body, dict):
+        paths = body.get("paths", [body["path"]] if "path" in body else None)
+    if not isinstance(paths, list) or not paths or not all(isinstance(path, str) for path in paths):
+        raise InvalidUpload('Expected a JSON body with "path" or "paths"')
+    if len(paths) > max_files:
+        raise InvalidUpload(f"Request names more than {max_files} files")
+    # Hashing reads new files from disk, so it runs in the threadpool
+    return [await run_in_threadpool(ingest_path, path, INGEST_ROOTS, file_hashes) for path in paths]
+
+def job_response(job: Dict[str, Any]) -> JSONResponse:
+    """
+    Respond with a job: 200 once it has finished, 202 while it is queued or running
+    """
+    finished = job["status"] not in ACTIVE_STATUSES
+    return JSONResponse(
+        public_job(job),
+        status_code=200 if finished else 202,
+        headers=None if finished else {"Location": f"/results/{job['id']}"}
+    )
 
-# Initialize micro-expression analyzer
-micro_expression_analyzer = MicroExpressionAnalyzer()
+def get_model_registry():
+    """
+    Get the model registry of the full pipeline
+    """
+    if not isinstance(video_analyzer, FullPipelineAnalyzer):
+        raise HTTPException(status_code=409, detail="Model registry is only available with ANALYZER_BACKEND=full")
+    return video_analyzer.predictor.registry
 
 @app.get("/")
 def read_root():
@@ -136,6 +523,14 @@ def get_model_status():
     Simplified model status endpoint
     """
     logger.info("Model status requested")
+    if isinstance(video_analyzer, FullPipelineAnalyzer):
+        loaded_model = video_analyzer.predictor.registry.current()
+        return {
+            "model_loaded": True,
+            "last_trained": loaded_model.last_trained,
+            "accuracy": loaded_model.accuracy,
+            "version": loaded_model.version
+        }
     return {
         "model_loaded": True,
         "last_trained": "2025-04-27T10:44:11",
@@ -143,57 +538,444 @@ def get_model_status():
         "version": "model_20250427_104411.pth"
     }
 
-@app.post("/upload")
-async def upload_video(file: UploadFile = File(...)):
+@app.get("/cache/stats")
+def get_cache_stats():
     """
-    Upload endpoint that uses the micro-expression dataset and caches results
+    Cache sizes and hit rates
+    """
+    stats = {
+        "scope": video_analyzer.cache_scope(),
+        "results": result_cache.stats(),
+        "coalescing": single_flight.stats()
+    }
+    if upload_retention is not None:
+        stats["retained_uploads"] = upload_retention.stats()
+    if rescorer is not None:
+        stats["last_rescore"] = rescorer.last_run
+    if INGEST_ROOTS:
+        stats["file_hashes"] = file_hashes.stats()
+    if isinstance(video_analyzer, FullPipelineAnalyzer):
+        stats["embeddings"] = video_analyzer.predictor.embedding_cache.stats()
+        if video_analyzer.stage_cache is not None:
+            stats["stages"] = video_analyzer.stage_cache.stats()
+    return stats
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+def list_models():
     """
+    List the model versions known to the registry
+    """
+    registry = get_model_registry()
+    return {"versions": registry.list_versions(), "status": registry.status()}
+
+@app.post("/admin/models/reload", status_code=202, dependencies=[Depends(require_admin)])
+def reload_model(version: Optional[str] = None):
+    """
+    Load a model version in the background and swap it in once warmed up.
+    Without a version, the one in models/model_metadata.json is loaded.
+    In-flight requests finish on the model they started with.
+    """
+    from model_registry import ReloadInProgress
+
+    registry = get_model_registry()
+    logger.info(f"Model reload requested (version: {version or 'latest'})")
     try:
-        logger.info(f"Received upload request for file: {file.filename}")
-        
-        # Read the file for hashing
-        file_content = await file.read()
-        
-        # Compute a hash for this video to use in caching
-        video_hash = hashlib.sha256(file_content).hexdigest()
+        return registry.reload(version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ReloadInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/cache/invalidate", dependencies=[Depends(require_admin)])
+def invalidate_cache(video_hash: Optional[str] = None, scope: Optional[str] = None, stale: bool = False):
+    """
+    Remove cached results of a video and/or a scope. With stale=true, the
+    results of every scope but the current one are removed.
+    """
+    try:
+        removed = result_cache.invalidate(
+            video_hash=video_hash, scope=scope, keep_scope=video_analyzer.cache_scope() if stale else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"removed": removed}
+
+@app.get("/admin/traces", dependencies=[Depends(require_admin)])
+def list_traces():
+    """
+    List the kept request traces, newest first
+    """
+    return {"traces": trace_store.list()}
+
+@app.get("/admin/traces/{trace_id}", dependencies=[Depends(require_admin)])
+def get_trace(trace_id: str, format: str = "chrome"):
+    """
+    Get a request trace as a Chrome trace (format=chrome, for
+    chrome://tracing or ui.perfetto.dev) or a speedscope profile
+    (format=speedscope). Parts still being recorded (e.g. of a job that is
+    running) are added once they finish.
+    """
+    if format not in ("chrome", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be chrome or speedscope")
+    info = trace_store.info(trace_id)
+    events = trace_store.events(trace_id) if info is not None else None
+    if events is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    document = chrome_trace(info, events) if format == "chrome" else speedscope_profile(info, events)
+    return JSONResponse(document, headers={
+        "Content-Disposition": f'attachment; filename="trace-{trace_id}.{format}.json"'
+    })
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+def get_memory_report(requests: int = 20):
+    """
+    Memory of this process, growth per process over the last analyses, and
+    the peak and retained memory of each recent analysis (with tracemalloc,
+    also where the allocations grew since the baseline)
+    """
+    return memory_tracker.report(requests)
+
+@app.post("/admin/memory/baseline", dependencies=[Depends(require_admin)])
+def reset_memory_baseline():
+    """
+    Compare later tracemalloc reports to this process's allocations now
+    """
+    if not MEMORY_TRACEMALLOC_FRAMES:
+        raise HTTPException(status_code=409, detail="tracemalloc is off (MEMORY_TRACEMALLOC_FRAMES not set)")
+    memory_tracker.reset_baseline()
+    return {"baseline": datetime.now().isoformat()}
+
+@app.get("/jobs/stats")
+def get_job_stats():
+    """
+    Number of jobs per status and submission counters
+    """
+    stats = job_queue.stats()
+    stats["live_sessions"] = live_sessions
+    if admission is not None:
+        stats["admission"] = admission.stats()
+    if analysis_pool is not None:
+        stats["analysis_pool"] = analysis_pool.stats()
+    return stats
+
+@app.get("/workers")
+def get_workers():
+    """
+    Memory of the worker processes when served by serve.py: shared and
+    private memory per worker, growth since each started, and totals
+    """
+    try:
+        with open(WORKERS_REPORT_PATH) as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not served by serve.py, or no report yet")
+    report["answered_by"] = os.getpid()
+    return report
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Request counts and stage timings of every process serving the API (in
+    the Prometheus text format), plus queue depths and cache size
+    """
+    load = job_queue.load()
+    gauges = [("jobs_queued", "Jobs waiting to run, by priority", {"priority": priority}, count)
+              for priority, count in load["queued"].items()]
+    gauges.append(("jobs_running", "Jobs running", {}, load["running"]))
+    cache = result_cache.stats()
+    gauges.append(("result_cache_entries", "Results in the cache", {}, cache["entries"]))
+    gauges.append(("result_cache_bytes", "Size of the cached results", {}, cache["bytes"]))
+    rss = rss_bytes()
+    if rss is not None:
+        gauges.append(("process_rss_bytes", "Resident memory of the process answering", {}, rss))
+    for pid, growth in memory_tracker.growth().items():
+        gauges.append(("memory_after_request_bytes", "Resident memory of a process after its last analysis",
+                       {"pid": pid}, growth["rss_after_last"]))
+        gauges.append(("memory_growth_per_request_bytes", "Memory growth per analysis over the last ones",
+                       {"pid": pid}, growth["growth_per_request"]))
+        gauges.append(("memory_growing", "1 if a process's memory rose over most of its last analyses",
+                       {"pid": pid}, int(growth["growing"])))
+    snapshots = Metrics.shared_snapshots(METRICS_DIR) if METRICS_DIR else ()
+    return Response(metrics.render(snapshots, gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/results/{job_id}")
+async def get_results(job_id: str, wait: float = 0):
+    """
+    Get the status of an analysis job, and its result once done.
+    With wait, long-polls up to that many seconds for the job to finish.
+    """
+    job = await job_queue.wait(job_id, min(max(wait, 0), MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job_response(job)
+
+@app.delete("/results/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel an analysis job. A queued job is cancelled right away (200); a
+    running one stops at its next cancellation check (202, poll for the
+    outcome). Finished jobs are returned unchanged.
+    """
+    job = await run_in_threadpool(job_queue.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job_response(job)
+
+def sse_message(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """
+    Format a Server-Sent Events message
+    """
+    message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    return f"id: {event_id}\n{message}" if event_id is not None else message
+
+@app.get("/results/{job_id}/events")
+async def stream_job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Stream the progress of an analysis job as Server-Sent Events: "status"
+    with the job on connect, "progress" as it advances, "partial" with a
+    provisional result every few seconds while the video is analyzed, then
+    "done", "failed" or "cancelled" with the finished job, after which the stream ends.
+    Events published before connecting are replayed; a reconnecting client
+    resumes after its Last-Event-ID. Provisional results are only computed
+    while a stream is connected.
+    """
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    try:
+        after = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        after = 0
+
+    async def event_stream():
+        subscription = await run_in_threadpool(job_events.subscribe, job_id)
+        try:
+            async for message in job_event_messages(subscription):
+                yield message
+        finally:
+            await run_in_threadpool(job_events.unsubscribe, subscription)
+
+    async def job_event_messages(subscription: int):
+        nonlocal after
+        yield sse_message("status", public_job(job))
+        # Jobs created finished (cached results) publish no events
+        finished = job["status"] not in ACTIVE_STATUSES
+        last_sent = renewed = time.monotonic()
+        while True:
+            if time.monotonic() - renewed >= SUBSCRIPTION_TTL / 2:
+                await run_in_threadpool(job_events.renew, subscription)
+                renewed = time.monotonic()
+            # The events live in SQLite as the job may run in another process, so they are polled
+            events = await run_in_threadpool(job_events.read, job_id, after)
+            for event_id, event, data in events:
+                after = event_id
+                if event == FINISHED:
+                    finished = True
+                else:
+                    yield sse_message(event, data, event_id)
+            if events:
+                last_sent = time.monotonic()
+                continue
+            if finished:
+                current = await run_in_threadpool(job_queue.get, job_id)
+                if current is not None:
+                    yield sse_message(current["status"], public_job(current), after or None)
+                return
+            if time.monotonic() - last_sent >= EVENT_KEEPALIVE_SECONDS:
+                # Keeps proxies from closing an idle stream, and notices jobs that have gone away
+                current = await run_in_threadpool(job_queue.get, job_id)
+                if current is None:
+                    return
+                finished = current["status"] not in ACTIVE_STATUSES
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/upload", openapi_extra=UPLOAD_REQUEST_BODY)
+async def upload_video(request: Request, wait: float = 0, priority: str = INTERACTIVE):
+    """
+    Upload a video for analysis. Returns a job right away (202), to be polled
+    at /results/{job_id}; known videos get a finished job (200). A JSON body
+    {"path": ...} names a file under INGEST_ROOTS instead, which is analyzed
+    in place without being copied. With wait,
+    waits up to that many seconds for the result. priority is "interactive"
+    or "batch"; batch jobs run once no interactive job is waiting. When the
+    queue is full the upload is rejected (503, or 429 for batch uploads over
+    their share) before it is read, with a Retry-After header.
+    """
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+    reserved = False
+    if admission is not None:
+        try:
+            await run_in_threadpool(admission.reserve, priority)
+            reserved = True
+        except Overloaded as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail,
+                                headers={"Retry-After": str(e.retry_after)})
+    
+    upload = None
+    try:
+        if is_json_request(request):
+            upload = (await ingest_request_paths(request))[0]
+        else:
+            # Stream the file to disk, hashing it on the way
+            with metrics.span("upload_receive"):
+                upload = await ingest_upload(request, UPLOADS_DIR, MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE)
+        logger.info(f"Received upload request for file: {upload.filename}")
         
-        # Check if we already have a result for this exact video
-        cached_result = result_cache.get_result(video_hash)
-        if cached_result:
-            logger.info(f"Returning cached result for {file.filename}")
-            return cached_result
+        # The hash of this video and the current model/pipeline scope are used in caching
+        scope = video_analyzer.cache_scope()
         
-        # Reset the file position for saving
-        await file.seek(0)
+        # Database work runs in the threadpool so the event loop stays free
+        job, taken = await run_in_threadpool(submit_upload, upload, scope, priority)
+        if taken:
+            upload = None
+        # The job now counts towards the queue itself
+        if reserved:
+            admission.release(priority)
+            reserved = False
         
-        # Save the file temporarily 
-        temp_path = os.path.join(UPLOADS_DIR, f"{uuid.uuid4()}{os.path.splitext(file.filename)[1]}")
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        logger.info(f"File saved temporarily to {temp_path}")
+        if wait > 0:
+            job = await job_queue.wait(job["id"], min(wait, MAX_WAIT_SECONDS))
+        return job_response(job)
         
-        # Get the result using the micro-expression analyzer
-        prediction_result = micro_expression_analyzer.analyze_video(temp_path)
+    except UploadTooLarge as e:
+        logger.warning(f"Rejected upload: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PathNotAllowed as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error processing upload: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reserved:
+            admission.release(priority)
+        # Clean up the temporary file unless a job took it over
+        if upload is not None:
+            await run_in_threadpool(release_upload, upload.path, upload.sha256)
+
+@app.post("/batch", openapi_extra=BATCH_REQUEST_BODY)
+async def upload_batch(request: Request, wait: float = 0, priority: str = BATCH):
+    """
+    Upload several videos at once (the "files" field, repeated per video,
+    at most MAX_BATCH_FILES), or a JSON body {"paths": [...]} naming files
+    under INGEST_ROOTS. Every video gets a job as from /upload, and
+    the jobs are returned in upload order: 200 once all have finished, 202
+    while any is queued or running. Batch uploads run at batch priority
+    unless priority says otherwise. With wait, waits up to that many seconds
+    for all of them. The upload is admitted only if the queue has room for
+    all of its videos.
+    """
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+    max_files = MAX_BATCH_FILES
+    reserved = 0
+    uploads = []
+    try:
+        if admission is not None:
+            # More videos than the queue can ever hold would be rejected on every retry
+            max_files = min(max_files, admission.max_queued_batch if priority == BATCH else admission.max_queued)
+            # The count is only known once the body is read; turn the upload away early if the queue is full
+            await run_in_threadpool(admission.reserve, priority)
+            reserved = 1
         
-        # Store the result in cache
-        result_cache.store_result(video_hash, prediction_result)
+        if is_json_request(request):
+            uploads = await ingest_request_paths(request, max_files)
+        else:
+            with metrics.span("upload_receive"):
+                uploads = await ingest_uploads(request, UPLOADS_DIR, MAX_UPLOAD_BYTES, max_files,
+                                               chunk_size=UPLOAD_CHUNK_SIZE)
+        logger.info(f"Received batch upload of {len(uploads)} files")
+        if admission is not None and len(uploads) > reserved:
+            await run_in_threadpool(admission.reserve, priority, len(uploads) - reserved)
+            reserved = len(uploads)
         
-        # Clean up the temporary file
-        try:
-            os.remove(temp_path)
-            logger.info(f"Temporary file removed: {temp_path}")
-        except Exception as e:
-            logger.warning(f"Could not remove temporary file: {str(e)}")
+        scope = video_analyzer.cache_scope()
+        jobs = []
+        for i, upload in enumerate(uploads):
+            job, taken = await run_in_threadpool(submit_upload, upload, scope, priority)
+            if taken:
+                uploads[i] = None
+            jobs.append(job)
+        # The jobs now count towards the queue themselves
+        if reserved:
+            admission.release(priority, reserved)
+            reserved = 0
         
-        return prediction_result
+        if wait > 0:
+            deadline = time.monotonic() + min(wait, MAX_WAIT_SECONDS)
+            jobs = [await job_queue.wait(job["id"], max(0.0, deadline - time.monotonic())) for job in jobs]
+        finished = all(job["status"] not in ACTIVE_STATUSES for job in jobs)
+        return JSONResponse({"jobs": [public_job(job) for job in jobs]}, status_code=200 if finished else 202)
         
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+    except UploadTooLarge as e:
+        logger.warning(f"Rejected batch upload: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PathNotAllowed as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        logger.error(f"Error processing upload: {str(e)}")
+        logger.error(f"Error processing batch upload: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if reserved:
+            admission.release(priority, reserved)
+        # Clean up the files no job took over
+        for upload in uploads:
+            if upload is not None:
+                await run_in_threadpool(release_upload, upload.path, upload.sha256)
+
+@app.websocket("/stream")
+async def stream_analysis(websocket: WebSocket, sample_rate: int = DEFAULT_SAMPLE_RATE):
+    """
+    Live analysis of a stream of JPEG frames (and optional PCM audio), with a
+    rolling prediction pushed back after every frame (see live_stream.py)
+    """
+    global live_sessions
+    await websocket.accept()
+    if not isinstance(video_analyzer, FullPipelineAnalyzer):
+        await websocket.send_json({"type": "error", "detail": "Live analysis is only available with ANALYZER_BACKEND=full"})
+        await websocket.close(code=1008)
+        return
+    if live_sessions >= MAX_LIVE_SESSIONS:
+        # 1013: try again later
+        await websocket.send_json({"type": "error", "detail": f"Too many live streams ({live_sessions} active)"})
+        await websocket.close(code=1013)
+        return
+    
+    live_sessions += 1
+    try:
+        session = LiveAnalysisSession(video_analyzer.video_processor, video_analyzer.predictor,
+                                      window_size=LIVE_WINDOW_FRAMES, sample_rate=sample_rate)
+        logger.info(f"Live stream started ({live_sessions} active)")
+        await serve_live_stream(websocket, session)
+    except Exception as e:
+        logger.error(f"Error in live stream: {str(e)}")
+        logger.error(traceback.format_exc())
+        try:
+            await websocket.close(code=1011)
+        except RuntimeError:
+            pass
+    finally:
+        live_sessions -= 1
 
 if __name__ == "__main__":
     import uvicorn
-    logger.info(f"Starting uvicorn server with micro-expression dataset (loaded: {micro_expression_analyzer.dataset_loaded})")
+    logger.info(f"Starting uvicorn server with {ANALYZER_BACKEND} analyzer (micro-expression dataset loaded: {video_analyzer.dataset_loaded})")
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
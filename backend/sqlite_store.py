@@ -0,0 +1,57 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """
+    Base of the SQLite-backed stores (result cache, job queue, job events,
+    file hashes). Every thread gets its own connection, and a forked child
+    opens new ones instead of using its parent's, so connections are never
+    shared across threads or forks.
+    """
+    def __init__(self, db_path: str, uri: bool = False):
+        """
+        Initialize the store
+
+        Args:
+            db_path: Path of the SQLite database (or a URI if uri is set)
+            uri: Whether db_path is a URI (e.g. a shared-cache in-memory database)
+        """
+        self.db_path = db_path
+        self._uri = uri
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's database connection, opening it if needed"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, uri=self._uri)
+            self._configure(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _configure(self, conn: sqlite3.Connection):
+        """Set up a new connection (WAL, so readers don't block the writer)"""
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    def close(self):
+        """
+        Close this thread's database connection (e.g. before forking; it is reopened when needed)
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def dumps(data: Any) -> str:
+    """Serialize data to JSON; numpy scalars (e.g. from the analyzers) become plain numbers"""
+    return json.dumps(data, default=lambda o: o.item() if hasattr(o, "item") else str(o))
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import logging
+import threading
+from typing import Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Most samples kept per profiled block (about 15 minutes at 5 ms intervals)
+MAX_SAMPLES = 200000
+# Files of the profiling machinery, whose frames are left out of the samples
+PLUMBING_FILES = ("profiling.py", "stack_sampler.py", "contextlib.py")
+
+
+class StackSampler:
+    """
+    Samples the call stack of one thread from a background thread, for the
+    frames below the block being profiled. Consecutive samples sharing a
+    frame are merged into one span, giving a flame chart.
+    """
+    def __init__(self, thread_ident: int, entry_frame, interval: float):
+        """
+        Initialize the sampler (call start and stop around the profiled block)
+
+        Args:
+            thread_ident: threading ident of the thread to sample
+            entry_frame: Frame that enters the profiled block
+            interval: Seconds between samples
+        """
+        self.thread_ident = thread_ident
+        self.interval = interval
+        # Frames up to the caller of the profiled block are left out of the samples
+        self.base_depth = len(_caller_stack(entry_frame))
+        self.samples = []
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+        self._started = None
+        self._stopped = None
+
+    def start(self):
+        self._started = time.time()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._stopped = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval) and len(self.samples) < MAX_SAMPLES:
+            frame = sys._current_frames().get(self.thread_ident)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((time.time(), tuple(self._name(code) for code in stack[self.base_depth:]
+                                                    if not _is_plumbing(code.co_filename))))
+
+    def _name(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return name
+
+    def spans(self) -> List[Tuple[str, float, float]]:
+        """Get (frame name, start, seconds) of every run of samples sharing a frame"""
+        spans = []
+        open_frames = []
+        for timestamp, stack in self.samples + [(None, ())]:
+            # Frames are taken to change halfway between two samples
+            boundary = self._stopped if timestamp is None else max(self._started, timestamp - self.interval / 2)
+            common = 0
+            while (common < len(open_frames) and common < len(stack)
+                   and open_frames[common][0] == stack[common]):
+                common += 1
+            for name, start in reversed(open_frames[common:]):
+                spans.append((name, start, boundary - start))
+            del open_frames[common:]
+            open_frames.extend((name, boundary) for name in stack[common:])
+        return spans
+
+
+def _caller_stack(frame) -> List[Any]:
+    """Frames from the outermost to the innermost one not in PLUMBING_FILES"""
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    while stack and _is_plumbing(stack[-1].f_code.co_filename):
+        stack.pop()
+    return stack
+
+
+def _is_plumbing(filename: str) -> bool:
+    return os.path.basename(filename) in PLUMBING_FILES
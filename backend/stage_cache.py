@@ -0,0 +1,165 @@
+import os
+import glob
+import json
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from result_cache import cache_scope
+
+logger = logging.getLogger(__name__)
+
+
+class StageCache:
+    """
+    Persistent cache of the extraction stage: the face crops, face boxes,
+    sample timestamps and audio features VideoProcessor.process_video
+    produces for a video.
+
+    Entries are compressed .npz files keyed by video content hash plus the
+    extraction config, so re-analysing a known video (e.g. under a new
+    model) skips decoding and face detection. The least recently used
+    entries are deleted once the cache exceeds its size budget.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Initialize the stage cache
+
+        Args:
+            cache_dir: Directory to store the entries in
+            max_bytes: Disk budget for the cache
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._bytes = sum(os.path.getsize(path) for path in self._files())
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        logger.info(f"Stage cache initialized ({cache_dir}, budget: {max_bytes / 1e6:.0f} MB)")
+
+    def _files(self):
+        return glob.glob(os.path.join(self.cache_dir, "*.npz"))
+
+    def _path(self, video_hash: str, config: Dict[str, Any]) -> str:
+        return os.path.join(self.cache_dir, f"{video_hash}-{cache_scope(config)}.npz")
+
+    def get(self, video_hash: str, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Get the extracted data of a video
+
+        Args:
+            video_hash: SHA-256 of the video file
+            config: Extraction config (VideoProcessor.config)
+
+        Returns:
+            Data in the format of VideoProcessor.process_video, or None if not cached
+        """
+        path = self._path(video_hash, config)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                face_crops = entry["face_crops"]
+                processed_data = {
+                    "face_frames": list(face_crops),
+                    "face_boxes": entry["face_boxes"],
+                    "face_timestamps": entry["face_timestamps"],
+                    "audio_features": entry["audio_features"],
+                    "metadata": json.loads(str(entry["metadata"]))
+                }
+            # Refresh the entry so it is evicted last
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read stage cache entry {path}: {str(e)}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        logger.info(f"Stage cache hit for video: {video_hash[:8]}... ({len(face_crops)} face frames)")
+        return processed_data
+
+    def put(self, video_hash: str, config: Dict[str, Any], processed_data: Dict[str, Any]):
+        """
+        Store the extracted data of a video
+
+        Args:
+            video_hash: SHA-256 of the video file
+            config: Extraction config (VideoProcessor.config)
+            processed_data: Output of VideoProcessor.process_video
+        """
+        path = self._path(video_hash, config)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # The face crops are stored as one uint8 (N, H, W, 3) tensor
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    face_crops=np.stack(processed_data["face_frames"]).astype(np.uint8, copy=False),
+                    face_boxes=np.asarray(processed_data.get("face_boxes", np.zeros((0, 4))), dtype=np.int32),
+                    face_timestamps=np.asarray(processed_data.get("face_timestamps", np.zeros(0)), dtype=np.float32),
+                    audio_features=np.asarray(processed_data["audio_features"], dtype=np.float32),
+                    metadata=np.array(json.dumps(processed_data.get("metadata", {}), default=float))
+                )
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not write stage cache entry: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self.stores += 1
+            self._bytes += size
+            over_budget = self._bytes > self.max_bytes
+        if over_budget:
+            self._prune()
+
+    def _prune(self):
+        """Delete the least recently used entries until within 90% of the budget"""
+        with self._lock:
+            entries = []
+            for path in self._files():
+                try:
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+                except OSError:
+                    pass
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    pass
+            self._bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache size and hit/miss/eviction counters (counters are per process)
+        """
+        lookups = self.hits + self.misses
+        return {
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
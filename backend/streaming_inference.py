@@ -0,0 +1,223 @@
+import logging
+from typing import Dict, Any, Optional, Iterable, Iterator, Tuple
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingSession:
+    """
+    Incremental CNN-LSTM inference over an unbounded sequence of face frames.
+
+    Frames are buffered into fixed-size chunks. Each chunk goes through the
+    CNN at most once and the LSTM hidden state is carried over to the next
+    chunk, so memory and cost per chunk stay constant however long the
+    recording is. After every chunk the classifier is run on the latest LSTM
+    output, which gives a running prediction over everything seen so far.
+    """
+    def __init__(self, predictor, audio_features, window_size: int = 30, loaded_model=None):
+        """
+        Initialize a streaming session
+
+        Args:
+            predictor: Predictor providing preprocessing and the model registry
+            audio_features: Audio features for the recording
+            window_size: Number of face frames per chunk (at most SEQUENCE_LENGTH)
+            loaded_model: Model snapshot to use; defaults to the active one
+        """
+        self.predictor = predictor
+        self.loaded_model = loaded_model or predictor.registry.current()
+        self.model = self.loaded_model.model
+        self.window_size = window_size
+        self.audio_tensor = predictor._prepare_audio(audio_features)
+
+        # LSTM (h, c) carried across chunks
+        self.state = None
+        self.pending = []
+        self.frames_processed = 0
+        self.windows_emitted = 0
+
+    def push(self, face_frame: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        Add a face frame to the stream
+
+        Returns:
+            The running prediction if this frame completed a window, else None
+        """
+        self.pending.append(face_frame)
+        if len(self.pending) >= self.window_size:
+            return self._process_pending()
+        return None
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """
+        Process any buffered frames that don't fill a whole window
+
+        Returns:
+            The running prediction, or None if nothing was buffered
+        """
+        if self.pending:
+            return self._process_pending()
+        return None
+
+    def _process_pending(self) -> Dict[str, Any]:
+        chunk = self.pending
+        self.pending = []
+
+        # CNN embeddings of the new frames only (served from the embedding cache when possible)
+        embeddings = self.predictor._encode_frames(chunk, self.loaded_model)  # (n, 128)
+
+        with torch.no_grad():
+            lstm_out, self.state = self.model.lstm(embeddings.unsqueeze(0), self.state)
+            outputs = self.model.classify(lstm_out[:, -1, :], self.audio_tensor)
+            probabilities = torch.softmax(outputs, dim=1)
+
+        fake_prob = probabilities[0][0].item()
+        truth_prob = probabilities[0][1].item()
+        is_truth = truth_prob > fake_prob
+
+        start_frame = self.frames_processed
+        self.frames_processed += len(chunk)
+        self.windows_emitted += 1
+
+        return {
+            "window": self.windows_emitted - 1,
+            "start_frame": start_frame,
+            "end_frame": self.frames_processed,
+            "prediction": "Truth" if is_truth else "Fake",
+            "confidence": (truth_prob if is_truth else fake_prob) * 100,
+            "truth_probability": truth_prob * 100,
+            "fake_probability": fake_prob * 100,
+            "model_version": self.loaded_model.version
+        }
+
+
+def stream_predictions(session: StreamingSession, face_frames: Iterable[np.ndarray]) -> Iterator[Dict[str, Any]]:
+    """
+    Feed face frames through a streaming session
+
+    Args:
+        session: Streaming session to use
+        face_frames: Iterable of BGR face crops (e.g. VideoProcessor.iter_face_frames)
+
+    Yields:
+        The running prediction after each window, including a final partial one
+    """
+    for face_frame in face_frames:
+        window_result = session.push(face_frame)
+        if window_result is not None:
+            yield window_result
+
+    window_result = session.flush()
+    if window_result is not None:
+        yield window_result
+
+    logger.info(f"Streaming inference processed {session.frames_processed} frames in {session.windows_emitted} windows")
+
+
+class RollingPrediction:
+    """
+    Running verdict over face crops as they are extracted: a micro-expression
+    vote over every face so far, combined with the latest output of a
+    StreamingSession the way Predictor.predict combines the two branches.
+
+    Used for live streams and for the provisional results published while a
+    long upload is analyzed.
+    """
+    def __init__(self, predictor, audio_features, window_size: int = 1, loaded_model=None,
+                 model_frames: Optional[int] = None, keep_frame_results: bool = False):
+        """
+        Initialize a rolling prediction
+
+        Args:
+            predictor: Predictor providing the model and micro-expression analyzer
+            audio_features: Audio features for the model
+            window_size: Face frames per model step
+            loaded_model: Model snapshot to use; defaults to the active one
+            model_frames: Only the first this many faces go through the model (None for all)
+            keep_frame_results: Keep every face's micro-expression result (see frame_results)
+        """
+        self.session = StreamingSession(predictor, audio_features, window_size, loaded_model)
+        self.micro_expr_analyzer = predictor.micro_expr_analyzer
+        if self.micro_expr_analyzer is not None and not self.micro_expr_analyzer.dataset_loaded:
+            self.micro_expr_analyzer = None
+        self.model_frames = model_frames
+
+        self.faces = 0
+        self.micro_counts = {"truth": 0, "lie": 0}
+        self._micro_confidence = {"truth": 0.0, "lie": 0.0}
+        # (label, confidence) of every face, in the format of analyze_video_frames
+        self.frame_results = [] if keep_frame_results else None
+        self.model_prediction = None
+
+    def push(self, face_frame: np.ndarray) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Add a face crop
+
+        Returns:
+            Tuple of (micro-expression result of the face or None, whether
+            the model produced a new output)
+        """
+        self.faces += 1
+
+        micro_expression = None
+        if self.micro_expr_analyzer is not None:
+            label, confidence = self.micro_expr_analyzer.analyze_frame(face_frame)
+            if label in self.micro_counts:
+                self.micro_counts[label] += 1
+                self._micro_confidence[label] += confidence
+            if self.frame_results is not None:
+                self.frame_results.append((label, confidence))
+            micro_expression = {"prediction": label, "confidence": confidence * 100}
+
+        window_result = None
+        if self.model_frames is None or self.faces <= self.model_frames:
+            window_result = self.session.push(face_frame)
+            if window_result is None and self.faces == self.model_frames:
+                window_result = self.session.flush()
+        if window_result is not None:
+            self.model_prediction = window_result
+        return micro_expression, window_result is not None
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """
+        Run the model on buffered faces that don't fill a window, and get the prediction
+        """
+        window_result = self.session.flush()
+        if window_result is not None:
+            self.model_prediction = window_result
+        return self.prediction()
+
+    def prediction(self) -> Optional[Dict[str, Any]]:
+        """
+        Combine the latest model output with the micro-expression vote so
+        far, weighted equally as in Predictor.predict (None before either exists)
+        """
+        micro_label = None
+        if sum(self.micro_counts.values()):
+            micro_label = max(self.micro_counts, key=lambda label: (self.micro_counts[label], self._micro_confidence[label]))
+            micro_confidence = self._micro_confidence[micro_label] / self.micro_counts[micro_label] * 100
+
+        model = self.model_prediction
+        if model is None and micro_label is None:
+            return None
+        if model is None:
+            prediction, confidence = ("Truth" if micro_label == "truth" else "Fake"), micro_confidence
+        elif micro_label is None:
+            prediction, confidence = model["prediction"], model["confidence"]
+        else:
+            combined = 0.5 * (model["prediction"] == "Truth") + 0.5 * (micro_label == "truth")
+            prediction = "Truth" if combined >= 0.5 else "Fake"
+            confidence = (model["confidence"] + micro_confidence) / 2
+
+        return {
+            "prediction": prediction,
+            "confidence": confidence,
+            "faces": self.faces,
+            "model_prediction": model["prediction"] if model else None,
+            "micro_expr_prediction": micro_label,
+            "model_version": self.session.loaded_model.version,
+            "is_dummy_model": self.session.loaded_model.is_dummy
+        }
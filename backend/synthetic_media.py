@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+
+
+def draw_face(frame: np.ndarray, center, scale: float = 1.0, eye_open: float = 1.0,
+              brow_raise: float = 0.0, mouth_open: float = 1.0):
+    """
+    Draw a face-like pattern the Haar cascade detects: a skin-coloured oval
+    with eyes, brows, a nose and a mouth
+
+    Args:
+        frame: BGR image to draw on
+        center: (x, y) of the face
+        scale: Size of the face relative to a 240 pixel high one
+        eye_open: Height of the eyes relative to a neutral face
+        brow_raise: Pixels (at scale 1) the brows are raised by
+        mouth_open: Height of the mouth relative to a neutral face
+    """
+    def px(value):
+        return max(1, int(round(value * scale)))
+
+    cx, cy = center
+    cv2.ellipse(frame, (cx, cy), (px(90), px(120)), 0, 0, 360, (170, 190, 220), -1)
+    for dx in (-35, 35):
+        cv2.ellipse(frame, (cx + px(dx), cy - px(30)), (px(18), px(9 * eye_open)), 0, 0, 360, (40, 40, 40), -1)
+        brow_y = cy - px(55 + brow_raise)
+        cv2.line(frame, (cx + px(dx) - px(22), brow_y), (cx + px(dx) + px(22), brow_y), (50, 50, 60), px(6))
+    cv2.line(frame, (cx, cy - px(20)), (cx - px(8), cy + px(25)), (120, 130, 160), px(5))
+    cv2.ellipse(frame, (cx, cy + px(60)), (px(35), px(10 * mouth_open)), 0, 0, 360, (60, 60, 120), -1)
+
+
+def make_video(path: str, seconds: float = 10.0, fps: int = 30, width: int = 640, height: int = 480):
+    """
+    Write a synthetic video of a face the Haar cascade detects, so the full
+    pipeline does its real work (decoding, face detection, inference)
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    # The face fills the same share of the frame at every resolution
+    scale = height / 480
+    for i in range(int(seconds * fps)):
+        frame = np.full((height, width, 3), 90, np.uint8)
+        center = (width // 2 + int(20 * scale * np.sin(i / 15)), height // 2)
+        draw_face(frame, center, scale)
+        writer.write(cv2.GaussianBlur(frame, (7, 7), 0))
+    writer.release()
@@ -0,0 +1,60 @@
+import pytest
+
+from admission import AdmissionController, Overloaded, MAX_RETRY_AFTER
+from job_queue import JobQueue, BATCH, INTERACTIVE
+
+
+def make_queue(tmp_path):
+    # Never started, so submitted jobs stay queued
+    return JobQueue(str(tmp_path / "jobs.db"), lambda job, progress: {}, workers=2)
+
+
+def test_full_queue_rejects_with_503(tmp_path):
+    queue = make_queue(tmp_path)
+    admission = AdmissionController(queue, max_queued=2)
+    queue.submit("a", "v1", None)
+    queue.submit("b", "v1", None)
+
+    with pytest.raises(Overloaded) as rejected:
+        admission.reserve(INTERACTIVE)
+    assert rejected.value.status_code == 503
+    # One job has to start first: no run time measured yet (10 s), two workers
+    assert rejected.value.retry_after == 5
+    assert admission.stats()["rejected"][INTERACTIVE] == 1
+
+
+def test_batch_share_rejects_with_429(tmp_path):
+    queue = make_queue(tmp_path)
+    admission = AdmissionController(queue, max_queued=4)
+    assert admission.max_queued_batch == 2
+    queue.submit("a", "v1", None, priority=BATCH)
+    queue.submit("b", "v1", None, priority=BATCH)
+
+    with pytest.raises(Overloaded) as rejected:
+        admission.reserve(BATCH)
+    assert rejected.value.status_code == 429
+    # Interactive uploads can still use the rest of the queue
+    admission.reserve(INTERACTIVE, count=2)
+
+
+def test_reservations_count_until_released(tmp_path):
+    queue = make_queue(tmp_path)
+    admission = AdmissionController(queue, max_queued=3)
+    # Uploads still streaming in hold their place
+    admission.reserve(INTERACTIVE, count=2)
+    assert admission.stats()["uploading"][INTERACTIVE] == 2
+    with pytest.raises(Overloaded):
+        admission.reserve(INTERACTIVE, count=2)
+
+    admission.release(INTERACTIVE, count=2)
+    admission.reserve(INTERACTIVE, count=3)
+    assert admission.stats()["admitted"][INTERACTIVE] == 5
+
+
+def test_retry_after_is_bounded(tmp_path):
+    queue = make_queue(tmp_path)
+    admission = AdmissionController(queue, max_queued=1)
+    queue.submit("a", "v1", None)
+    with pytest.raises(Overloaded) as rejected:
+        admission.reserve(INTERACTIVE, count=1000)
+    assert rejected.value.retry_after == MAX_RETRY_AFTER
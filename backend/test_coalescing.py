@@ -0,0 +1,35 @@
+import threading
+import time
+
+from coalescing import SingleFlight
+
+
+def test_concurrent_runs_compute_once(tmp_path):
+    flight = SingleFlight(str(tmp_path / "locks"))
+    cache = {}
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        cache["a"] = "result"
+        return cache["a"]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.run("a", compute, lambda: cache.get("a"))))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats()["coalesced_local"] == 3
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cached_result_is_not_computed_again(tmp_path):
+    flight = SingleFlight(str(tmp_path / "locks"))
+    assert flight.run("a", lambda: "computed", lambda: "cached") == "cached"
+    assert flight.stats()["computed"] == 0
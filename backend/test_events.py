@@ -0,0 +1,48 @@
+import pickle
+
+from events import EventChannel, PARTIAL, PROGRESS
+from job_queue import JobQueue, DONE
+from test_job_queue import wait_for
+
+
+def test_subscriptions(tmp_path):
+    events = EventChannel(str(tmp_path / "events.db"))
+    check = pickle.loads(pickle.dumps(events.subscriber_check("job")))
+    assert not events.has_subscribers("job")
+    assert not check()
+
+    subscription = events.subscribe("job")
+    assert events.has_subscribers("job")
+    assert not events.has_subscribers("other")
+    # The check reuses its answer for a while
+    assert not check()
+    assert pickle.loads(pickle.dumps(check))()
+
+    events.unsubscribe(subscription)
+    assert not events.has_subscribers("job")
+
+
+def test_progress_and_partials_are_throttled(tmp_path):
+    events = EventChannel(str(tmp_path / "events.db"))
+    seen = {}
+
+    def handler(job, progress):
+        seen["wants_partials"] = progress.wants_partials()
+        for step in range(100):
+            progress(step / 100, "extracting_faces", {"faces": step})
+        progress(0.9, "predicting")
+        return {}
+
+    queue = JobQueue(str(tmp_path / "jobs.db"), handler, workers=1, poll_interval=0.05, events=events)
+    job, _ = queue.submit("a", "v1", None)
+    queue.start()
+    try:
+        wait_for(queue, job["id"], (DONE,))
+    finally:
+        queue.stop()
+
+    published = [event for _, event, _ in events.read(job["id"])]
+    assert seen["wants_partials"] is False
+    # One write per stage and one partial, rather than one per step
+    assert published.count(PROGRESS) == 2
+    assert published.count(PARTIAL) == 1
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+
+from cancellation import check
+from job_queue import JobQueue, BATCH, CANCELLED, DONE, INTERACTIVE, RUNNING
+
+
+def wait_for(queue, job_id, statuses, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} is still {queue.get(job_id)['status']}")
+
+
+def test_interactive_jobs_run_before_batch_jobs(tmp_path):
+    order = []
+    queue = JobQueue(str(tmp_path / "jobs.db"), lambda job, progress: order.append(job["video_hash"]) or {},
+                     workers=1, poll_interval=0.05)
+    jobs = [queue.submit("batch-1", "v1", None, priority=BATCH)[0],
+            queue.submit("batch-2", "v1", None, priority=BATCH)[0],
+            queue.submit("interactive", "v1", None, priority=INTERACTIVE)[0]]
+    queue.start()
+    try:
+        for job in jobs:
+            wait_for(queue, job["id"], (DONE,))
+    finally:
+        queue.stop()
+    assert order == ["interactive", "batch-1", "batch-2"]
+
+
+def test_duplicate_submissions_share_a_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lambda job, progress: {})
+    first, created = queue.submit("a", "v1", None, priority=BATCH)
+    again, created_again = queue.submit("a", "v1", None, priority=INTERACTIVE)
+    other, created_other = queue.submit("a", "v2", None)
+    assert created and not created_again and created_other
+    assert again["id"] == first["id"]
+    # The interactive upload moved the job up
+    assert queue.get(first["id"])["priority"] == 0
+    assert other["id"] != first["id"]
+
+
+def test_cancel_queued_job(tmp_path):
+    ran = []
+    queue = JobQueue(str(tmp_path / "jobs.db"), lambda job, progress: ran.append(job["id"]) or {},
+                     workers=1, poll_interval=0.05)
+    job, _ = queue.submit("a", "v1", None)
+    assert queue.cancel(job["id"])["status"] == CANCELLED
+    assert queue.cancel("unknown") is None
+
+    queue.start()
+    try:
+        time.sleep(0.3)
+    finally:
+        queue.stop()
+    assert ran == []
+    assert queue.get(job["id"])["status"] == CANCELLED
+
+
+def test_cancelled_jobs_release_their_upload(tmp_path):
+    def release(job):
+        os.remove(job["video_path"])
+
+    db_path = str(tmp_path / "jobs.db")
+    uploads = []
+    for name in ("queued.mp4", "orphaned.mp4"):
+        uploads.append(tmp_path / name)
+        uploads[-1].write_bytes(b"video")
+
+    queue = JobQueue(db_path, lambda job, progress: {}, release=release)
+    job, _ = queue.submit("a", "v1", str(uploads[0]))
+    queue.cancel(job["id"])
+    assert not uploads[0].exists()
+
+    # A job cancelled while running in a process that then stopped
+    previous = JobQueue(db_path, lambda job, progress: {})
+    orphaned, _ = previous.submit("b", "v1", str(uploads[1]))
+    assert previous._claim()["id"] == orphaned["id"]
+    previous.cancel(orphaned["id"])
+    assert uploads[1].exists()
+    queue._recover()
+    assert queue.get(orphaned["id"])["status"] == CANCELLED
+    assert not uploads[1].exists()
+
+
+def test_cancel_running_job(tmp_path):
+    started = threading.Event()
+
+    def handler(job, progress):
+        started.set()
+        for i in range(500):
+            progress(i / 500, "analyzing")
+            check()
+            time.sleep(0.01)
+        return {}
+
+    queue = JobQueue(str(tmp_path / "jobs.db"), handler, workers=1, poll_interval=0.05)
+    job, _ = queue.submit("a", "v1", None)
+    queue.start()
+    try:
+        assert started.wait(5)
+        assert queue.cancel(job["id"])["status"] == RUNNING
+        finished = wait_for(queue, job["id"], (CANCELLED, DONE), timeout=3)
+    finally:
+        queue.stop()
+    assert finished["status"] == CANCELLED
+    assert finished["result"] is None
+
+
+def test_cancel_requested_by_another_process(tmp_path):
+    def handler(job, progress):
+        for i in range(500):
+            progress(i / 500, "analyzing")
+            check()
+            time.sleep(0.01)
+        return {}
+
+    queue = JobQueue(str(tmp_path / "jobs.db"), handler, workers=1, poll_interval=0.05)
+    other = JobQueue(str(tmp_path / "jobs.db"), handler, workers=0)
+    job, _ = queue.submit("a", "v1", None)
+    queue.start()
+    try:
+        wait_for(queue, job["id"], (RUNNING,))
+        other.cancel(job["id"])
+        finished = wait_for(queue, job["id"], (CANCELLED, DONE), timeout=3)
+    finally:
+        queue.stop()
+    assert finished["status"] == CANCELLED
+
+
+def test_jobs_of_a_stopped_process_run_again(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    previous = JobQueue(db_path, lambda job, progress: {})
+    running, _ = previous.submit("a", "v1", None)
+    queued, _ = previous.submit("b", "v1", None)
+    cancelled, _ = previous.submit("c", "v1", None)
+    # The previous run took jobs and then stopped without finishing them
+    assert previous._claim()["id"] == running["id"]
+    assert previous._claim()["id"] == queued["id"]
+    assert previous._claim()["id"] == cancelled["id"]
+    previous.cancel(cancelled["id"])
+
+    queue = JobQueue(db_path, lambda job, progress: {"prediction": job["video_hash"]}, workers=1, poll_interval=0.05)
+    queue.start()
+    try:
+        for job in (running, queued):
+            finished = wait_for(queue, job["id"], (DONE,))
+            assert finished["attempts"] == 2
+        assert queue.get(cancelled["id"])["status"] == CANCELLED
+    finally:
+        queue.stop()
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from metrics import Metrics, RETIRED_SNAPSHOT
+
+
+def write_snapshot(registry, directory, pid):
+    """Write a snapshot as the worker with this pid would"""
+    registry.write_snapshot(directory)
+    path = os.path.join(directory, f"{pid}.json")
+    os.replace(os.path.join(directory, f"{os.getpid()}.json"), path)
+    return path
+
+
+def counter_total(snapshots, name):
+    return sum(value for snapshot in snapshots for counter, _, value in snapshot["counters"] if counter == name)
+
+
+def test_retired_snapshots_are_added_up(tmp_path):
+    directory = str(tmp_path)
+    for pid, requests in ((101, 3), (102, 4), (103, 5)):
+        worker = Metrics()
+        worker.inc("http_requests_total", requests, method="GET", route="/health", status=200)
+        worker.observe("http_request_duration_seconds", 0.01, route="/health")
+        write_snapshot(worker, directory, pid)
+
+    Metrics.retire_snapshot(directory, 101)
+    Metrics.retire_snapshot(directory, 102)
+    Metrics.retire_snapshot(directory, 999)
+
+    assert sorted(os.listdir(directory)) == ["103.json", RETIRED_SNAPSHOT]
+    snapshots = Metrics.shared_snapshots(directory)
+    assert counter_total(snapshots, "http_requests_total") == 12
+    histograms = [values for snapshot in snapshots for _, _, values in snapshot["histograms"]]
+    assert sum(values[-1] for values in histograms) == pytest.approx(0.03)
+
+
+def test_snapshot_being_retired_is_not_counted_twice(tmp_path):
+    directory = str(tmp_path)
+    worker = Metrics()
+    worker.inc("jobs_finished_total", 2, status="done")
+    path = write_snapshot(worker, directory, 101)
+    with open(path) as f:
+        content = f.read()
+
+    Metrics.retire_snapshot(directory, 101)
+    # As if a reader listed the directory before the file was deleted
+    with open(path, "w") as f:
+        f.write(content)
+    assert counter_total(Metrics.shared_snapshots(directory), "jobs_finished_total") == 2
@@ -0,0 +1,68 @@
+import os
+import hashlib
+
+import pytest
+
+from path_ingest import FileHashIndex, PathNotAllowed, ingest_path, resolve_path
+
+
+@pytest.fixture
+def roots(tmp_path):
+    root = tmp_path / "videos"
+    root.mkdir()
+    (root / "a.mp4").write_bytes(b"video a")
+    outside = tmp_path / "private"
+    outside.mkdir()
+    (outside / "secret.mp4").write_bytes(b"secret")
+    return [str(root)]
+
+
+def test_paths_are_resolved_inside_the_roots(roots):
+    root = roots[0]
+    real_path = os.path.realpath(os.path.join(root, "a.mp4"))
+    assert resolve_path("a.mp4", roots) == real_path
+    assert resolve_path(os.path.join(root, "a.mp4"), roots) == real_path
+    assert resolve_path(f"file://{root}/a.mp4", roots) == real_path
+
+    with pytest.raises(FileNotFoundError):
+        resolve_path("missing.mp4", roots)
+    with pytest.raises(PathNotAllowed):
+        resolve_path("a.mp4", [])
+    with pytest.raises(PathNotAllowed):
+        resolve_path("http://example.com/a.mp4", roots)
+
+
+def test_paths_escaping_the_roots_are_rejected(roots):
+    root = roots[0]
+    with pytest.raises(PathNotAllowed):
+        resolve_path("../private/secret.mp4", roots)
+    with pytest.raises(PathNotAllowed):
+        resolve_path(os.path.join(root, "..", "private", "secret.mp4"), roots)
+    # A sibling directory sharing the root's name as a prefix is not inside it
+    os.mkdir(root + "-other")
+    with open(os.path.join(root + "-other", "b.mp4"), "wb") as f:
+        f.write(b"b")
+    with pytest.raises(PathNotAllowed):
+        resolve_path(os.path.join(root + "-other", "b.mp4"), roots)
+    # Symlinks are followed before the check
+    os.symlink(os.path.join(os.path.dirname(root), "private", "secret.mp4"), os.path.join(root, "link.mp4"))
+    with pytest.raises(PathNotAllowed):
+        resolve_path("link.mp4", roots)
+
+
+def test_changed_files_are_hashed_again(roots, tmp_path):
+    index = FileHashIndex(str(tmp_path / "file_hashes.db"))
+    path = os.path.join(roots[0], "a.mp4")
+
+    upload = ingest_path("a.mp4", roots, index)
+    assert upload.sha256 == hashlib.sha256(b"video a").hexdigest()
+    assert index.hash(path) == upload.sha256
+    assert (index.hits, index.misses) == (1, 1)
+    assert index.path_for(upload.sha256, roots) == os.path.realpath(path)
+
+    with open(path, "wb") as f:
+        f.write(b"video a, edited")
+    assert index.hash(path) == hashlib.sha256(b"video a, edited").hexdigest()
+    assert index.misses == 2
+    # The old hash no longer names a file
+    assert index.path_for(upload.sha256) is None
@@ -0,0 +1,27 @@
+from process_memory import MemoryTracker
+
+
+def test_overlapping_requests_are_marked():
+    tracker = MemoryTracker()
+    tracker.configure(enabled=True)
+    with tracker.request("first") as first:
+        with tracker.request("second") as second:
+            pass
+    with tracker.request("alone") as alone:
+        pass
+    assert first["overlapped"] and second["overlapped"]
+    assert "overlapped" not in alone
+    assert alone["peak_growth"] >= 0
+
+
+def test_exited_processes_are_forgotten():
+    tracker = MemoryTracker()
+    tracker.configure(enabled=True)
+    # Above the largest pid Linux hands out
+    dead_pid = 2 ** 22 + 1
+    tracker.merge([{"pid": dead_pid, "rss_after": 1}])
+    assert dead_pid in tracker.growth()
+
+    with tracker.request("job"):
+        pass
+    assert dead_pid not in tracker.growth()
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import time
+
+from result_cache import ResultCache
+from rescoring import Rescorer
+
+
+def test_evicts_least_recently_used():
+    cache = ResultCache(cache_dir=None, legacy_json=None, max_entries=2)
+    cache.store_result("a", {"prediction": "Truth"}, scope="v1")
+    time.sleep(0.01)
+    cache.store_result("b", {"prediction": "Deception"}, scope="v1")
+    time.sleep(0.01)
+    # The hit is only recorded in memory; storing "c" writes it before evicting
+    assert cache.get_result("a", scope="v1") is not None
+    cache.store_result("c", {"prediction": "Truth"}, scope="v1")
+
+    assert cache.get_result("b", scope="v1") is None
+    assert cache.get_result("a", scope="v1") is not None
+    assert cache.get_result("c", scope="v1") is not None
+    assert cache.evictions == 1
+
+
+def test_hits_are_flushed():
+    cache = ResultCache(cache_dir=None, legacy_json=None)
+    cache.store_result("a", {"prediction": "Truth"}, scope="v1")
+    cache.store_result("b", {"prediction": "Truth"}, scope="v1")
+    for _ in range(3):
+        cache.get_result("b", scope="v1")
+    assert cache.hottest("v1", 10) == ["b", "a"]
+
+
+def test_scopes_are_separate():
+    cache = ResultCache(cache_dir=None, legacy_json=None)
+    cache.store_result("a", {"prediction": "Truth"}, scope="v1")
+    cache.store_result("a", {"prediction": "Deception"}, scope="v2")
+
+    assert cache.get_result("a", scope="v1")["prediction"] == "Truth"
+    assert cache.get_result("a", scope="v2")["prediction"] == "Deception"
+    assert cache.get_result("a", scope="v3") is None
+
+    cache.invalidate(keep_scope="v2")
+    assert cache.get_result("a", scope="v1") is None
+    assert cache.get_result("a", scope="v2") is not None
+
+
+def test_expired_results_are_not_returned():
+    cache = ResultCache(cache_dir=None, legacy_json=None, ttl_seconds=0.01)
+    cache.store_result("a", {"prediction": "Truth"}, scope="v1")
+    time.sleep(0.05)
+    assert cache.get_result("a", scope="v1") is None
+
+
+def test_incremental_auto_vacuum(tmp_path):
+    cache = ResultCache(cache_dir=str(tmp_path / "new"), legacy_json=None)
+    assert cache._connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    # A database created by an older version is converted on startup
+    old_dir = tmp_path / "old"
+    old_dir.mkdir()
+    conn = sqlite3.connect(str(old_dir / "prediction_cache.db"))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE unrelated (x)")
+    conn.close()
+    cache = ResultCache(cache_dir=str(old_dir), legacy_json=None)
+    assert cache._connection().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_unscoped_results_move_to_current_scope(tmp_path):
+    # Database written before results were scoped
+    conn = sqlite3.connect(str(tmp_path / "prediction_cache.db"))
+    conn.execute("CREATE TABLE results (video_hash TEXT PRIMARY KEY, result TEXT NOT NULL, timestamp TEXT NOT NULL)")
+    conn.execute("INSERT INTO results VALUES ('a', '{\"prediction\": \"Truth\"}', '2024-01-01T00:00:00')")
+    conn.commit()
+    conn.close()
+    with open(tmp_path / "prediction_cache.json", "w") as f:
+        json.dump({"b": {"result": {"prediction": "Deception"}, "timestamp": "2024-01-01T00:00:00"}}, f)
+
+    cache = ResultCache(cache_dir=str(tmp_path), legacy_scope="v1")
+    assert cache.get_result("a", scope="v1")["prediction"] == "Truth"
+    assert cache.get_result("b", scope="v1")["prediction"] == "Deception"
+    assert not cache.has_result("a", scope="")
+
+
+def test_rescoring_runs_in_background():
+    cache = ResultCache(cache_dir=None, legacy_json=None)
+    cache.store_result("a", {"prediction": "Truth"}, scope="v1")
+    cache.store_result("b", {"prediction": "Truth"}, scope="v1")
+    cache.store_result("b", {"prediction": "Deception"}, scope="v2")
+
+    rescorer = Rescorer(cache, limit=10, time_budget=60)
+    rescorer.start("v1", "v2", lambda video_hash: {"prediction": "Deception"}).join()
+
+    assert cache.get_result("a", scope="v2")["prediction"] == "Deception"
+    assert rescorer.last_run["rescored"] == 1
+    assert rescorer.last_run["already_cached"] == 1
@@ -13,7 +13,7 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def test_video(video_path: str, model_path: str = None):
+def test_video(video_path: str, model_path: str = None, stream: bool = False):
     """
     Test the lie detection model on a single video
     """
@@ -48,6 +48,9 @@ def test_video(video_path: str, model_path: str = None):
             logger.error(f"Error loading model from {model_path}: {str(e)}")
             return
     
+    if stream:
+        return run_stream(video_path, video_processor, predictor)
+    
     # Process the video
     logger.info(f"Processing video: {video_path}")
     processed_data = video_processor.process_video(video_path)
@@ -70,11 +73,32 @@ def test_video(video_path: str, model_path: str = None):
     
     return prediction
 
+def run_stream(video_path: str, video_processor: VideoProcessor, predictor: Predictor):
+    """
+    Analyse the whole video with streaming inference, printing the running prediction per window
+    """
+    audio_features = video_processor._extract_audio_features(video_path)
+    face_frames = video_processor.iter_face_frames(video_path)
+    
+    prediction = None
+    logger.info("=" * 50)
+    logger.info("Streaming Prediction Results:")
+    for prediction in predictor.predict_stream(face_frames, audio_features):
+        logger.info(f"Frames {prediction['start_frame']}-{prediction['end_frame']}: "
+                    f"{prediction['prediction']} ({prediction['confidence']:.2f}%)")
+    logger.info("=" * 50)
+    
+    if prediction is None:
+        logger.error("Failed to process video. No faces detected.")
+    
+    return prediction
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test lie detection model on a video")
     parser.add_argument("video", type=str, help="Path to video file")
     parser.add_argument("--model", type=str, help="Path to a specific model file (optional)")
+    parser.add_argument("--stream", action="store_true", help="Analyse the whole video with streaming inference")
     
     args = parser.parse_args()
     
-    test_video(args.video, args.model)
+    test_video(args.video, args.model, args.stream)
@@ -0,0 +1,240 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+from typing import List, Optional
+
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Allowance for multipart boundaries and part headers when checking Content-Length
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured maximum size"""
+
+
+class InvalidUpload(Exception):
+    """Raised when the request is not a multipart upload with the expected file field"""
+
+
+class IngestedUpload:
+    """
+    A file streamed to disk by ingest_upload
+    """
+    def __init__(self, path: str, filename: str, sha256: str, size: int):
+        self.path = path
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+
+
+class _FilePartWriter:
+    """
+    Multipart parser callbacks that write file fields to disk, hashing them on the way
+    """
+    def __init__(self, dest_dir: str, field_name: str, max_bytes: int, chunk_size: int, max_files: int = 1):
+        self.dest_dir = dest_dir
+        self.field_name = field_name
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.max_files = max_files
+
+        # Files written completely, in the order they arrived
+        self.uploads = []
+        self.too_large = False
+        self.too_many = False
+
+        self._file = None
+        self._path = None
+        self._filename = None
+        self._size = 0
+        self._hasher = None
+        self._hash_seconds = 0.0
+        self._paths = []
+        self._in_target_part = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._in_target_part = False
+
+    def on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        # Other fields are ignored
+        if name != self.field_name or filename is None:
+            return
+        if len(self._paths) >= self.max_files:
+            # A single file upload keeps the first matching file; a multi-file one is rejected
+            self.too_many = self.max_files > 1
+            return
+
+        self._filename = filename.decode("utf-8", "replace")
+        extension = os.path.splitext(self._filename)[1]
+        self._path = os.path.join(self.dest_dir, f"{uuid.uuid4()}{extension}")
+        self._paths.append(self._path)
+        self._size = 0
+        self._hasher = hashlib.sha256()
+        self._hash_seconds = 0.0
+        # Buffered so the disk sees fixed-size writes whatever the network chunking
+        self._file = open(self._path, "wb", buffering=self.chunk_size)
+        self._in_target_part = True
+
+    def on_part_data(self, data, start, end):
+        if not self._in_target_part or self.too_large:
+            return
+
+        self._size += end - start
+        if self._size > self.max_bytes:
+            self.too_large = True
+            return
+
+        chunk = data[start:end]
+        started = time.perf_counter()
+        self._hasher.update(chunk)
+        self._hash_seconds += time.perf_counter() - started
+        self._file.write(chunk)
+
+    def on_part_end(self):
+        if self._in_target_part:
+            self._file.close()
+            self._in_target_part = False
+            # Hashing overlaps with receiving the upload; this is the time spent in it
+            metrics.record("hashing", self._hash_seconds)
+            self.uploads.append(IngestedUpload(self._path, self._filename, self._hasher.hexdigest(), self._size))
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        self.close()
+        for path in self._paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+async def ingest_upload(request, dest_dir: str, max_bytes: int, field_name: str = "file",
+                        chunk_size: int = 1024 * 1024) -> IngestedUpload:
+    """
+    Stream a multipart upload straight from the request body to disk
+
+    The SHA-256 of the file is computed while its chunks arrive, so the
+    file is never held in memory or read a second time, and memory per
+    request stays constant regardless of the upload size.
+
+    Args:
+        request: Starlette request with a multipart/form-data body
+        dest_dir: Directory to write the file to
+        max_bytes: Maximum accepted file size
+        field_name: Name of the form field holding the file
+        chunk_size: Size of the writes to disk
+
+    Returns:
+        The ingested upload
+
+    Raises:
+        UploadTooLarge: If the body or file is larger than allowed (checked
+            against Content-Length before anything is read)
+        InvalidUpload: If the body isn't multipart or has no file in field_name
+    """
+    writer = _FilePartWriter(dest_dir, field_name, max_bytes, chunk_size)
+    await _ingest(request, writer, max_bytes)
+    upload = writer.uploads[0]
+    logger.info(f"Received {upload.filename} ({upload.size} bytes) -> {upload.path}")
+    return upload
+
+
+async def ingest_uploads(request, dest_dir: str, max_bytes: int, max_files: int, field_name: str = "files",
+                         chunk_size: int = 1024 * 1024) -> List[IngestedUpload]:
+    """
+    Stream a multipart upload of several files straight to disk (see ingest_upload)
+
+    Args:
+        request: Starlette request with a multipart/form-data body
+        dest_dir: Directory to write the files to
+        max_bytes: Maximum accepted size of each file
+        max_files: Maximum number of files
+        field_name: Name of the form field holding the files (repeated once per file)
+        chunk_size: Size of the writes to disk
+
+    Returns:
+        The ingested uploads, in the order of the request
+
+    Raises:
+        UploadTooLarge: If the body or a file is larger than allowed
+        InvalidUpload: If the body isn't multipart, has no file in field_name
+            or more than max_files of them
+    """
+    writer = _FilePartWriter(dest_dir, field_name, max_bytes, chunk_size, max_files)
+    await _ingest(request, writer, max_bytes * max_files)
+    logger.info(f"Received {len(writer.uploads)} files "
+                f"({sum(upload.size for upload in writer.uploads)} bytes) -> {dest_dir}")
+    return writer.uploads
+
+
+async def _ingest(request, writer: _FilePartWriter, max_body_bytes: int):
+    """Feed the request body to a writer, removing what it wrote if the upload fails"""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise InvalidUpload("Expected a multipart/form-data request")
+
+    content_length = _content_length(request)
+    if content_length is not None and content_length > max_body_bytes + MULTIPART_OVERHEAD_BYTES * writer.max_files:
+        raise UploadTooLarge(f"Upload of {content_length} bytes exceeds the limit of {max_body_bytes} bytes")
+
+    parser = MultipartParser(boundary, writer.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if writer.too_large:
+                raise UploadTooLarge(f"Upload exceeds the limit of {writer.max_bytes} bytes")
+            if writer.too_many:
+                raise InvalidUpload(f"Upload has more than {writer.max_files} files")
+        parser.finalize()
+        writer.close()
+        if not writer.uploads:
+            raise InvalidUpload(f"No file found in form field '{writer.field_name}'")
+    except BaseException:
+        writer.discard()
+        raise
+
+
+def _content_length(request) -> Optional[int]:
+    try:
+        return int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
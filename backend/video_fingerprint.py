@@ -0,0 +1,200 @@
+import logging
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sampled frames, and the most samples taken from one video
+FINGERPRINT_INTERVAL = 1.0
+FINGERPRINT_MAX_SAMPLES = 600
+# Fingerprints shorter than this are too ambiguous to match
+MIN_FINGERPRINT_SAMPLES = 5
+# Fraction of the shorter fingerprint that has to overlap in the best alignment
+MIN_OVERLAP_RATIO = 0.8
+# Each 64-bit frame hash is split into this many bands for the candidate index
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+# Number of set bits in every byte value
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(frame: np.ndarray) -> int:
+    """
+    Compute the 64-bit difference hash of a frame
+
+    The frame is shrunk to 9x8 grayscale and every bit records whether a pixel
+    is brighter than its right neighbour, which survives re-encoding, scaling
+    and small colour shifts.
+
+    Args:
+        frame: BGR frame
+
+    Returns:
+        The hash as an unsigned 64-bit integer
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, :-1] > small[:, 1:]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class NearDuplicate(Exception):
+    """
+    Raised by an analyzer's on_fingerprint callback to stop the analysis of a
+    video that is a near-duplicate of one with a cached result
+    """
+    def __init__(self, video_hash: str, distance: float):
+        super().__init__(video_hash, distance)
+        self.video_hash = video_hash
+        self.distance = distance
+
+
+class FingerprintBuilder:
+    """
+    Build the fingerprint of a video from frames decoded for something else
+    (e.g. the analysis), sampling the same timestamps as compute_fingerprint
+    """
+    def __init__(self, interval: float = FINGERPRINT_INTERVAL, max_samples: int = FINGERPRINT_MAX_SAMPLES):
+        """
+        Args:
+            interval: Seconds between sampled frames
+            max_samples: Maximum number of frames to sample
+        """
+        self.interval = interval
+        self.max_samples = max_samples
+        self._hashes = []
+        self._next_timestamp = 0.0
+
+    @property
+    def full(self) -> bool:
+        """Whether max_samples frames have been sampled"""
+        return len(self._hashes) >= self.max_samples
+
+    def wants(self, timestamp: float) -> bool:
+        """Whether the frame at timestamp is sampled"""
+        return not self.full and timestamp >= self._next_timestamp
+
+    def add(self, timestamp: float, frame: np.ndarray):
+        """
+        Pass on a decoded frame (frames must come in order; unsampled ones are ignored)
+
+        Args:
+            timestamp: Seconds from the start of the video
+            frame: BGR frame
+        """
+        if self.wants(timestamp):
+            self._hashes.append(dhash(frame))
+            self._next_timestamp += self.interval
+
+    def fingerprint(self) -> Optional[np.ndarray]:
+        """
+        Returns:
+            uint64 array of frame hashes, or None if no frame was sampled
+        """
+        if not self._hashes:
+            return None
+        return np.array(self._hashes, dtype=np.uint64)
+
+
+def compute_fingerprint(video_path: str, interval: float = FINGERPRINT_INTERVAL,
+                        max_samples: int = FINGERPRINT_MAX_SAMPLES) -> Optional[np.ndarray]:
+    """
+    Compute the perceptual fingerprint of a video: the dHash of the frames
+    at fixed timestamps (0, interval, 2 * interval, ...)
+
+    Args:
+        video_path: Path to the video file
+        interval: Seconds between sampled frames
+        max_samples: Maximum number of frames to sample
+
+    Returns:
+        uint64 array of frame hashes, or None if the video can't be read
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logger.warning(f"Could not open video for fingerprinting: {video_path}")
+        return None
+
+    builder = FingerprintBuilder(interval, max_samples)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0:
+            fps = 30.0
+
+        frame_index = 0
+        while not builder.full:
+            # grab() skips decoding the frames between samples where the backend allows it
+            if not cap.grab():
+                break
+            if builder.wants(frame_index / fps):
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                builder.add(frame_index / fps, frame)
+            frame_index += 1
+    finally:
+        cap.release()
+
+    return builder.fingerprint()
+
+
+def band_keys(fingerprint: np.ndarray) -> List[int]:
+    """
+    Get the band keys of a fingerprint for the candidate index
+
+    Two frame hashes within a few bits of each other very likely agree
+    exactly on at least one band, so videos sharing band keys are the only
+    candidates worth aligning. Near-uniform frames (black or white) match
+    everything and are left out.
+
+    Args:
+        fingerprint: uint64 array of frame hashes
+
+    Returns:
+        Sorted distinct band keys (band number in the high bits, band value in the low bits)
+    """
+    keys = set()
+    for frame_hash in fingerprint.tolist():
+        if not 4 <= bin(frame_hash).count("1") <= 60:
+            continue
+        for band in range(BANDS):
+            value = (frame_hash >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)
+            keys.add((band << BAND_BITS) | value)
+    return sorted(keys)
+
+
+def fingerprint_distance(a: np.ndarray, b: np.ndarray,
+                         min_overlap_ratio: float = MIN_OVERLAP_RATIO) -> Optional[Tuple[float, int]]:
+    """
+    Compare two fingerprints at their best alignment
+
+    Every offset of one fingerprint against the other is tried (to match
+    trimmed copies), and the mean Hamming distance between the overlapping
+    frame hashes is taken.
+
+    Args:
+        a: uint64 array of frame hashes
+        b: uint64 array of frame hashes
+        min_overlap_ratio: Fraction of the shorter fingerprint that must overlap
+
+    Returns:
+        Tuple of (mean Hamming distance in bits, offset of b relative to a),
+        or None if the fingerprints are too short to compare
+    """
+    min_overlap = max(MIN_FINGERPRINT_SAMPLES, int(np.ceil(min(len(a), len(b)) * min_overlap_ratio)))
+    if min(len(a), len(b)) < min_overlap:
+        return None
+
+    # Pairwise Hamming distances between all frame hashes: (len(a), len(b))
+    xor = np.bitwise_xor(a[:, None], b[None, :])
+    distances = _POPCOUNT8[xor.view(np.uint8)].reshape(len(a), len(b), 8).sum(axis=2)
+
+    best = None
+    for offset in range(-(len(a) - min_overlap), len(b) - min_overlap + 1):
+        mean_distance = float(np.diagonal(distances, offset=offset).mean())
+        if best is None or mean_distance < best[0]:
+            best = (mean_distance, offset)
+    return best
@@ -2,18 +2,51 @@ import cv2
 import numpy as np
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional, Iterator, Tuple
 import time
 
+from metrics import metrics
+from cancellation import Cancelled, check
+from profiling import current_trace, traced
+from process_memory import memory_tracker
+
 logger = logging.getLogger(__name__)
 
+# Default frame sampling and face detection parameters
+SAMPLES_PER_SECOND = 1
+FACE_CASCADE = 'haarcascade_frontalface_default.xml'
+DETECT_SCALE_FACTOR = 1.1
+DETECT_MIN_NEIGHBORS = 5
+DETECT_MIN_SIZE = 30
+FACE_MARGIN = 20
+FACE_SIZE = 224
+# Frame rate assumed for videos that don't report one
+UNKNOWN_FPS = 30.0
+
 class VideoProcessor:
-    def __init__(self):
+    def __init__(self, samples_per_second: int = SAMPLES_PER_SECOND, scale_factor: float = DETECT_SCALE_FACTOR,
+                 min_neighbors: int = DETECT_MIN_NEIGHBORS, min_face_size: int = DETECT_MIN_SIZE,
+                 face_margin: int = FACE_MARGIN, face_size: int = FACE_SIZE):
         """
         Initialize the video processor with face detection model
+        
+        Args:
+            samples_per_second: Number of frames sampled per second of video
+            scale_factor: Scale step of the face detector
+            min_neighbors: Detections needed to accept a face
+            min_face_size: Smallest face (in pixels) the detector looks for
+            face_margin: Margin (in pixels) added around detected faces
+            face_size: Side length of the square face crops
         """
+        self.samples_per_second = samples_per_second
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_face_size = min_face_size
+        self.face_margin = face_margin
+        self.face_size = face_size
+        
         # Load face detection model
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + FACE_CASCADE)
         
         # Directory for saving processed frames
         self.processed_dir = "processed"
@@ -21,13 +54,37 @@ class VideoProcessor:
         
         logger.info("VideoProcessor initialized")
     
-    def process_video(self, video_path: str) -> Optional[Dict[str, Any]]:
+    def config(self) -> Dict[str, Any]:
+        """
+        Get the parameters that affect the extracted data (part of the result cache scope)
+        """
+        return {
+            "samples_per_second": self.samples_per_second,
+            "face_cascade": FACE_CASCADE,
+            "scale_factor": self.scale_factor,
+            "min_neighbors": self.min_neighbors,
+            "min_face_size": self.min_face_size,
+            "face_margin": self.face_margin,
+            "face_size": self.face_size
+        }
+    
+    @traced("process_video")
+    def process_video(self, video_path: str, progress_callback: Optional[Callable[[float], None]] = None,
+                      face_callback: Optional[Callable[[np.ndarray], None]] = None,
+                      frame_callback: Optional[Callable[[float, np.ndarray], None]] = None) -> Optional[Dict[str, Any]]:
         """
         Process a video file:
         1. Extract frames at regular intervals
         2. Detect faces in each frame
         3. Extract audio features
         4. Return processed data for model input
+        
+        Args:
+            video_path: Path to the video file
+            progress_callback: Optional function called with the fraction of the video processed
+            face_callback: Optional function called with each face crop as it is extracted
+            frame_callback: Optional function called with the timestamp and image of
+                every decoded frame (e.g. FingerprintBuilder.add)
         """
         try:
             logger.info(f"Processing video: {video_path}")
@@ -41,55 +98,25 @@ class VideoProcessor:
             # Get video properties
             fps = cap.get(cv2.CAP_PROP_FPS)
             frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps
+            duration = frame_count / (fps if fps > 0 else UNKNOWN_FPS)
             
             logger.info(f"Video properties: {fps} fps, {frame_count} frames, {duration:.2f} seconds")
             
-            # Extract frames at regular intervals (1 frame per second)
-            frames = []
+            # Extract frames at regular intervals (samples_per_second)
+            sampled_count = 0
             face_frames = []
-            frame_interval = int(fps)
-            
-            frame_idx = 0
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                if frame_idx % frame_interval == 0:
-                    # Convert to grayscale for face detection
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    
-                    # Detect faces
-                    faces = self.face_cascade.detectMultiScale(
-                        gray, 
-                        scaleFactor=1.1, 
-                        minNeighbors=5,
-                        minSize=(30, 30)
-                    )
-                    
-                    # If faces found, save the largest face
-                    if len(faces) > 0:
-                        # Find the largest face
-                        largest_face_idx = np.argmax([w*h for (x, y, w, h) in faces])
-                        x, y, w, h = faces[largest_face_idx]
-                        
-                        # Extract face ROI with some margin
-                        margin = 20
-                        x_start = max(0, x - margin)
-                        y_start = max(0, y - margin)
-                        x_end = min(frame.shape[1], x + w + margin)
-                        y_end = min(frame.shape[0], y + h + margin)
-                        
-                        face_roi = frame[y_start:y_end, x_start:x_end]
-                        
-                        # Resize to standard size for model input
-                        face_roi = cv2.resize(face_roi, (224, 224))
-                        face_frames.append(face_roi)
-                    
-                    frames.append(frame)
-                
-                frame_idx += 1
+            face_boxes = []
+            face_timestamps = []
+            for timestamp, face in self._iter_sampled_faces(cap, fps, frame_callback):
+                sampled_count += 1
+                if progress_callback is not None and duration > 0:
+                    progress_callback(min(1.0, timestamp / duration))
+                if face is not None:
+                    face_frames.append(face[0])
+                    face_boxes.append(face[1])
+                    face_timestamps.append(timestamp)
+                    if face_callback is not None:
+                        face_callback(face[0])
             
             cap.release()
             
@@ -98,15 +125,18 @@ class VideoProcessor:
                 logger.warning("No faces detected in the video")
                 return None
             
-            logger.info(f"Extracted {len(frames)} frames and {len(face_frames)} face frames")
+            logger.info(f"Extracted {sampled_count} frames and {len(face_frames)} face frames")
             
             # Extract audio features (in a real implementation, we would use a library like librosa)
             # For this example, we'll simulate audio features
-            audio_features = self._extract_audio_features(video_path)
+            with metrics.span("feature_extraction"):
+                audio_features = self._extract_audio_features(video_path)
             
             # Prepare the processed data
             processed_data = {
                 "face_frames": face_frames,
+                "face_boxes": np.array(face_boxes, dtype=np.int32),
+                "face_timestamps": np.array(face_timestamps, dtype=np.float32),
                 "audio_features": audio_features,
                 "metadata": {
                     "fps": fps,
@@ -117,10 +147,134 @@ class VideoProcessor:
             
             return processed_data
             
+        except Cancelled:
+            raise
         except Exception as e:
             logger.error(f"Error processing video: {str(e)}")
             return None
     
+    def iter_face_frames(self, video_path: str) -> Iterator[np.ndarray]:
+        """
+        Lazily yield the face crops of a video, one sampled frame at a time
+        
+        Unlike process_video, nothing is accumulated, so this can be combined with
+        Predictor.predict_stream to analyse arbitrarily long recordings.
+        
+        Args:
+            video_path: Path to the video file
+            
+        Yields:
+            224x224 BGR face crops
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            logger.error(f"Error opening video file: {video_path}")
+            return
+        
+        try:
+            for _, face in self._iter_sampled_faces(cap, cap.get(cv2.CAP_PROP_FPS)):
+                if face is not None:
+                    yield face[0]
+        finally:
+            cap.release()
+    
+    def _iter_sampled_faces(self, cap, fps: float, frame_callback: Optional[Callable[[float, np.ndarray], None]] = None
+                            ) -> Iterator[Tuple[float, Optional[Tuple[np.ndarray, Tuple[int, int, int, int]]]]]:
+        """
+        Read frames from an open capture and detect the largest face in every sampled frame
+        
+        Args:
+            cap: Opened cv2.VideoCapture
+            fps: Frame rate of the video
+            frame_callback: Optional function called with the timestamp and image of every decoded frame
+            
+        Yields:
+            (timestamp in seconds, face) for each sampled frame, where face is
+            the result of _detect_face (None if the frame has no face)
+        """
+        # Sampling and timestamps of videos with an unknown frame rate assume UNKNOWN_FPS
+        if not fps > 0:
+            fps = UNKNOWN_FPS
+        frame_interval = max(1, int(fps / self.samples_per_second))
+        
+        frame_idx = 0
+        # Time spent decoding and detecting faces, recorded once per video (and per frame when traced)
+        decode_seconds = 0.0
+        detect_seconds = 0.0
+        trace = current_trace()
+        # Memory is sampled once around all of it (per frame would cost more than it tells)
+        memory = memory_tracker.begin_stage()
+        try:
+            while cap.isOpened():
+                started = time.perf_counter()
+                ret, frame = cap.read()
+                seconds = time.perf_counter() - started
+                decode_seconds += seconds
+                if trace is not None:
+                    trace.add("decode", time.time() - seconds, seconds, {"frame": frame_idx})
+                if not ret:
+                    break
+                if frame_callback is not None:
+                    frame_callback(frame_idx / fps, frame)
+                
+                if frame_idx % frame_interval == 0:
+                    check()
+                    started = time.perf_counter()
+                    face = self._detect_face(frame)
+                    seconds = time.perf_counter() - started
+                    detect_seconds += seconds
+                    if trace is not None:
+                        trace.add("face_detection", time.time() - seconds, seconds,
+                                  {"frame": frame_idx, "face": face is not None})
+                    yield frame_idx / fps, face
+                
+                frame_idx += 1
+        finally:
+            metrics.record("decode", decode_seconds)
+            metrics.record("face_detection", detect_seconds)
+            if memory is not None:
+                for source, growth in memory_tracker.end_stage(memory).items():
+                    metrics.inc("stage_memory_growth_bytes_total", growth, stage="face_extraction", source=source)
+    
+    def _detect_face(self, frame: np.ndarray) -> Optional[Tuple[np.ndarray, Tuple[int, int, int, int]]]:
+        """
+        Detect the largest face in a frame and crop it
+        
+        Returns:
+            The face_size x face_size crop (with margin) and its box in the frame
+            as (x_start, y_start, x_end, y_end), or None if no face was found
+        """
+        # Convert to grayscale for face detection
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        
+        # Detect faces
+        faces = self.face_cascade.detectMultiScale(
+            gray, 
+            scaleFactor=self.scale_factor, 
+            minNeighbors=self.min_neighbors,
+            minSize=(self.min_face_size, self.min_face_size)
+        )
+        
+        if len(faces) == 0:
+            return None
+        
+        # Find the largest face
+        largest_face_idx = np.argmax([w*h for (x, y, w, h) in faces])
+        x, y, w, h = faces[largest_face_idx]
+        
+        # Extract face ROI with some margin
+        margin = self.face_margin
+        x_start = max(0, x - margin)
+        y_start = max(0, y - margin)
+        x_end = min(frame.shape[1], x + w + margin)
+        y_end = min(frame.shape[0], y + h + margin)
+        
+        face_roi = frame[y_start:y_end, x_start:x_end]
+        
+        # Resize to standard size for model input
+        box = (int(x_start), int(y_start), int(x_end), int(y_end))
+        return cv2.resize(face_roi, (self.face_size, self.face_size)), box
+    
     def _extract_audio_features(self, video_path: str) -> np.ndarray:
         """
         Extract audio features from the video
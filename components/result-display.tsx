@@ -9,6 +9,7 @@ import { AlertTriangle, CheckCircle2, BarChart3, AudioWaveformIcon as Waveform,
 import { Tooltip, TooltipTrigger, TooltipContent, TooltipProvider } from "@/components/ui/tooltip"
 import { motion, AnimatePresence } from "framer-motion"
 import { toast } from "sonner"
+import type { ProvisionalResult } from "@/lib/api"
 
 type ResultProps = {
   result: {
@@ -515,3 +516,37 @@ export function ResultDisplay({ result, onReset }: ResultProps) {
     </motion.div>
   )
 }
+
+type ProvisionalVerdictProps = {
+  partial: ProvisionalResult
+}
+
+// Running verdict shown while a video is still being analyzed
+export function ProvisionalVerdict({ partial }: ProvisionalVerdictProps) {
+  const verdict = partial.prediction
+  if (!verdict) {
+    return null
+  }
+  const isTruth = verdict.prediction === "Truth"
+
+  return (
+    <motion.div
+      className={`px-4 py-3 rounded-lg border text-sm flex items-center justify-between gap-3 ${
+        isTruth
+          ? "bg-green-50 border-green-200 text-green-800 dark:bg-green-900/20 dark:border-green-900/30 dark:text-green-300"
+          : "bg-red-50 border-red-200 text-red-800 dark:bg-red-900/20 dark:border-red-900/30 dark:text-red-300"
+      }`}
+      initial={{ opacity: 0, y: 5 }}
+      animate={{ opacity: 1, y: 0 }}
+      transition={{ duration: 0.3 }}
+    >
+      <span className="flex items-center gap-2 font-medium">
+        {isTruth ? <CheckCircle2 className="h-4 w-4" /> : <AlertTriangle className="h-4 w-4" />}
+        Provisional: {isTruth ? "Truth" : "Deception"} detected ({verdict.confidence.toFixed(1)}%)
+      </span>
+      <span className="text-xs opacity-75">
+        {partial.faces} faces, vote {partial.vote.truth}:{partial.vote.lie}
+      </span>
+    </motion.div>
+  )
+}
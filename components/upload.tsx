@@ -7,8 +7,8 @@ import { Button } from "@/components/ui/button"
 import { Progress } from "@/components/ui/progress"
 import { Card } from "@/components/ui/card"
 import { Loader2, UploadCloud, AlertTriangle, CheckCircle2, Info, Calendar, Award, FileCode, Video, FileVideo } from "lucide-react"
-import { ResultDisplay } from "./result-display"
-import { uploadVideo, LieDetectionResult, checkApiAvailability, getModelStatus } from "@/lib/api"
+import { ResultDisplay, ProvisionalVerdict } from "./result-display"
+import { uploadVideo, LieDetectionResult, ProvisionalResult, checkApiAvailability, getModelStatus } from "@/lib/api"
 import { Alert, AlertDescription } from "./ui/alert"
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from "./ui/tooltip"
 import { Badge } from "./ui/badge"
@@ -19,6 +19,7 @@ export function Upload() {
   const [file, setFile] = useState<File | null>(null)
   const [uploading, setUploading] = useState(false)
   const [uploadProgress, setUploadProgress] = useState(0)
+  const [provisional, setProvisional] = useState<ProvisionalResult | null>(null)
   const [processing, setProcessing] = useState(false)
   const [result, setResult] = useState<null | {
     prediction: "Truth" | "Fake"
@@ -121,6 +122,7 @@ export function Upload() {
     try {
       setUploading(true)
       setUploadProgress(0)
+      setProvisional(null)
       toast.info("Analyzing video...", { duration: 3000 })
 
       // Set up upload progress tracking
@@ -135,7 +137,12 @@ export function Upload() {
 
       try {
         // Upload the video to our backend API
-        const apiResult = await uploadVideo(file)
+        const apiResult = await uploadVideo(file, (job) => {
+          setUploadProgress((prev) => Math.max(prev, Math.round(job.progress * 95)))
+        }, (partial) => {
+          setProvisional(partial)
+          setUploadProgress((prev) => Math.max(prev, Math.round(partial.progress * 95)))
+        })
         
         clearInterval(interval)
         setUploadProgress(100)
@@ -192,6 +199,7 @@ export function Upload() {
     setUploading(false)
     setProcessing(false)
     setUploadProgress(0)
+    setProvisional(null)
     if (fileInputRef.current) {
       fileInputRef.current.value = ""
     }
@@ -427,6 +435,7 @@ export function Upload() {
                          uploadProgress < 60 ? "Extracting features..." : 
                          uploadProgress < 90 ? "Running AI analysis..." : "Finalizing results..."}
                       </div>
+                      {provisional && <ProvisionalVerdict partial={provisional} />}
                     </motion.div>
                   )}
 
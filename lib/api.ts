@@ -14,28 +14,148 @@ export type LieDetectionResult = {
   }
 }
 
+export type AnalysisJob = {
+  job_id: string;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  progress: number;  // 0 to 1
+  stage: string | null;
+  filename: string | null;
+  priority: 'interactive' | 'batch';
+  created_at: string;
+  started_at: string | null;
+  finished_at: string | null;
+  result?: LieDetectionResult;  // Set once the job is done
+  error?: string;  // Set if the job failed
+}
+
+// Provisional result published while a long video is analyzed
+export type ProvisionalResult = {
+  progress: number;  // 0 to 1
+  stage: string;
+  frames_processed: number;
+  faces: number;
+  vote: { truth: number; lie: number };  // Micro-expression vote over the faces so far
+  segment: {  // Latest model output
+    start_frame: number;
+    end_frame: number;
+    prediction: 'Truth' | 'Fake';
+    confidence: number;
+  } | null;
+  prediction: {  // Running combined verdict
+    prediction: 'Truth' | 'Fake';
+    confidence: number;
+    faces: number;
+    is_dummy_model: boolean;
+  } | null;
+}
+
+// Longest time a single /results request waits for a job to finish (seconds)
+const RESULT_POLL_WAIT = 25;
+// Attempts at an upload the backend turns away because its queue is full,
+// and the longest pause between them (seconds)
+const MAX_UPLOAD_ATTEMPTS = 3;
+const MAX_RETRY_AFTER = 30;
+
+/**
+ * Get the status of an analysis job, waiting up to `wait` seconds for it to finish
+ */
+export async function getJob(jobId: string, wait: number = 0): Promise<AnalysisJob> {
+  const response = await fetch(`${API_BASE_URL}/results/${jobId}?wait=${wait}`, {
+    method: 'GET',
+    headers: { 'Accept': 'application/json' },
+    cache: 'no-cache',
+  });
+  
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(errorData.detail || 'Failed to get analysis job');
+  }
+  
+  return await response.json();
+}
+
+/**
+ * Subscribe to the provisional results of an analysis job (Server-Sent Events)
+ *
+ * Returns a function that closes the subscription. The browser reconnects
+ * on its own if the connection drops, resuming after the last event seen.
+ */
+export function subscribeToPartialResults(
+  jobId: string,
+  onPartial: (partial: ProvisionalResult) => void
+): () => void {
+  if (typeof EventSource === 'undefined') {
+    return () => {};
+  }
+  const source = new EventSource(`${API_BASE_URL}/results/${jobId}/events`);
+  source.addEventListener('partial', (event) => {
+    onPartial(JSON.parse((event as MessageEvent).data));
+  });
+  // The stream ends with the finished job; the long poll picks up the result
+  const close = () => source.close();
+  source.addEventListener('done', close);
+  source.addEventListener('failed', close);
+  return close;
+}
+
 /**
  * Upload a video file and get lie detection results
+ *
+ * The backend queues the analysis and returns a job, which is long-polled
+ * until it has finished. onProgress is called with every job update, and
+ * onPartial with every provisional result while the video is analyzed.
+ * Uploads rejected because the backend is busy (429/503) are retried after
+ * the delay it asks for.
  */
-export async function uploadVideo(file: File): Promise<LieDetectionResult> {
+export async function uploadVideo(
+  file: File,
+  onProgress?: (job: AnalysisJob) => void,
+  onPartial?: (partial: ProvisionalResult) => void
+): Promise<LieDetectionResult> {
+  let unsubscribe: (() => void) | undefined;
   try {
     const formData = new FormData();
     formData.append('file', file);
     
-    const response = await fetch(`${API_BASE_URL}/upload`, {
-      method: 'POST',
-      body: formData,
-    });
+    let response: Response;
+    for (let attempt = 1; ; attempt++) {
+      response = await fetch(`${API_BASE_URL}/upload`, {
+        method: 'POST',
+        body: formData,
+      });
+      if ((response.status !== 429 && response.status !== 503) || attempt >= MAX_UPLOAD_ATTEMPTS) {
+        break;
+      }
+      const retryAfter = Math.min(Number(response.headers.get('Retry-After')) || 5, MAX_RETRY_AFTER);
+      console.log(`Backend busy, retrying upload in ${retryAfter}s`);
+      await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+    }
     
     if (!response.ok) {
       const errorData = await response.json();
       throw new Error(errorData.detail || 'Failed to upload video');
     }
     
-    return await response.json();
+    let job: AnalysisJob = await response.json();
+    if (onPartial && (job.status === 'queued' || job.status === 'running')) {
+      unsubscribe = subscribeToPartialResults(job.job_id, onPartial);
+    }
+    while (job.status === 'queued' || job.status === 'running') {
+      onProgress?.(job);
+      job = await getJob(job.job_id, RESULT_POLL_WAIT);
+    }
+    onProgress?.(job);
+    
+    if (job.status === 'failed' || !job.result) {
+      throw new Error(job.error || 'Video analysis failed');
+    }
+    
+    return job.result;
   } catch (error) {
     console.error('Error uploading video:', error);
     throw error;
+  } finally {
+    unsubscribe?.();
   }
 }
 